@@ -0,0 +1,110 @@
+""" Adaptive resolution part of the project
+This script chooses the working resolution of the warp, background removal and circle detection so that the
+detection stays within a latency budget (for example when the Raspberry Pi is thermally throttled). The final
+scoring picture is always analysed at full resolution
+"""
+
+import math
+from scripts import parameters as p
+
+# smoothing factor of the measured latency (0-1, higher = faster reaction)
+LATENCY_SMOOTHING = 0.3
+
+# the scale is rounded to this step so that only a few working resolutions are used
+SCALE_STEP = 0.05
+
+# maximum change of the scale between two frames
+MAX_SCALE_CHANGE = 1.25
+
+# stages of the detection working at the scale (see scriptDP.detectBallTags), the tag detection works on the camera
+# frame and its duration is taken from the budget
+SCALED_STAGES = ("warp", "background", "circles")
+
+# smallest share of the budget left to the scaled stages when the tag detection is slow
+MIN_BUDGET_SHARE = 0.2
+
+
+# FUNCTION to create a resolution controller
+def newController(budget=None, minScale=None, params=p):
+    """ FUNCTION to create a resolution controller
+
+    Source : Mulnard T.
+
+    :param budget: float : target latency of the detection in seconds (default : parameter latency_budget_ms)
+    :param minScale: float : smallest working scale (default : parameter adaptive_min_scale)
+    :param params: parameters of the table (default : parameters module)
+    :return: dictionary : state of the controller
+    """
+    return {"budget": params.latencyBudget if budget is None else budget,
+            "minScale": params.minScale if minScale is None else minScale,
+            "scale": 1.0,
+            "latency": None,
+            "changes": 0}
+
+
+# FUNCTION to update the controller with the latency of the last frame
+def updateController(controller, latency, scale, fixed=0.0):
+    """ FUNCTION to update the controller with the latency of the last frame
+
+    The time of the scaled stages is about proportional to the number of pixels, so the scale is corrected by the
+    square root of the ratio between their share of the budget and their smoothed latency measured at that scale.
+
+    Source : Mulnard T.
+
+    :param controller: dictionary : state of the controller coming from newController
+    :param latency: float : duration of the scaled stages of the last frame in seconds (see SCALED_STAGES)
+    :param scale: float : scale used for the last frame
+    :param fixed: float : duration of the stages which do not follow the scale (tag detection) in seconds
+    :return: float : scale to use for the next frame
+    """
+    # latency expected at the current scale, from the latency measured at the scale of the frame
+    latency *= (controller["scale"] / scale) ** 2
+    if controller["latency"] is None:
+        controller["latency"] = latency
+    else:
+        controller["latency"] += LATENCY_SMOOTHING * (latency - controller["latency"])
+
+    budget = max(controller["budget"] - fixed, MIN_BUDGET_SHARE * controller["budget"])
+    wanted = controller["scale"] * math.sqrt(budget / max(controller["latency"], 1e-6))
+    wanted = min(max(wanted, controller["scale"] / MAX_SCALE_CHANGE), controller["scale"] * MAX_SCALE_CHANGE)
+    wanted = min(max(round(round(wanted / SCALE_STEP) * SCALE_STEP, 2), controller["minScale"]), 1.0)
+
+    if wanted != controller["scale"]:
+        # the smoothed latency follows the new scale
+        controller["latency"] *= (wanted / controller["scale"]) ** 2
+        controller["scale"] = wanted
+        controller["changes"] += 1
+
+    return controller["scale"]
+
+
+# FUNCTION to update the controller with the stage timings of the last frame
+def updateTimings(controller, timings, scale):
+    """ FUNCTION to update the controller with the stage timings of the last frame (see scriptDP.detectBallFrame) : the
+    scaled stages give the latency and the tag detection the fixed part, a frame without tags is skipped
+
+    Source : Mulnard T.
+
+    :param controller: dictionary : state of the controller coming from newController
+    :param timings: dictionary : duration (seconds) of each stage of the last frame
+    :param scale: float : scale used for the last frame
+    :return: float : scale to use for the next frame
+    """
+    if any(stage not in timings for stage in SCALED_STAGES):
+        return controller["scale"]
+    return updateController(controller, sum(timings[stage] for stage in SCALED_STAGES), scale,
+                            timings.get("tags", 0.0))
+
+
+# FUNCTION to scale a length parameter to the working resolution
+def scaled(value, scale, minimum=1):
+    """ FUNCTION to scale a length parameter (radius, distance, offset) to the working resolution
+
+    Source : Mulnard T.
+
+    :param value: integer : value at full resolution
+    :param scale: float : working scale
+    :param minimum: integer : smallest returned value
+    :return: integer : value at the working resolution
+    """
+    return max(int(round(value * scale)), minimum)
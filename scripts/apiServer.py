@@ -0,0 +1,335 @@
+""" Local API part of the project
+This script runs an optional local server (asyncio thread, no extra library) so that a tablet or a scoreboard can
+follow the play without OpenCV :
+ - GET /ws : WebSocket stream of the detections, tag status, game events and stage timings (json messages)
+ - GET /state : last value of every topic
+ - POST /command : command for the program (start_drill, recalibrate, set_radius)
+The vision loop only replaces the last value of a topic, it never waits for the clients. A slow client skips the
+intermediate values and always receives the newest one.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import queue
+import struct
+import threading
+import time
+from scripts import parameters as p
+
+# accepted commands and the types of their mandatory arguments
+COMMANDS = {"start_drill": {"drill": (int, str)}, "recalibrate": {}, "set_radius": {"radius": (int,)}}
+
+# accepted range of the integer arguments (the games of the menu, same radius as parameters.setZoneRadius)
+ARGUMENT_RANGES = {"drill": (1, 3), "radius": (1, 5000)}
+
+# magic string of the WebSocket handshake (RFC 6455)
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+serverLoop = None
+serverThread = None
+newEvent = None
+
+# last message of each topic : topic -> (sequence number, json message)
+latestEvents = {}
+eventCounter = 0
+notifyPending = False
+
+# commands received from the clients, read by the main program
+commandQueue = queue.Queue()
+
+
+# FUNCTION to start the local server in a background thread
+def startServer(port=p.apiPort, host=p.apiHost):
+    """ FUNCTION to start the local server in a background thread
+
+    Source : Mulnard T. and https://docs.python.org/3/library/asyncio-stream.html
+
+    :param port: integer : port of the server
+    :param host: string : address to listen on ('127.0.0.1' for this computer only, '0.0.0.0' for the whole local
+                 network : the commands are not authenticated)
+    :return: nothing
+    """
+    global serverLoop, serverThread
+    if serverThread is not None:
+        return
+
+    serverLoop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        global newEvent
+        asyncio.set_event_loop(serverLoop)
+        newEvent = asyncio.Condition()
+        server = serverLoop.run_until_complete(asyncio.start_server(__handleClient, host, port))
+        started.set()
+        try:
+            serverLoop.run_forever()
+        finally:
+            # closing the connections still open before closing the loop
+            server.close()
+            tasks = asyncio.all_tasks(serverLoop)
+            for task in tasks:
+                task.cancel()
+            serverLoop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            serverLoop.close()
+
+    serverThread = threading.Thread(target=run, name="apiServer", daemon=True)
+    serverThread.start()
+    started.wait(5)
+    print("   > API server listening on {}:{}".format(host, port))
+
+
+# FUNCTION to stop the local server
+def stopServer():
+    """ FUNCTION to stop the local server
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    global serverLoop, serverThread
+    if serverThread is None:
+        return
+    serverLoop.call_soon_threadsafe(serverLoop.stop)
+    serverThread.join(5)
+    serverLoop = None
+    serverThread = None
+
+
+# FUNCTION to publish the new value of a topic
+def publish(topic, data):
+    """ FUNCTION to publish the new value of a topic (never blocks, does nothing if the server is not running)
+
+    Source : Mulnard T.
+
+    :param topic: string : name of the topic (detections, tags, game, timings...)
+    :param data: dictionary : content of the message (json serializable, numpy numbers are converted)
+    :return: nothing
+    """
+    if serverLoop is None:
+        return
+    message = json.dumps({"topic": topic, "time": time.time(), "data": data}, default=__toJson)
+    serverLoop.call_soon_threadsafe(__storeEvent, topic, message)
+
+
+# FUNCTION to get the next command sent by a client
+def nextCommand(timeout=None):
+    """ FUNCTION to get the next command sent by a client
+
+    Source : Mulnard T.
+
+    :param timeout: float : maximum waiting time in seconds (None = wait forever)
+    :return: dictionary : command and its arguments, None if there is no command
+    """
+    try:
+        return commandQueue.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+
+# PRIVATE FUNCTION to convert the numpy values for json
+def __toJson(value):
+    """ PRIVATE FUNCTION to convert the numpy values (and other numbers) for json
+
+    :param value: value not handled by json
+    :return: python value
+    """
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+# PRIVATE FUNCTION to store the last message of a topic and wake up the clients
+def __storeEvent(topic, message):
+    """ PRIVATE FUNCTION to store the last message of a topic and wake up the clients (server thread)
+
+    :param topic: string : name of the topic
+    :param message: string : json message
+    """
+    global eventCounter, notifyPending
+    eventCounter += 1
+    latestEvents[topic] = (eventCounter, message)
+
+    # only one wake up is scheduled for a burst of messages
+    async def notify():
+        global notifyPending
+        async with newEvent:
+            notifyPending = False
+            newEvent.notify_all()
+    if not notifyPending:
+        notifyPending = True
+        asyncio.ensure_future(notify())
+
+
+# PRIVATE FUNCTION to check and queue a command
+def __queueCommand(command):
+    """ PRIVATE FUNCTION to check and queue a command
+
+    :param command: dictionary : command and its arguments
+    :return: string : error message, empty if the command is accepted
+    """
+    if not isinstance(command, dict) or command.get("command") not in COMMANDS:
+        return "unknown command, accepted commands are : " + ", ".join(COMMANDS)
+    missing = [argument for argument in COMMANDS[command["command"]] if argument not in command]
+    if missing:
+        return "missing argument(s) : " + ", ".join(missing)
+    for argument, types in COMMANDS[command["command"]].items():
+        value = command[argument]
+        if isinstance(value, bool) or not isinstance(value, types):
+            return "argument '{}' must be of type {}".format(argument, " or ".join(kind.__name__ for kind in types))
+        if isinstance(value, int) and argument in ARGUMENT_RANGES and \
+                not ARGUMENT_RANGES[argument][0] <= value <= ARGUMENT_RANGES[argument][1]:
+            return "argument '{}' must be between {} and {}".format(argument, *ARGUMENT_RANGES[argument])
+    commandQueue.put(command)
+    return ""
+
+
+# PRIVATE FUNCTION to handle a connection
+async def __handleClient(reader, writer):
+    """ PRIVATE FUNCTION to handle a connection (HTTP request or WebSocket stream)
+
+    :param reader: asyncio stream reader
+    :param writer: asyncio stream writer
+    """
+    try:
+        requestLine = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if len(requestLine) < 2:
+            return
+        method, path = requestLine[0], requestLine[1]
+
+        if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+            if "sec-websocket-key" in headers:
+                await __streamEvents(reader, writer, headers["sec-websocket-key"])
+            else:
+                await __sendHttp(writer, 400, json.dumps({"error": "missing Sec-WebSocket-Key header"}))
+        elif method == "GET" and path == "/state":
+            state = "{" + ", ".join('"{}": {}'.format(topic, message) for topic, (_, message) in
+                                    sorted(latestEvents.items())) + "}"
+            await __sendHttp(writer, 200, state)
+        elif method == "POST" and path == "/command":
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            try:
+                error = __queueCommand(json.loads(body or b"null"))
+            except ValueError:
+                error = "the command must be a json object"
+            await __sendHttp(writer, 400 if error else 202, json.dumps({"error": error} if error else {"ok": True}))
+        else:
+            await __sendHttp(writer, 404, json.dumps({"error": "use GET /ws, GET /state or POST /command"}))
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+        # client gone or server stopped
+        pass
+    finally:
+        writer.close()
+
+
+# PRIVATE FUNCTION to send an HTTP answer
+async def __sendHttp(writer, status, body):
+    """ PRIVATE FUNCTION to send an HTTP answer with a json body
+
+    :param writer: asyncio stream writer
+    :param status: integer : HTTP status code
+    :param body: string : json body
+    """
+    reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found"}
+    data = body.encode()
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                 "Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".format(status, reasons[status],
+                                                                                       len(data)).encode() + data)
+    await writer.drain()
+
+
+# PRIVATE FUNCTION to send a WebSocket text frame
+def __wsFrame(message, opcode=0x1):
+    """ PRIVATE FUNCTION to build a WebSocket frame (server frames are not masked)
+
+    :param message: string or bytes : payload
+    :param opcode: integer : 0x1 text, 0x8 close, 0xA pong
+    :return: bytes : frame
+    """
+    data = message.encode() if isinstance(message, str) else message
+    if len(data) < 126:
+        header = struct.pack("!BB", 0x80 | opcode, len(data))
+    elif len(data) < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+    return header + data
+
+
+# PRIVATE FUNCTION to read the frames sent by a WebSocket client
+async def __readFrames(reader, writer):
+    """ PRIVATE FUNCTION to read the frames sent by a WebSocket client (commands, ping and close)
+
+    :param reader: asyncio stream reader
+    :param writer: asyncio stream writer
+    """
+    while True:
+        first, second = await reader.readexactly(2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length)))
+
+        if opcode == 0x8:
+            writer.write(__wsFrame(b"", 0x8))
+            return
+        elif opcode == 0x9:
+            writer.write(__wsFrame(payload, 0xA))
+        elif opcode == 0x1:
+            try:
+                error = __queueCommand(json.loads(payload))
+            except ValueError:
+                error = "the command must be a json object"
+            if error:
+                writer.write(__wsFrame(json.dumps({"topic": "error", "data": error})))
+
+
+# PRIVATE FUNCTION to stream the events to a WebSocket client
+async def __streamEvents(reader, writer, key):
+    """ PRIVATE FUNCTION to stream the events to a WebSocket client (latest value of each topic)
+
+    Source : Mulnard T. and https://datatracker.ietf.org/doc/html/rfc6455
+
+    :param reader: asyncio stream reader
+    :param writer: asyncio stream writer
+    :param key: string : Sec-WebSocket-Key of the client
+    """
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    writer.write("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 "Sec-WebSocket-Accept: {}\r\n\r\n".format(accept).encode())
+    await writer.drain()
+
+    readTask = asyncio.ensure_future(__readFrames(reader, writer))
+    lastSent = 0
+    try:
+        while not readTask.done():
+            # sending the newest message of each topic changed since the last loop
+            newMessages = sorted(event for event in latestEvents.values() if event[0] > lastSent)
+            for counter, message in newMessages:
+                writer.write(__wsFrame(message))
+                lastSent = max(lastSent, counter)
+            if newMessages:
+                await writer.drain()
+                continue
+
+            # waiting for a new message (the timeout is used to see if the client has left)
+            async with newEvent:
+                try:
+                    await asyncio.wait_for(newEvent.wait_for(lambda: eventCounter > lastSent), 1)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        readTask.cancel()
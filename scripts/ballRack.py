@@ -0,0 +1,230 @@
+""" Ball rack part of the project
+This script follows a full rack of balls, with several balls of the same color : the circles detected in a frame
+(structured array, see imgProcess.circleDetection) are assigned to the expected balls of the rack with a cost matrix
+(distance to the last position of each ball, with a penalty for another color). The assignment uses scipy when it is
+installed, and a greedy assignment on the sorted costs otherwise
+"""
+
+import cv2
+import numpy as np
+import time
+from scripts import imgProcess, parameters as p
+
+# optional : optimal assignment (the greedy assignment is used without scipy)
+try:
+    from scipy.optimize import linear_sum_assignment
+except ModuleNotFoundError:
+    linear_sum_assignment = None
+
+# cost (pixels) added when the color of the detection is not the color of the ball
+COLOR_PENALTY = 1000
+
+# maximum distance (pixels) between the last position of a ball and its detection in the next frame
+MAX_DISTANCE = 150
+
+# cost of a forbidden pair
+FORBIDDEN = 1e9
+
+# ball of the rack : name (color and number), color, last position (nan if never seen) and if it is seen in the frame
+RACK_DTYPE = np.dtype([("name", "U12"), ("label", "U8"), ("x", np.float32), ("y", np.float32), ("seen", bool)])
+
+# radius (pixels) of the balls drawn by the benchmark
+BALL_RADIUS = 30
+
+# colors (BGR) of the balls drawn by the benchmark
+BALL_COLORS = {"WHITE": (235, 235, 235), "YELLOW": (40, 200, 230), "RED": (30, 40, 200), "BLUE": (200, 40, 40)}
+
+
+# FUNCTION to create a rack
+def newRack(labels, positions=None):
+    """ FUNCTION to create a rack (the balls of the same color are numbered : RED1, RED2...)
+
+    Source : Mulnard T.
+
+    :param labels: list of strings : color of each ball
+    :param positions: list of tuples : known position (x, y) of each ball, None if unknown
+    :return: structured array of the balls (RACK_DTYPE)
+    """
+    rack = np.zeros(len(labels), dtype=RACK_DTYPE)
+    counts = {}
+    for index, label in enumerate(labels):
+        counts[label] = counts.get(label, 0) + 1
+        rack[index]["name"] = "{}{}".format(label, counts[label]) if labels.count(label) > 1 else label
+    rack["label"] = labels
+    rack["x"], rack["y"] = (np.nan, np.nan) if positions is None else np.array(positions, dtype=np.float32).T
+    return rack
+
+
+# FUNCTION to build the cost matrix between the balls and the detections
+def costMatrix(rack, detections, maxDistance=MAX_DISTANCE):
+    """ FUNCTION to build the cost matrix between the balls of the rack and the detections
+
+    A ball never seen can take any detection of its color (no distance cost). A detection too far from a known ball
+    is forbidden for this ball.
+
+    Source : Mulnard T.
+
+    :param rack: structured array of the balls (RACK_DTYPE)
+    :param detections: structured array of the detections (imgProcess.BALL_DTYPE)
+    :param maxDistance: float : maximum distance (pixels) between a known ball and its detection
+    :return: array (balls, detections) : cost of each pair
+    """
+    distance = np.hypot(rack["x"][:, None] - detections["x"][None, :], rack["y"][:, None] - detections["y"][None, :])
+    unknown = np.isnan(distance)
+    cost = np.where(unknown, 0, distance)
+    cost += COLOR_PENALTY * (rack["label"][:, None] != detections["label"][None, :])
+    cost[~unknown & (distance > maxDistance)] = FORBIDDEN
+    return cost
+
+
+# FUNCTION to assign the pairs with the lowest costs first
+def greedyAssignment(cost):
+    """ FUNCTION to assign the pairs with the lowest costs first (each ball and each detection is used once)
+
+    Source : Mulnard T.
+
+    :param cost: array (balls, detections) : cost of each pair
+    :return: arrays : indices of the balls and of their detections
+    """
+    order = np.argsort(cost, axis=None, kind="stable")
+    rows, cols = np.unravel_index(order, cost.shape)
+    usedRows = np.zeros(cost.shape[0], dtype=bool)
+    usedCols = np.zeros(cost.shape[1], dtype=bool)
+    pairs = []
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if len(pairs) == min(cost.shape) or cost[row, col] >= FORBIDDEN:
+            break
+        if not usedRows[row] and not usedCols[col]:
+            usedRows[row] = usedCols[col] = True
+            pairs.append((row, col))
+    pairs = np.array(pairs, dtype=np.intp).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+# FUNCTION to assign the detections to the balls of the rack
+def assignBalls(rack, detections, maxDistance=MAX_DISTANCE, greedy=None):
+    """ FUNCTION to assign the detections of a frame to the balls of the rack and update their position
+
+    Source : Mulnard T. and https://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.linear_sum_assignment.html
+
+    :param rack: structured array of the balls (RACK_DTYPE), updated
+    :param detections: structured array of the detections (imgProcess.BALL_DTYPE)
+    :param maxDistance: float : maximum distance (pixels) between a known ball and its detection
+    :param greedy: boolean : force the greedy assignment (default : only without scipy)
+    :return: array : index of the detection of each ball (-1 if the ball is not seen)
+    """
+    assigned = np.full(len(rack), -1, dtype=np.intp)
+    rack["seen"] = False
+    if len(rack) == 0 or len(detections) == 0:
+        return assigned
+    cost = costMatrix(rack, detections, maxDistance)
+    if linear_sum_assignment is None or greedy:
+        rows, cols = greedyAssignment(cost)
+    else:
+        rows, cols = linear_sum_assignment(cost)
+        kept = cost[rows, cols] < FORBIDDEN
+        rows, cols = rows[kept], cols[kept]
+
+    assigned[rows] = cols
+    rack["x"][rows], rack["y"][rows] = detections["x"][cols], detections["y"][cols]
+    rack["seen"][rows] = True
+    return assigned
+
+
+# FUNCTION to get the positions of the seen balls
+def rackPositions(rack):
+    """ FUNCTION to get the positions of the balls seen in the last frame
+
+    Source : Mulnard T.
+
+    :param rack: structured array of the balls (RACK_DTYPE)
+    :return: dictionary : name and coordinates of the seen balls
+    """
+    return {str(ball["name"]): (int(ball["x"]), int(ball["y"])) for ball in rack[rack["seen"]]}
+
+
+# FUNCTION to draw a rack on an image without background
+def drawRack(labels, params=p, seed=0):
+    """ FUNCTION to draw the balls of a rack at random positions on a black image (image without background)
+
+    Source : Mulnard T.
+
+    :param labels: list of strings : color of each ball (key of BALL_COLORS)
+    :param params: parameters of the table (size of the warped image and of the black borders)
+    :param seed: integer : seed of the positions
+    :return: image array, array of the positions (x, y) of the balls
+    """
+    generator = np.random.default_rng(seed)
+    image = np.zeros((params.height, params.width, 3), dtype=np.uint8)
+    margin = params.bRectDist + params.bCircRad // 2 + BALL_RADIUS
+    positions = []
+    while len(positions) < len(labels):
+        position = generator.uniform((margin, margin), (params.width - margin, params.height - margin))
+        if all(np.hypot(*(position - other)) > 3 * BALL_RADIUS for other in positions):
+            positions.append(position)
+    positions = np.round(positions).astype(np.int32)
+    for label, (x, y) in zip(labels, positions.tolist()):
+        cv2.circle(image, (x, y), BALL_RADIUS, BALL_COLORS[label], -1)
+    return image, positions
+
+
+# FUNCTION to measure the detection and the assignment with more and more balls
+def benchmark(counts=(2, 4, 8, 12, 16, 22), repeat=10, params=p):
+    """ FUNCTION to measure the detection, the color identification and the assignment with more and more balls
+
+    Source : Mulnard T.
+
+    :param counts: list of integers : number of balls of each test
+    :param repeat: integer : number of measures of each test
+    :param params: parameters of the table
+    :return: list of dictionaries : number of balls, detected and well assigned balls, mean duration (milliseconds)
+             of the detection and of the assignment (scipy and greedy)
+    """
+    results = []
+    for count in counts:
+        # a rack of one white ball and the other balls shared between the colors
+        colors = ["YELLOW", "RED", "BLUE"]
+        labels = ["WHITE"] + [colors[index % len(colors)] for index in range(count - 1)]
+        image, positions = drawRack(labels, params, seed=count)
+        result = {"balls": count, "detect": 0.0, "assign": 0.0, "greedy": 0.0}
+
+        for _ in range(repeat):
+            timeStart = time.perf_counter()
+            detections = imgProcess.circleDetection(image.copy(), minRadius=15, maxRadius=70, imgDisplayOut=False,
+                                                    params=params, structured=True)[1]
+            result["detect"] += time.perf_counter() - timeStart
+
+            for method, greedy in (("assign", False), ("greedy", True)):
+                if method == "assign" and linear_sum_assignment is None:
+                    continue
+                # the last positions are slightly off, as after a small move of the balls
+                rack = newRack(labels, positions + 5)
+                timeStart = time.perf_counter()
+                assigned = assignBalls(rack, detections, greedy=greedy)
+                result[method] += time.perf_counter() - timeStart
+
+        result["detected"] = len(detections)
+        result["assigned"] = int(np.sum(np.hypot(rack["x"] - positions[:, 0], rack["y"] - positions[:, 1])[
+                                            assigned >= 0] < BALL_RADIUS / 2))
+        for method in ("detect", "assign", "greedy"):
+            result[method] = 1000 * result[method] / repeat if result[method] > 0 else None
+        results.append(result)
+    return results
+
+
+# FUNCTION to run the benchmark and print the results
+def showBenchmark(repeat=10):
+    """ FUNCTION to run the benchmark and print the results
+
+    Source : Mulnard T.
+
+    :param repeat: integer : number of measures of each test
+    :return: nothing
+    """
+    if linear_sum_assignment is None:
+        print("      > scipy not found, only the greedy assignment is measured")
+    for result in benchmark(repeat=repeat):
+        assign = "-" if result["assign"] is None else "{:6.3f} ms".format(result["assign"])
+        print("      > {:2d} balls : {:2d} detected, {:2d} well assigned | detection {:7.2f} ms | assignment {} | "
+              "greedy {:6.3f} ms".format(result["balls"], result["detected"], result["assigned"], result["detect"],
+                                         assign, result["greedy"]))
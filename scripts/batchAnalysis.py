@@ -0,0 +1,255 @@
+""" Batch analysis part of the project
+This script runs the ball detection over a folder of recorded frames (or a video) on a process pool, without any
+camera or projector, and writes one row per frame in a CSV file (and optionally in columnar numpy files).
+The CSV is written chunk by chunk, so an interrupted run can be resumed, and the frames can be shared between several
+machines with --shard
+
+Usage : python -m scripts.batchAnalysis assets/captures --out analysis.csv --workers 4 --shard 0/2 --resume
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import cv2
+import glob
+import numpy as np
+import os
+import time
+from scripts import parallelTiles, scriptDP, parameters as p
+
+# extensions of the image files of a capture folder
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# names of the balls (and targets) with position columns in the output
+BALL_NAMES = ["WHITE", "YELLOW", "RED", "BLUE", "CYAN", "BROWN"]
+
+# stages of the detection with a timing column in the output (milliseconds)
+STAGES = ["read", "tags", "warp", "background", "circles", "detect"]
+
+# columns of the output
+COLUMNS = (["frame", "tags", "balls"] + [name + axis for name in BALL_NAMES for axis in ("_x", "_y")]
+           + [stage + "_ms" for stage in STAGES])
+
+# number of frames sent at once to a worker
+CHUNK_FRAMES = 16
+
+# parameters of the table used by the workers (set by __initWorker)
+workerParams = None
+
+
+# FUNCTION to list the frames of a capture folder or of a video
+def listFrames(source):
+    """ FUNCTION to list the frames of a capture folder or of a video
+
+    Source : Mulnard T.
+
+    :param source: string : folder of images or path of a video
+    :return: list of strings : frame ids (path of the image, or 'video path#index')
+    """
+    if os.path.isdir(source):
+        return sorted(fileName for fileName in glob.glob(os.path.join(source, "*"))
+                      if fileName.lower().endswith(IMAGE_EXTENSIONS))
+
+    video = cv2.VideoCapture(source)
+    if not video.isOpened():
+        raise IOError("no frame found in '{}'".format(source))
+    count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    return ["{}#{}".format(source, index) for index in range(count)]
+
+
+# PRIVATE FUNCTION to prepare a worker of the process pool
+def __initWorker(paramPath):
+    """ PRIVATE FUNCTION to prepare a worker of the process pool
+
+    :param paramPath: string : path of the json parameters of the table
+    """
+    global workerParams
+    workerParams = p.loadParameters(paramPath)
+    # one process per core : OpenCV and the strips stay on the thread of the worker
+    workerParams.parallelWorkers = 1
+    parallelTiles.setThreadPolicy(2)
+    scriptDP.verbose = False
+
+
+# PRIVATE FUNCTION to read the frames of a chunk
+def __readFrames(frameIds):
+    """ PRIVATE FUNCTION to read the frames of a chunk (a video is opened once and only seeked between frames
+    which do not follow each other)
+
+    :param frameIds: list of strings : frame ids coming from listFrames
+    :return: generator of (frame id, image array or None, reading time in seconds)
+    """
+    video = None
+    nextIndex = -1
+    for frameId in frameIds:
+        timeStart = time.perf_counter()
+        if "#" in frameId and not os.path.exists(frameId):
+            videoPath, index = frameId.rsplit("#", 1)
+            if video is None:
+                video = cv2.VideoCapture(videoPath)
+            if int(index) != nextIndex:
+                video.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            nextIndex = int(index) + 1
+            image = video.read()[1]
+        else:
+            image = cv2.imread(frameId)
+        yield frameId, image, time.perf_counter() - timeStart
+
+    if video is not None:
+        video.release()
+
+
+# PRIVATE FUNCTION to analyse a chunk of frames in a worker
+def __analyseChunk(frameIds):
+    """ PRIVATE FUNCTION to analyse a chunk of frames in a worker
+
+    :param frameIds: list of strings : consecutive frame ids
+    :return: list of dictionaries : one row of the output per frame
+    """
+    rows = []
+    for frameId, image, readTime in __readFrames(frameIds):
+        row = dict.fromkeys(COLUMNS, "")
+        row["frame"] = frameId
+        row["read_ms"] = round(readTime * 1000, 2)
+        if image is None:
+            row["tags"] = -1
+            rows.append(row)
+            continue
+
+        timings, tags = {}, {}
+        listBalls = scriptDP.detectBallFrame(image, workerParams, timings, debugOut=False, tags=tags,
+                                             sinks=scriptDP.newSinks())
+
+        # the detection stops after the tags stage when the tags are not found
+        row["tags"] = int(tags != {})
+        row["balls"] = len(listBalls)
+        for name, (x, y) in listBalls.items():
+            if name in BALL_NAMES:
+                row[name + "_x"], row[name + "_y"] = int(x), int(y)
+        for stage, duration in timings.items():
+            row[stage + "_ms"] = round(duration * 1000, 2)
+        rows.append(row)
+
+    return rows
+
+
+# PRIVATE FUNCTION to read the frames already written in the output
+def __doneFrames(outPath):
+    """ PRIVATE FUNCTION to read the frames already written in the output
+
+    :param outPath: string : path of the CSV output
+    :return: set of strings : frame ids
+    """
+    if not os.path.exists(outPath):
+        return set()
+    with open(outPath, "r", newline="") as outFile:
+        return {row["frame"] for row in csv.DictReader(outFile)}
+
+
+# FUNCTION to analyse the frames of a capture folder or a video
+def analyseFrames(source, outPath, workers=0, shard=(0, 1), resume=False, paramPath="assets/parameters.json"):
+    """ FUNCTION to analyse the frames of a capture folder or a video on a process pool
+
+    Source : Mulnard T. and https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+
+    :param source: string : folder of images or path of a video
+    :param outPath: string : path of the CSV output
+    :param workers: integer : number of processes (0 = one per core)
+    :param shard: integer tuple : (index, count) only the frames number index modulo count are analysed
+    :param resume: boolean : skip the frames already in the output (otherwise the output is replaced)
+    :param paramPath: string : path of the json parameters of the table
+    :return: dictionary : number of analysed frames, frames with tags, duration and frames per second
+    """
+    frameIds = listFrames(source)[shard[0]::shard[1]]
+    done = __doneFrames(outPath) if resume else set()
+    frameIds = [frameId for frameId in frameIds if frameId not in done]
+    chunks = [frameIds[index:index + CHUNK_FRAMES] for index in range(0, len(frameIds), CHUNK_FRAMES)]
+
+    workers = workers if workers > 0 else os.cpu_count()
+    report = {"frames": 0, "tags": 0, "skipped": len(done)}
+    timeStart = time.perf_counter()
+
+    newFile = not (resume and os.path.exists(outPath))
+    with open(outPath, "w" if newFile else "a", newline="") as outFile, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=__initWorker,
+                                                   initargs=(paramPath,)) as executor:
+        writer = csv.DictWriter(outFile, fieldnames=COLUMNS)
+        if newFile:
+            writer.writeheader()
+
+        # the chunks are written as soon as they are finished, so an interrupted run loses at most one chunk per worker
+        for rows in executor.map(__analyseChunk, chunks):
+            writer.writerows(rows)
+            outFile.flush()
+            report["frames"] += len(rows)
+            report["tags"] += sum(row["tags"] == 1 for row in rows)
+            print("\r   > {} / {} frames".format(report["frames"], len(frameIds)), end="", flush=True)
+    print()
+
+    report["duration"] = time.perf_counter() - timeStart
+    report["fps"] = report["frames"] / report["duration"] if report["duration"] else 0
+    return report
+
+
+# FUNCTION to convert the CSV output into columnar files
+def saveColumns(outPath, columnsDir):
+    """ FUNCTION to convert the CSV output into columnar files (one .npy file per column, read with numpy.load)
+
+    The missing values (ball not detected, tags not found) are stored as -1.
+
+    Source : Mulnard T.
+
+    :param outPath: string : path of the CSV output
+    :param columnsDir: string : folder of the columnar files
+    :return: integer : number of rows
+    """
+    with open(outPath, "r", newline="") as outFile:
+        rows = list(csv.DictReader(outFile))
+
+    os.makedirs(columnsDir, exist_ok=True)
+    np.save(os.path.join(columnsDir, "frame.npy"), np.array([row["frame"] for row in rows]))
+    for column in COLUMNS[1:]:
+        dtype = "f4" if column.endswith("_ms") else "i4"
+        values = np.array([row[column] or -1 for row in rows], dtype="f8").astype(dtype)
+        np.save(os.path.join(columnsDir, column + ".npy"), values)
+
+    return len(rows)
+
+
+# PRIVATE FUNCTION to read the shard argument
+def __shardArgument(text):
+    """ PRIVATE FUNCTION to read the shard argument ('index/count')
+
+    :param text: string : argument of the command line
+    :return: integer tuple : (index, count)
+    """
+    try:
+        index, count = (int(value) for value in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("the shard must be written 'index/count' (ex: 0/4)")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("the shard index must be between 0 and count - 1")
+    return index, count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ball detection over recorded frames")
+    parser.add_argument("source", help="folder of images or path of a video")
+    parser.add_argument("--out", default="assets/output/batchAnalysis.csv", help="path of the CSV output")
+    parser.add_argument("--columns", help="folder where the output is also written as one numpy file per column")
+    parser.add_argument("--workers", type=int, default=0, help="number of processes (default : one per core)")
+    parser.add_argument("--shard", type=__shardArgument, default=(0, 1), help="part of the frames to analyse "
+                                                                              "(index/count)")
+    parser.add_argument("--resume", action="store_true", help="skip the frames already in the output")
+    parser.add_argument("--params", default="assets/parameters.json", help="json parameters of the table")
+    args = parser.parse_args()
+
+    print("[batch] Analysing the frames of " + args.source)
+    result = analyseFrames(args.source, args.out, args.workers, args.shard, args.resume, args.params)
+    print("   > {} frames analysed ({} skipped) | tags found on {} | {:.1f} s ({:.1f} frames per second)".format(
+        result["frames"], result["skipped"], result["tags"], result["duration"], result["fps"]))
+    print("   > results stored in " + args.out)
+    if args.columns:
+        saveColumns(args.out, args.columns)
+        print("   > columns stored in " + args.columns)
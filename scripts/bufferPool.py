@@ -0,0 +1,140 @@
+""" Buffer pool part of the project
+This script keeps the image arrays of the detection between two frames, so that every stage writes into a
+preallocated array (dst=) instead of allocating a new full-size image. There is one pool per thread (the tables of
+the multi-table runtime are processed in parallel), freed with its thread, and a few resolutions per name : the
+buffers of an older working resolution are freed when a new one is used
+"""
+
+import cv2
+import numpy as np
+import threading
+import tracemalloc
+import weakref
+
+# largest number of resolutions kept per name and thread (a strip worker gets the first, middle and last strips, which
+# have different heights), the least recently used one is freed
+MAX_SHAPES = 3
+
+
+# CLASS with the buffers of one thread
+class ThreadBuffers(dict):
+    """ CLASS with the buffers of one thread : (name, type) -> {shape -> array}, least recently used shape first
+
+    Source : Mulnard T.
+    """
+
+
+# pool of the calling thread (freed with the thread) and pools of the living threads by thread id (memory report)
+threadPool = threading.local()
+pools = weakref.WeakValueDictionary()
+
+# number of buffers created since the start (stays constant in steady state)
+createdBuffers = 0
+
+# structuring elements of the morphology, one per size
+kernels = {}
+
+
+# FUNCTION to get a preallocated array
+def getBuffer(name, shape, dtype=np.uint8):
+    """ FUNCTION to get a preallocated array (created at the first call for this name and resolution in this thread)
+
+    Source : Mulnard T.
+
+    :param name: string : name of the stage using the array
+    :param shape: integer tuple : shape of the array
+    :param dtype: numpy type of the array
+    :return: array : content is not initialised
+    """
+    global createdBuffers
+    buffers = getattr(threadPool, "buffers", None)
+    if buffers is None:
+        buffers = threadPool.buffers = ThreadBuffers()
+        pools[threading.get_ident()] = buffers
+
+    # the used shape goes at the end of the order of its name
+    shapes = buffers.setdefault((name, np.dtype(dtype).str), {})
+    buffer = shapes.pop(tuple(shape), None)
+    if buffer is None:
+        if len(shapes) >= MAX_SHAPES:
+            del shapes[next(iter(shapes))]
+        buffer = np.empty(shape, dtype=dtype)
+        createdBuffers += 1
+    shapes[tuple(shape)] = buffer
+
+    return buffer
+
+
+# FUNCTION to get an elliptic structuring element
+def getKernel(size):
+    """ FUNCTION to get an elliptic structuring element (created once per size)
+
+    Source : Mulnard T.
+
+    :param size: integer : size of the kernel
+    :return: array : structuring element
+    """
+    if size not in kernels:
+        kernels[size] = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+    return kernels[size]
+
+
+# FUNCTION to empty the pool
+def clearPool():
+    """ FUNCTION to empty the pools of every thread (end of a run)
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    for buffers in list(pools.values()):
+        buffers.clear()
+
+
+# FUNCTION to get the memory used by the pool
+def poolSize():
+    """ FUNCTION to get the memory used by the pools of the living threads
+
+    Source : Mulnard T.
+
+    :return: integer : number of bytes
+    """
+    return sum(buffer.nbytes for buffers in list(pools.values()) for shapes in list(buffers.values())
+               for buffer in list(shapes.values()))
+
+
+# FUNCTION to measure the allocations of a function called once per frame
+def memoryReport(frameFunction, frames=20, warmup=3):
+    """ FUNCTION to measure the allocations of a function called once per frame
+
+    Only the allocations made through numpy (which includes the arrays returned by OpenCV) are seen by tracemalloc.
+
+    Source : Mulnard T. and https://docs.python.org/3/library/tracemalloc.html
+
+    :param frameFunction: function without arguments processing one frame
+    :param frames: integer : number of measured frames
+    :param warmup: integer : number of frames run before the measure (creation of the buffers)
+    :return: dictionary : mean and max of the peak of temporary memory per frame, memory kept, new buffers
+    """
+    for _ in range(warmup):
+        frameFunction()
+
+    buffersBefore = createdBuffers
+    peaks = []
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        frameFunction()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    kept = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    return {"frames": frames,
+            "meanPeak": sum(peaks) / frames,
+            "maxPeak": max(peaks),
+            "keptPerFrame": kept / frames,
+            "newBuffers": createdBuffers - buffersBefore,
+            "poolSize": poolSize()}
@@ -0,0 +1,329 @@
+""" Calibration snapshot part of the project
+This script keeps everything derived from the calibration in a single file : the keystone matrix, the remap tables
+of the projection and the compiled layout and display image of the drills. The file is a json header followed by
+aligned binary arrays, read with a memory map (no parsing, no copy). Each entry keeps a checksum of its inputs (files
+and parameters) : an entry whose inputs changed is rebuilt and the file is written again
+
+File layout : magic (8 bytes), length of the header (8 bytes), json header, arrays aligned on ALIGNMENT bytes
+"""
+
+import cv2
+import hashlib
+import json
+import numpy as np
+import os
+import struct
+import time
+import zlib
+from scripts import gameEngine, parameters as p
+
+# first bytes of a snapshot file
+MAGIC = b"DPSNAP\x00\x00"
+
+# version of the file layout (a snapshot of another version is rebuilt)
+SNAPSHOT_VERSION = 1
+
+# alignment (bytes) of the arrays in the file
+ALIGNMENT = 64
+
+# arrays of a compiled drill layout (the other values of the layout are kept in the json header)
+LAYOUT_ARRAYS = ("centers", "radius2", "radius", "kinds", "applies", "weights", "penalties", "hasPenalty")
+
+# snapshot used by the program (opened with the first use)
+activeSnapshot = None
+
+
+# FUNCTION to compute the checksum of the inputs of an entry
+def inputsChecksum(paths=(), values=()):
+    """ FUNCTION to compute the checksum of the inputs of an entry
+
+    Source : Mulnard T.
+
+    :param paths: list of strings : files used by the entry (a missing file is part of the checksum)
+    :param values: list : other values used by the entry (json serializable)
+    :return: string : checksum
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            with open(path, "rb") as inputFile:
+                digest.update(inputFile.read())
+        except OSError:
+            digest.update(b"missing:" + path.encode())
+    digest.update(json.dumps(list(values), sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# PRIVATE FUNCTION to get the parameters as json values
+def __paramsValues(params):
+    """ PRIVATE FUNCTION to get the parameters of the table as json values (part of the inputs of the entries)
+
+    :param params: parameters of the table
+    :return: dictionary : name and value of the parameters
+    """
+    return {name: value for name, value in vars(params).items()
+            if not name.startswith("_") and isinstance(value, (int, float, str, list, tuple))}
+
+
+# FUNCTION to open a snapshot file
+def openSnapshot(path=p.calibSnapshot):
+    """ FUNCTION to open a snapshot file (the arrays are views on a memory map of the file)
+
+    Source : Mulnard T. and https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+
+    :param path: string : path of the snapshot file
+    :return: dictionary : snapshot (empty if the file is missing, from another version or damaged)
+    """
+    snapshot = {"path": path, "entries": {}, "dirty": False}
+    try:
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, length = data[:8].tobytes(), struct.unpack("<Q", data[8:16].tobytes())[0]
+        header = json.loads(data[16:16 + length].tobytes())
+    except (OSError, ValueError, struct.error):
+        return snapshot
+    if magic != MAGIC or header.get("version") != SNAPSHOT_VERSION:
+        print("<WARNING> calibration snapshot from another version, it will be rebuilt")
+        return snapshot
+
+    for name, entry in header["entries"].items():
+        arrays = {}
+        for key, array in entry["arrays"].items():
+            size = int(np.prod(array["shape"])) * np.dtype(array["dtype"]).itemsize
+            if array["offset"] + size > data.size:
+                break
+            arrays[key] = np.ndarray(array["shape"], dtype=array["dtype"], buffer=data, offset=array["offset"])
+        else:
+            snapshot["entries"][name] = {"inputs": entry["inputs"], "meta": entry["meta"], "arrays": arrays,
+                                         "crc": {key: array["crc"] for key, array in entry["arrays"].items()},
+                                         "checked": False}
+    return snapshot
+
+
+# FUNCTION to get an entry of the snapshot
+def getEntry(snapshot, name, inputs):
+    """ FUNCTION to get an entry of the snapshot if its inputs did not change (the checksum of its data is verified
+    with its first use)
+
+    Source : Mulnard T.
+
+    :param snapshot: dictionary coming from openSnapshot
+    :param name: string : name of the entry
+    :param inputs: string : checksum of the current inputs (see inputsChecksum)
+    :return: dictionary : 'arrays' and 'meta' of the entry, None if it is missing or stale
+    """
+    entry = snapshot["entries"].get(name)
+    if entry is None or entry["inputs"] != inputs:
+        return None
+    if not entry["checked"]:
+        if any(zlib.crc32(array) != entry["crc"][key] for key, array in entry["arrays"].items()):
+            print("<WARNING> calibration snapshot entry '{}' is damaged, it will be rebuilt".format(name))
+            del snapshot["entries"][name]
+            return None
+        entry["checked"] = True
+    return entry
+
+
+# FUNCTION to put an entry in the snapshot
+def putEntry(snapshot, name, inputs, arrays, meta=None):
+    """ FUNCTION to put an entry in the snapshot (written with the next saveSnapshot)
+
+    Source : Mulnard T.
+
+    :param snapshot: dictionary coming from openSnapshot
+    :param name: string : name of the entry
+    :param inputs: string : checksum of the inputs (see inputsChecksum)
+    :param arrays: dictionary : name and numpy array
+    :param meta: json serializable value kept with the arrays
+    :return: dictionary : the entry
+    """
+    arrays = {key: np.ascontiguousarray(array) for key, array in arrays.items()}
+    snapshot["entries"][name] = {"inputs": inputs, "meta": meta, "arrays": arrays,
+                                 "crc": {key: zlib.crc32(array) for key, array in arrays.items()}, "checked": True}
+    snapshot["dirty"] = True
+    return snapshot["entries"][name]
+
+
+# FUNCTION to write the snapshot file
+def saveSnapshot(snapshot):
+    """ FUNCTION to write the snapshot file (written next to it and then renamed, so a reader never sees a part of
+    it)
+
+    Source : Mulnard T.
+
+    :param snapshot: dictionary coming from openSnapshot
+    :return: nothing
+    """
+    # offsets of the arrays from the start of the data
+    entries = {}
+    blocks = []
+    offset = 0
+    for name, entry in snapshot["entries"].items():
+        arrays = {}
+        for key, array in entry["arrays"].items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            arrays[key] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape),
+                           "crc": entry["crc"][key]}
+            blocks.append((offset, array))
+            offset += array.nbytes
+        entries[name] = {"inputs": entry["inputs"], "meta": entry["meta"], "arrays": arrays}
+
+    # the data starts after the header, whose length depends on the offsets written in it
+    start = 0
+    while True:
+        header = {"version": SNAPSHOT_VERSION, "entries": {name: {
+            "inputs": entry["inputs"], "meta": entry["meta"],
+            "arrays": {key: dict(array, offset=array["offset"] + start) for key, array in entry["arrays"].items()}}
+            for name, entry in entries.items()}}
+        headerBytes = json.dumps(header).encode()
+        if 16 + len(headerBytes) <= start:
+            break
+        start = -(-(16 + len(headerBytes)) // ALIGNMENT) * ALIGNMENT
+
+    temporary = snapshot["path"] + ".tmp"
+    with open(temporary, "wb") as snapshotFile:
+        snapshotFile.write(MAGIC + struct.pack("<Q", len(headerBytes)) + headerBytes)
+        for blockOffset, array in blocks:
+            snapshotFile.seek(start + blockOffset)
+            snapshotFile.write(array.tobytes())
+    os.replace(temporary, snapshot["path"])
+    snapshot["dirty"] = False
+
+
+# FUNCTION to get the snapshot of the program
+def getSnapshot():
+    """ FUNCTION to get the snapshot of the program (opened with the first use)
+
+    Source : Mulnard T.
+
+    :return: dictionary : snapshot
+    """
+    global activeSnapshot
+    if activeSnapshot is None:
+        activeSnapshot = openSnapshot()
+    return activeSnapshot
+
+
+# FUNCTION to get the keystone matrix
+def keystoneMatrix(snapshot=None):
+    """ FUNCTION to get the keystone matrix (read from matrix.csv only when the file changed)
+
+    Source : Mulnard T.
+
+    :param snapshot: dictionary coming from openSnapshot (default : snapshot of the program)
+    :return: float array : keystone matrix (IOError if the keystone was never set)
+    """
+    snapshot = getSnapshot() if snapshot is None else snapshot
+    inputs = inputsChecksum([p.kstData])
+    entry = getEntry(snapshot, "keystone", inputs)
+    if entry is None:
+        entry = putEntry(snapshot, "keystone", inputs, {"matrix": np.loadtxt(p.kstData, delimiter=",")})
+    return entry["arrays"]["matrix"]
+
+
+# FUNCTION to get the remap tables of the projection
+def keystoneMaps(snapshot=None, params=p):
+    """ FUNCTION to get the remap tables of the projection (same result as cv2.warpPerspective with the keystone
+    matrix, without computing the transformation of every pixel again)
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/da/d54/group__imgproc__transform.html#ga9156732fa8f01be9ebd1a194f2728b7f
+
+    :param snapshot: dictionary coming from openSnapshot (default : snapshot of the program)
+    :param params: parameters of the table (resolution of the projected image)
+    :return: fixed point remap tables (see cv2.convertMaps)
+    """
+    snapshot = getSnapshot() if snapshot is None else snapshot
+    inputs = inputsChecksum([p.kstData], [params.width, params.height])
+    name = "keystoneMaps:{}x{}".format(params.width, params.height)
+    entry = getEntry(snapshot, name, inputs)
+    if entry is None:
+        inverse = np.linalg.inv(keystoneMatrix(snapshot))
+        grid = np.indices((params.height, params.width), dtype=np.float32)[::-1].transpose(1, 2, 0).copy()
+        sources = cv2.perspectiveTransform(grid.reshape(1, -1, 2), inverse).reshape(params.height, params.width, 2)
+        map1, map2 = cv2.convertMaps(sources, None, cv2.CV_16SC2)
+        entry = putEntry(snapshot, name, inputs, {"map1": map1, "map2": map2})
+    return entry["arrays"]["map1"], entry["arrays"]["map2"]
+
+
+# FUNCTION to project an image through the keystone
+def projectImage(image, snapshot=None, params=p):
+    """ FUNCTION to warp an image through the keystone with the remap tables of the snapshot
+
+    Source : Mulnard T.
+
+    :param image: image array (resolution of the parameters)
+    :param snapshot: dictionary coming from openSnapshot (default : snapshot of the program)
+    :param params: parameters of the table
+    :return: image array to project
+    """
+    map1, map2 = keystoneMaps(snapshot, params)
+    return cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+
+
+# FUNCTION to get the image and the layout of a drill
+def drillLayout(drill, drillPath, targetRadius, placementRadius=100, snapshot=None, params=p):
+    """ FUNCTION to get the image and the compiled layout of a drill (prepared only when the drill, its image, the
+    keystone or the parameters changed)
+
+    Source : Mulnard T.
+
+    :param drill: dictionary : drill definition coming from gameEngine.loadDrill
+    :param drillPath: string : path of the json drill definition
+    :param targetRadius: integer : radius of the finish zones
+    :param placementRadius: integer : radius for the correct start position
+    :param snapshot: dictionary coming from openSnapshot (default : snapshot of the program)
+    :param params: parameters of the table
+    :return: image array to display, dictionary : compiled layout of the drill (see gameEngine.prepareDrill)
+    """
+    snapshot = getSnapshot() if snapshot is None else snapshot
+    inputs = inputsChecksum([drillPath, drill["image"], p.kstData],
+                            [targetRadius, placementRadius, __paramsValues(params)])
+    name = "drill:{}".format(drillPath)
+    entry = getEntry(snapshot, name, inputs)
+    if entry is None:
+        image, layout = gameEngine.prepareDrill(drill, targetRadius, placementRadius, keystoneMatrix(snapshot), params,
+                                                maps=keystoneMaps(snapshot, params))
+        arrays = {key: layout[key] for key in LAYOUT_ARRAYS}
+        arrays["image"] = image
+        entry = putEntry(snapshot, name, inputs, arrays,
+                         {key: value for key, value in layout.items() if key not in LAYOUT_ARRAYS})
+    layout = dict(entry["meta"])
+    layout.update({key: entry["arrays"][key] for key in LAYOUT_ARRAYS})
+    # the display image is drawn on by the games : the snapshot keeps its own copy
+    return entry["arrays"]["image"].copy(), layout
+
+
+# FUNCTION to prepare everything before the first drill
+def warmStart(drillPaths=(), targetRadius=p.zoneRadius, params=p):
+    """ FUNCTION to prepare the keystone and the drills before the first game, and write the snapshot if an entry
+    was rebuilt
+
+    Source : Mulnard T.
+
+    :param drillPaths: list of strings : drills prepared in advance
+    :param targetRadius: integer : radius of the finish zones
+    :param params: parameters of the table
+    :return: float : duration (seconds)
+    """
+    timeStart = time.perf_counter()
+    snapshot = getSnapshot()
+    try:
+        keystoneMatrix(snapshot)
+        for drillPath in drillPaths:
+            drillLayout(gameEngine.loadDrill(drillPath), drillPath, targetRadius, snapshot=snapshot, params=params)
+    except (IOError, KeyError, ValueError):
+        print("<WARNING> calibration snapshot not complete, please set the keystone before playing")
+    if snapshot["dirty"]:
+        saveSnapshot(snapshot)
+    return time.perf_counter() - timeStart
+
+
+# FUNCTION to write the snapshot of the program if it changed
+def flush():
+    """ FUNCTION to write the snapshot of the program if an entry was rebuilt since it was opened
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    if activeSnapshot is not None and activeSnapshot["dirty"]:
+        saveSnapshot(activeSnapshot)
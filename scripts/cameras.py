@@ -0,0 +1,359 @@
+""" Camera backends part of the project
+This script gives the same interface to the different sources of images : the Pi camera of a table, a replay of
+recorded frames (image files or a video) or a simulated view of the table, used to test the program without any camera
+"""
+
+import cv2
+import cv2.aruco
+import glob
+import numpy as np
+import time
+from scripts import bufferPool, imgProcess, parameters as p
+
+# simulated camera : color (BGR) of the cloth of the table and of the floor around it
+TABLE_COLOR = (60, 140, 50)
+FLOOR_COLOR = (70, 70, 70)
+
+# simulated camera : radius (pixels of the table) and colors (BGR) of the balls
+BALL_RADIUS = 30
+BALL_COLORS = {"WHITE": (235, 235, 235), "YELLOW": (40, 200, 230), "RED": (30, 40, 200), "BLUE": (200, 40, 40)}
+
+# simulated camera : size (pixels of the table, multiple of the 7 cells of a 5x5 tag) and white margin (2 cells, the
+# detection misses the tags with a thinner margin) of the tags, margin (pixels) of the table plane around the table
+# and number of noise patterns drawn in turn
+TAG_SIZE = 84
+TAG_MARGIN = 24
+PLANE_MARGIN = 120
+NOISE_PATTERNS = 4
+
+
+# CLASS to take pictures with a Pi camera
+class PiCameraBackend:
+    """ CLASS to take pictures with a Pi camera directly into an image array
+
+    Source : Mulnard T. and https://picamera.readthedocs.io/en/release-1.13/recipes2.html
+    """
+
+    def __init__(self, resolution, rotation=0, cameraNum=0):
+        """ Open the camera
+
+        :param resolution: integer list : resolution (w, h) of the pictures
+        :param rotation: integer : rotation of the camera (0 / 90 / 180 / 270)
+        :param cameraNum: integer : id of the camera (compute module with several cameras)
+        """
+        from picamera import PiCamera
+        self.camera = PiCamera(camera_num=cameraNum)
+        self.camera.resolution = tuple(resolution)
+        self.camera.rotation = rotation
+        self.resolution = tuple(resolution)
+        self.fullResolution = tuple(resolution)
+        self.fullFramerate = self.camera.framerate
+
+    def capture(self):
+        """ Take a picture
+
+        :return: image array (BGR)
+        """
+        # the picamera buffer is rounded up to a width multiple of 32 and a height multiple of 16
+        width, height = self.resolution
+        image = bufferPool.getBuffer("camera", (-(-height // 16) * 16, -(-width // 32) * 32, 3))
+        self.camera.capture(image, "bgr", use_video_port=True)
+        return image[:height, :width]
+
+    def setRoi(self, roi, resolution, fps):
+        """ Read only a window of the sensor, at a reduced resolution and a higher frame rate
+
+        :param roi: integer tuple : window (x, y, w, h) in pixels of the full resolution, None = full sensor
+        :param resolution: integer tuple : resolution (w, h) of the pictures of the window
+        :param fps: float : frame rate of the camera
+        """
+        if roi is None:
+            self.camera.zoom = (0.0, 0.0, 1.0, 1.0)
+            self.camera.resolution = self.fullResolution
+            self.camera.framerate = self.fullFramerate
+            self.resolution = self.fullResolution
+            return
+        width, height = self.fullResolution
+        self.camera.zoom = (roi[0] / width, roi[1] / height, roi[2] / width, roi[3] / height)
+        self.camera.resolution = tuple(resolution)
+        self.camera.framerate = fps
+        self.resolution = tuple(resolution)
+
+    def close(self):
+        """ Release the camera """
+        self.camera.close()
+
+
+# CLASS to replay recorded frames as if they came from a camera
+class ReplayCameraBackend:
+    """ CLASS to replay recorded frames (glob pattern of images or video file) as if they came from a camera
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, source, loop=True, fps=0):
+        """ Open the recorded frames
+
+        :param source: string : glob pattern of image files (ex: 'assets/output/0-*.png') or path of a video
+        :param loop: boolean : start again from the first frame at the end of the recording
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        """
+        self.files = sorted(glob.glob(source))
+        self.video = None if self.files else cv2.VideoCapture(source)
+        if self.video is not None and not self.video.isOpened():
+            raise IOError("no frame found for the replay source '{}'".format(source))
+        self.source = source
+        self.loop = loop
+        self.period = 1 / fps if fps > 0 else 0
+        self.index = 0
+        self.lastTime = 0
+        self.cache = {}
+        self.roi = None
+
+    def capture(self):
+        """ Get the next frame of the recording
+
+        :return: image array (BGR), None at the end of the recording
+        """
+        # waiting to simulate the frame rate of a real camera
+        if self.period > 0:
+            delay = self.lastTime + self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.lastTime = time.perf_counter()
+
+        if self.video is not None:
+            ok, image = self.video.read()
+            if not ok and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self.video.read()
+            if ok and self.roi is not None:
+                return self.__cropRoi(image)
+            return image if ok else None
+
+        if self.index >= len(self.files):
+            if not self.loop:
+                return None
+            self.index = 0
+
+        # the files are decoded only once, the next loops copy the cached frames into a buffer of the pool
+        # (the detection draws on the frame)
+        fileName = self.files[self.index]
+        if fileName not in self.cache:
+            self.cache[fileName] = cv2.imread(fileName)
+        self.index += 1
+        frame = self.cache[fileName]
+        if self.roi is not None:
+            return self.__cropRoi(frame)
+        image = bufferPool.getBuffer("replay", frame.shape)
+        image[...] = frame
+        return image
+
+    def __cropRoi(self, frame):
+        """ Crop and resize a frame like the window of the sensor of a camera
+
+        :param frame: image array : full frame
+        :return: image array : window of the frame
+        """
+        x, y, w, h = self.roi
+        width, height = self.roiResolution
+        image = bufferPool.getBuffer("replayRoi", (height, width, 3))
+        return cv2.resize(frame[y:y + h, x:x + w], (width, height), dst=image, interpolation=cv2.INTER_AREA)
+
+    def setRoi(self, roi, resolution, fps):
+        """ Read only a window of the frames, at a reduced resolution and a higher frame rate
+
+        :param roi: integer tuple : window (x, y, w, h) in pixels of the full frames, None = full frames
+        :param resolution: integer tuple : resolution (w, h) of the pictures of the window (None with the full frames)
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        """
+        self.roi = None if roi is None else tuple(int(value) for value in roi)
+        self.roiResolution = None if resolution is None else tuple(resolution)
+        self.period = 1 / fps if fps > 0 else 0
+
+    def close(self):
+        """ Release the recording """
+        if self.video is not None:
+            self.video.release()
+
+
+# CLASS to read back the images of a buffer projector as if they came from a camera
+class LoopbackCameraBackend:
+    """ CLASS to read back the images of a buffer projector (see projectors.py) as if they came from a camera
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, projector, fps=0):
+        """ Connect the camera to the projector
+
+        :param projector: BufferProjector
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        """
+        self.projector = projector
+        self.period = 1 / fps if fps > 0 else 0
+        self.lastTime = 0
+
+    def capture(self):
+        """ Get the image visible on the projector
+
+        :return: image array (BGR), None if nothing is projected yet
+        """
+        if self.period > 0:
+            delay = self.lastTime + self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.lastTime = time.perf_counter()
+
+        frame = self.projector.visible()
+        if frame is None:
+            return None
+        image = bufferPool.getBuffer("loopback", frame.shape)
+        image[...] = frame
+        return image
+
+    def setRoi(self, roi, resolution, fps):
+        """ The loopback camera always reads the full projected image
+
+        :param roi: not used
+        :param resolution: not used
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        """
+        self.period = 1 / fps if fps > 0 else 0
+
+    def close(self):
+        """ Nothing to release """
+
+
+# CLASS to simulate a camera looking at the table
+class SimulatedCameraBackend:
+    """ CLASS to simulate a camera looking at the table : the cloth with the tags of the table, the light of a buffer
+    projector (see projectors.py) and the balls are drawn in the plane of the table (size of the warped image), then
+    seen by the camera through a homography, with the noise of the sensor
+
+    The projected image covers the table exactly (the keystone correction is already in the projected image), and the
+    tags are put where the warp of the detection (with the tag offset) sends the corners of the table on the corners of
+    the warped image : a ball drawn at (x, y) of the table is detected at (x, y).
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, projector, params=p, corners=None, noise=3.0, light=0.3, player=None, seed=0, fps=0,
+                 section=None, tagIds=(0, 1, 2, 3)):
+        """ Draw the table seen by the camera
+
+        :param projector: BufferProjector, None = nothing projected
+        :param params: parameters of the table (resolution of the camera, size of the warped image and tag offset)
+        :param corners: float array (4, 2) : corners of the table in the camera frames (top-left, top-right,
+                        bottom-right, bottom-left of the warped image), default : a slightly tilted view
+        :param noise: float : standard deviation of the noise of the sensor (gray levels)
+        :param light: float : intensity of the projected light on the cloth (0-1)
+        :param player: function : called at each frame, gives the positions (x, y) of the balls on the table by name
+        :param seed: integer : seed of the noise
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        :param section: integer tuple : part (x0, y0, x1, y1) of the table seen by the camera, its tags are put around
+                        this part instead of the corners of the table (see multiCamera.py), None = whole table
+        :param tagIds: integer tuple : ids of the tags (top-left, top-right, bottom-right, bottom-left)
+        """
+        self.projector = projector
+        self.params = params
+        self.light = light
+        self.player = player
+        self.balls = {}
+        self.period = 1 / fps if fps > 0 else 0
+        self.lastTime = 0
+        self.frames = 0
+        self.renderTime = 0.0
+        self.resolution = tuple(params.camRes)
+        width, height = self.resolution
+        if corners is None:
+            corners = np.float32([[0.10, 0.14], [0.90, 0.12], [0.91, 0.89], [0.09, 0.88]]) * (width, height)
+        x0, y0, x1, y1 = (0, 0, params.width, params.height) if section is None else section
+        seen = np.float32([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+        self.matrix = cv2.getPerspectiveTransform(seen + PLANE_MARGIN, np.float32(corners))
+
+        # plane of the table : cloth and tags (the detection removes the offset from the centers of the tags)
+        self.background = np.empty((params.height + 2 * PLANE_MARGIN, params.width + 2 * PLANE_MARGIN, 3), np.uint8)
+        self.background[...] = FLOOR_COLOR
+        self.background[PLANE_MARGIN:-PLANE_MARGIN, PLANE_MARGIN:-PLANE_MARGIN] = TABLE_COLOR
+        arucoDict = cv2.aruco.Dictionary_get(imgProcess.ARUCO_DICT[params.tagType])
+        inverse = np.linalg.inv(self.matrix)
+        for markerID, corner, side in zip(tagIds, corners, (1, -1, -1, 1)):
+            center = cv2.perspectiveTransform(np.float32([[corner + (side * params.warpOffset, 0)]]), inverse)[0, 0]
+            x, y = np.round(center - TAG_SIZE / 2).astype(int)
+            marker = cv2.aruco.drawMarker(arucoDict, markerID, TAG_SIZE)
+            self.background[y - TAG_MARGIN:y + TAG_SIZE + TAG_MARGIN, x - TAG_MARGIN:x + TAG_SIZE + TAG_MARGIN] = 255
+            self.background[y:y + TAG_SIZE, x:x + TAG_SIZE] = marker[:, :, None]
+
+        # noise of the sensor, split in a positive and a negative part for the saturated additions
+        generator = np.random.default_rng(seed)
+        self.noise = []
+        for _ in range(NOISE_PATTERNS):
+            pattern = generator.normal(0, noise, (height, width, 3))
+            self.noise.append((np.clip(pattern, 0, 255).astype(np.uint8), np.clip(-pattern, 0, 255).astype(np.uint8)))
+
+    def capture(self):
+        """ Draw the view of the camera
+
+        :return: image array (BGR)
+        """
+        if self.period > 0:
+            delay = self.lastTime + self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.lastTime = time.perf_counter()
+
+        timeStart = time.perf_counter()
+        if self.player is not None:
+            self.balls = self.player()
+        plane = bufferPool.getBuffer("simulatedPlane", self.background.shape)
+        plane[...] = self.background
+        table = plane[PLANE_MARGIN:-PLANE_MARGIN, PLANE_MARGIN:-PLANE_MARGIN]
+        projected = None if self.projector is None else self.projector.visible()
+        if projected is not None:
+            if projected.shape[:2] != table.shape[:2]:
+                projected = cv2.resize(projected, (table.shape[1], table.shape[0]))
+            cv2.addWeighted(table, 1.0, projected, self.light, 0, dst=table)
+        for name, (x, y) in self.balls.items():
+            cv2.circle(plane, (int(round(x)) + PLANE_MARGIN, int(round(y)) + PLANE_MARGIN), BALL_RADIUS,
+                       BALL_COLORS[name], -1, cv2.LINE_AA)
+
+        width, height = self.resolution
+        image = bufferPool.getBuffer("simulated", (height, width, 3))
+        cv2.warpPerspective(plane, self.matrix, (width, height), dst=image, borderValue=FLOOR_COLOR)
+        positive, negative = self.noise[self.frames % NOISE_PATTERNS]
+        cv2.add(image, positive, dst=image)
+        cv2.subtract(image, negative, dst=image)
+        self.frames += 1
+        self.renderTime += time.perf_counter() - timeStart
+        return image
+
+    def setRoi(self, roi, resolution, fps):
+        """ The simulated camera always gives the full frames
+
+        :param roi: not used
+        :param resolution: not used
+        :param fps: float : frame rate to simulate (0 = as fast as possible)
+        """
+        self.period = 1 / fps if fps > 0 else 0
+
+    def close(self):
+        """ Nothing to release """
+
+
+# FUNCTION to create a camera backend from its configuration
+def openCamera(config, params):
+    """ FUNCTION to create a camera backend from its configuration
+
+    Source : Mulnard T.
+
+    :param config: dictionary : 'type' ('picamera' or 'replay') and the options of the backend
+    :param params: parameters of the table (resolution and rotation of the camera)
+    :return: camera backend
+    """
+    if config["type"] == "picamera":
+        return PiCameraBackend(params.camRes, params.camRot, config.get("cameraNum", 0))
+    elif config["type"] == "replay":
+        return ReplayCameraBackend(config["source"], config.get("loop", True), config.get("fps", 0))
+
+    raise ValueError("unknown camera type '{}'".format(config["type"]))
@@ -0,0 +1,292 @@
+""" Color learning part of the project
+This script learns the colors of the balls from the camera instead of the BGR ranges set by hand : the pixels of the
+balls are sampled in a few frames (one color at a time), clustered in the Lab color space (body, shadow and highlight
+of a ball) and kept as per-color models in assets/colorModels.json. The models are compiled into a lookup table of
+the BGR colors, so the classification of a pixel is a single read (see imgProcess.classifyCircles). The compiled table
+is kept in the calibration snapshot
+"""
+
+import cv2
+import json
+import numpy as np
+import time
+from scripts import calibSnapshot, cameras, imgProcess, scriptDP, parameters as p
+
+# colors of the balls learned by the calibration
+BALL_NAMES = ("WHITE", "YELLOW", "RED", "BLUE")
+
+# clusters of a color (body, shadow and highlight of the ball) and minimum share of the pixels of a kept cluster
+CLUSTERS = 3
+MIN_SHARE = 0.05
+
+# maximum number of pixels of a color given to the clustering
+MAX_SAMPLES = 20000
+
+# standard deviation (L, a, b) added to the clusters for the changes of the light : mostly the lightness, a little the
+# color of the ball (the calibration frames only see one light)
+LIGHT_SPREAD = (50.0, 8.0, 8.0)
+
+# maximum Mahalanobis distance (standard deviations) between a color and a cluster of a ball
+MAX_DISTANCE = 4.0
+
+# bits per channel of the lookup table (64 x 64 x 64 cells of 4 BGR values)
+LUT_BITS = 6
+
+# half size of the sampled square compared to the radius of a ball (inside the ball)
+SAMPLE_OFFSET = 0.6
+
+# frames taken for each color by the calibration
+CALIBRATION_FRAMES = 3
+
+
+# FUNCTION to sample the pixels of the balls of a frame
+def sampleFrame(image, label, samples, params=p):
+    """ FUNCTION to sample the pixels of the balls of a frame where all the balls have the same color
+
+    Source : Mulnard T.
+
+    :param image: image array : camera frame (BGR)
+    :param label: string : color of the balls of the frame
+    :param samples: dictionary : list of the sampled pixel arrays by color (completed)
+    :param params: parameters of the table
+    :return: integer : number of sampled balls (0 if the tags are not found)
+    """
+    tagCenters = imgProcess.tagDetect(image, params.tagType, params.tagScale)[0]
+    if tagCenters == {}:
+        return 0
+    image = imgProcess.warpPerspective(image, tagCenters, params.warpOffset, params=params)
+    image = imgProcess.removeBackground(image, params.bRectDist, params.bCircRad, params=params)
+    balls = imgProcess.circleDetection(image.copy(), minDist=50, minRadius=15, maxRadius=70, imgDisplayOut=False,
+                                       params=params, structured=True)[1]
+    for x, y, r, _, _ in balls.tolist():
+        half = int(r * SAMPLE_OFFSET)
+        patch = image[max(y - half, 0):y + half, max(x - half, 0):x + half].reshape((-1, 3))
+        # the black pixels are the removed background
+        samples.setdefault(label, []).append(patch[patch.any(axis=1)])
+    return len(balls)
+
+
+# FUNCTION to learn the models of the colors from the sampled pixels
+def learnModels(samples, clusters=CLUSTERS, seed=0):
+    """ FUNCTION to learn the models of the colors : the sampled pixels of each color are clustered in the Lab color
+    space (k-means), each cluster is kept as its mean and covariance
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d1/d5c/tutorial_py_kmeans_opencv.html
+
+    :param samples: dictionary : list of the sampled pixel arrays by color (see sampleFrame)
+    :param clusters: integer : number of clusters of a color
+    :param seed: integer : seed of the selection of the pixels and of the k-means
+    :return: dictionary : clusters (mean, covariance and share of the pixels in Lab) and number of pixels by color
+    """
+    generator = np.random.default_rng(seed)
+    cv2.setRNGSeed(seed)
+    models = {}
+    for label, patches in samples.items():
+        pixels = np.concatenate(patches).astype(np.uint8)
+        if len(pixels) < clusters:
+            continue
+        if len(pixels) > MAX_SAMPLES:
+            pixels = pixels[generator.choice(len(pixels), MAX_SAMPLES, replace=False)]
+        lab = cv2.cvtColor(pixels[None], cv2.COLOR_BGR2Lab)[0].astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+        _, members, _ = cv2.kmeans(lab, clusters, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+
+        models[label] = {"pixels": len(pixels), "clusters": []}
+        for cluster in range(clusters):
+            points = lab[members[:, 0] == cluster]
+            if len(points) < max(MIN_SHARE * len(lab), 2):
+                continue
+            covariance = np.cov(points, rowvar=False) + np.diag(np.square(LIGHT_SPREAD))
+            models[label]["clusters"].append({"mean": points.mean(axis=0).tolist(), "covariance": covariance.tolist(),
+                                              "share": len(points) / len(lab)})
+    return models
+
+
+# FUNCTION to save the models of the colors
+def saveModels(models, path=p.colorModels):
+    """ FUNCTION to save the models of the colors in a json file
+
+    Source : Mulnard T.
+
+    :param models: dictionary coming from learnModels
+    :param path: string : path of the json file
+    :return: nothing
+    """
+    with open(path, "w") as modelsFile:
+        json.dump(models, modelsFile, indent=1)
+
+
+# FUNCTION to compile the models of the colors into a lookup table
+def compileClassifier(models, bits=LUT_BITS, maxDistance=MAX_DISTANCE):
+    """ FUNCTION to compile the models of the colors into a lookup table of the BGR colors : each cell takes the color
+    of the closest cluster (Mahalanobis distance in Lab), or no color if every cluster is too far
+
+    Source : Mulnard T.
+
+    :param models: dictionary coming from learnModels
+    :param bits: integer : bits per channel of the table
+    :param maxDistance: float : maximum Mahalanobis distance (standard deviations) to a cluster
+    :return: dictionary : names of the colors, table (uint8, 0 = no color, index + 1 in the names) and bits
+    """
+    size = 1 << bits
+    # center of each cell of the table
+    levels = (np.arange(size) << (8 - bits)) + (1 << (8 - bits)) // 2
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).astype(np.uint8)
+    lab = cv2.cvtColor(grid.reshape((1, -1, 3)), cv2.COLOR_BGR2Lab)[0].astype(np.float32)
+
+    names = [name for name, model in models.items() if model["clusters"]]
+    distances = np.full((len(names) + 1, len(lab)), maxDistance ** 2, dtype=np.float32)
+    for index, name in enumerate(names):
+        for cluster in models[name]["clusters"]:
+            difference = lab - np.float32(cluster["mean"])
+            inverse = np.linalg.inv(np.float32(cluster["covariance"])).astype(np.float32)
+            np.minimum(distances[index + 1], np.einsum("ij,jk,ik->i", difference, inverse, difference),
+                       out=distances[index + 1])
+    lut = distances.argmin(axis=0).astype(np.uint8).reshape((size, size, size))
+    return {"names": np.array(names), "lut": lut, "bits": bits}
+
+
+# FUNCTION to get the lookup classifier of the learned colors
+def getClassifier(path=p.colorModels, snapshot=None):
+    """ FUNCTION to get the lookup classifier of the learned colors (compiled only when the models changed)
+
+    Source : Mulnard T.
+
+    :param path: string : path of the json file of the models
+    :param snapshot: dictionary coming from calibSnapshot.openSnapshot (default : snapshot of the program)
+    :return: dictionary : names of the colors, table and bits (see compileClassifier), IOError if the colors were
+             never learned
+    """
+    snapshot = calibSnapshot.getSnapshot() if snapshot is None else snapshot
+    inputs = calibSnapshot.inputsChecksum([path], [LUT_BITS, MAX_DISTANCE])
+    entry = calibSnapshot.getEntry(snapshot, "colorClassifier", inputs)
+    if entry is None:
+        with open(path) as modelsFile:
+            classifier = compileClassifier(json.load(modelsFile))
+        entry = calibSnapshot.putEntry(snapshot, "colorClassifier", inputs, {"lut": classifier["lut"]},
+                                       {"names": classifier["names"].tolist(), "bits": classifier["bits"]})
+    return {"names": np.array(entry["meta"]["names"]), "lut": entry["arrays"]["lut"], "bits": entry["meta"]["bits"]}
+
+
+# FUNCTION to use the learned colors in the detection
+def loadClassifier(path=p.colorModels):
+    """ FUNCTION to use the learned colors in the detection of the balls, if they were learned (the color ranges of
+    the parameters are used otherwise)
+
+    Source : Mulnard T.
+
+    :param path: string : path of the json file of the models
+    :return: boolean : if the learned colors are used
+    """
+    try:
+        imgProcess.colorClassifier = getClassifier(path)
+    except (IOError, KeyError, ValueError):
+        imgProcess.colorClassifier = None
+    return imgProcess.colorClassifier is not None
+
+
+# FUNCTION to learn the colors of the balls with the camera
+def calibrate(names=BALL_NAMES, frames=CALIBRATION_FRAMES, params=p):
+    """ FUNCTION to learn the colors of the balls with the camera : the balls of each color are put on the table one
+    color at a time, a few frames are sampled, then the models are learned, saved and used
+
+    Source : Mulnard T.
+
+    :param names: list of strings : colors of the balls
+    :param frames: integer : frames taken for each color
+    :param params: parameters of the table
+    :return: nothing
+    """
+    samples = {}
+    for name in names:
+        choice = input("   > put only the {} ball(s) on the table, then press 'Enter' ('s' to skip) : ".format(name))
+        if choice == "s":
+            continue
+        balls = 0
+        for _ in range(frames):
+            scriptDP.imgTake(p.pathCamIN)
+            image = scriptDP.capturedFrames.pop(p.pathCamIN, None)
+            balls += sampleFrame(cv2.imread(p.pathCamIN) if image is None else image, name, samples, params)
+        print("      > {} ball(s) sampled in {} frames".format(balls, frames))
+
+    models = learnModels(samples)
+    if models == {}:
+        print("<Error> no ball was sampled, the colors are not changed")
+        return
+
+    # the colors skipped in this run keep their last learned models (the ranges are not used with a classifier)
+    try:
+        with open(p.colorModels) as modelsFile:
+            learned = json.load(modelsFile)
+    except (IOError, ValueError):
+        learned = {}
+    saveModels({**learned, **models})
+    loadClassifier()
+    for name, model in models.items():
+        print("      > {:6s} : {} clusters from {} pixels".format(name, len(model["clusters"]), model["pixels"]))
+
+
+# FUNCTION to compare the learned colors with the color ranges under changing light
+def benchmark(gains=(0.6, 0.8, 1.0, 1.2, 1.4), frames=4, params=p):
+    """ FUNCTION to compare the learned colors with the color ranges on simulated frames (see
+    cameras.SimulatedCameraBackend) under changing light : the colors are learned with the usual light and the balls
+    are classified with a darker or brighter light (gain of the frame)
+
+    Source : Mulnard T.
+
+    :param gains: float tuple : gains of the light of the classified frames
+    :param frames: integer : frames classified for each gain
+    :param params: parameters of the table
+    :return: dictionary : by gain, share of the balls found with the right color for the ranges and for the learned
+             colors, duration (milliseconds) of the classification of a frame and of the compilation of the models
+    """
+    positions = {"WHITE": (300, 300), "YELLOW": (700, 450), "RED": (1100, 300), "BLUE": (500, 650)}
+    balls = {}
+    camera = cameras.SimulatedCameraBackend(None, params, player=lambda: balls)
+
+    # learning with the usual light, one color at a time
+    samples = {}
+    for name in positions:
+        balls = {name: positions[name]}
+        for _ in range(2):
+            sampleFrame(camera.capture().copy(), name, samples, params)
+    models = learnModels(samples)
+    timeStart = time.perf_counter()
+    classifier = compileClassifier(models)
+    results = {"compile": 1000 * (time.perf_counter() - timeStart), "gains": {}}
+
+    balls = dict(positions)
+    for gain in gains:
+        result = {"ranges": 0, "learned": 0, "rangesTime": 0.0, "learnedTime": 0.0}
+        for _ in range(frames):
+            image = cv2.convertScaleAbs(camera.capture(), alpha=gain)
+            tagCenters = imgProcess.tagDetect(image, params.tagType, params.tagScale)[0]
+            image = imgProcess.warpPerspective(image, tagCenters, params.warpOffset, params=params)
+            image = imgProcess.removeBackground(image, params.bRectDist, params.bCircRad, params=params)
+            for key, model in (("ranges", None), ("learned", classifier)):
+                timeStart = time.perf_counter()
+                found = imgProcess.circleDetection(image.copy(), minDist=50, minRadius=15, maxRadius=70,
+                                                   imgDisplayOut=False, params=params, classifier=model)[1]
+                result[key + "Time"] += time.perf_counter() - timeStart
+                result[key] += sum(np.hypot(*np.subtract(found[name], position)) < cameras.BALL_RADIUS
+                                   for name, position in positions.items() if name in found)
+        for key in ("ranges", "learned"):
+            result[key] /= frames * len(positions)
+            result[key + "Time"] *= 1000 / frames
+        results["gains"][gain] = result
+    return results
+
+
+# FUNCTION to run the benchmark and print the results
+def showBenchmark():
+    """ FUNCTION to run the benchmark and print the results
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    results = benchmark()
+    print("      > compilation of the learned colors : {:.1f} ms".format(results["compile"]))
+    for gain, result in results["gains"].items():
+        print("      > light x{:.1f} : ranges {:4.0%} in {:5.2f} ms | learned {:4.0%} in {:5.2f} ms".format(
+            gain, result["ranges"], result["rangesTime"], result["learned"], result["learnedTime"]))
@@ -0,0 +1,198 @@
+""" Debug images part of the project
+This script writes the intermediate images of the detection (warped, no background, circles), of the keystone and of
+the games on a background thread, so that the PNG compression is not done during the shot. A policy chooses the
+frames to keep (never, one frame every N, or only the frames where the detection failed)
+"""
+
+import cv2
+import glob
+import os
+import queue
+import threading
+import time
+from scripts import parameters as p
+
+# maximum number of images waiting to be written (the new images are dropped when the queue is full)
+QUEUE_SIZE = 16
+
+# images waiting to be written : (path, image array, parameters of the table)
+imageQueue = queue.Queue(maxsize=QUEUE_SIZE)
+
+# thread writing the images (started with the first image) and lock of its start (the tables call from their threads)
+writerThread = None
+writerLock = threading.Lock()
+
+# number of frames seen by the policy, of written images and of images dropped because the queue was full
+stats = {"frames": 0, "written": 0, "dropped": 0}
+
+# files written for each rotating name, oldest first
+rotation = {}
+
+
+# PRIVATE FUNCTION to get the final path of an image
+def __outputPath(path, params):
+    """ PRIVATE FUNCTION to get the final path of an image (format of the parameters, timestamp if rotating)
+
+    :param path: string : path given by the program (ex: assets/output/1-warped.png)
+    :param params: parameters of the table
+    :return: string : path of the written file
+    """
+    base = os.path.splitext(path)[0]
+    if params.debugKeep <= 0:
+        return base + params.debugFormat
+
+    stamp = time.strftime("%Y%m%d-%H%M%S") + "-{:03d}".format(int(time.time() * 1000) % 1000)
+    return "{}-{}{}".format(base, stamp, params.debugFormat)
+
+
+# PRIVATE FUNCTION to remove the oldest files of a rotating name
+def __rotate(path, written, keep):
+    """ PRIVATE FUNCTION to remove the oldest files of a rotating name
+
+    :param path: string : path given by the program
+    :param written: string : path of the file which has just been written
+    :param keep: integer : number of files kept per name
+    """
+    base = os.path.splitext(path)[0]
+    if base not in rotation:
+        # files of a previous run are part of the rotation
+        rotation[base] = sorted(glob.glob(base + "-????????-??????-???.*"))
+    files = rotation[base]
+    if written not in files:
+        files.append(written)
+    while len(files) > keep:
+        try:
+            os.remove(files.pop(0))
+        except OSError:
+            pass
+
+
+# PRIVATE FUNCTION to get the options of the image format
+def __writeOptions(params):
+    """ PRIVATE FUNCTION to get the options of cv2.imwrite for the format of the parameters
+
+    :param params: parameters of the table
+    :return: list of integers : options of cv2.imwrite
+    """
+    if params.debugFormat == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, params.debugQuality]
+    elif params.debugFormat in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, params.debugQuality]
+    return []
+
+
+# PRIVATE FUNCTION run by the writer thread
+def __writeImages():
+    """ PRIVATE FUNCTION run by the writer thread : write the images of the queue (format, quality and rotation of the
+    parameters of the table of each image)
+    """
+    while True:
+        path, image, params = imageQueue.get()
+        written = path
+        try:
+            written = __outputPath(path, params)
+            if cv2.imwrite(written, image, __writeOptions(params)):
+                stats["written"] += 1
+                if params.debugKeep > 0:
+                    __rotate(path, written, params.debugKeep)
+        except (cv2.error, OSError):
+            print("<WARNING> debug image {} not written".format(written))
+        finally:
+            # flush waits for every image, written or not
+            imageQueue.task_done()
+
+
+# PRIVATE FUNCTION to put an image in the queue
+def __enqueue(path, image, params):
+    """ PRIVATE FUNCTION to put an image in the queue (never blocks)
+
+    :param path: string : path given by the program
+    :param image: image array : must not be modified afterwards (copy of the buffers reused by the next frame)
+    :param params: parameters of the table
+    """
+    global writerThread
+    with writerLock:
+        if writerThread is None:
+            writerThread = threading.Thread(target=__writeImages, name="debugWriter", daemon=True)
+            writerThread.start()
+    try:
+        imageQueue.put_nowait((path, image, params))
+    except queue.Full:
+        stats["dropped"] += 1
+
+
+# FUNCTION to start the debug images of a frame
+def newFrame(params=p):
+    """ FUNCTION to start the debug images of a frame
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table (default : parameters module)
+    :return: list where the images of the frame are kept, None if the frame is not sampled by the policy
+    """
+    stats["frames"] += 1
+    if params.debugPolicy == "every" and (stats["frames"] - 1) % params.debugEvery == 0:
+        return []
+    elif params.debugPolicy == "failure":
+        # the result of the frame is not known yet, its images are kept until endFrame
+        return []
+    return None
+
+
+# FUNCTION to add an image to the current frame
+def addImage(frame, path, image):
+    """ FUNCTION to add an image to the current frame
+
+    Source : Mulnard T.
+
+    :param frame: list coming from newFrame (None = nothing is done)
+    :param path: string : path of the image
+    :param image: image array (copied)
+    :return: nothing
+    """
+    if frame is not None:
+        frame.append((path, image.copy()))
+
+
+# FUNCTION to end the frame and send its images to the writer
+def endFrame(frame, failure=False, params=p):
+    """ FUNCTION to end the frame and send its images to the writer
+
+    Source : Mulnard T.
+
+    :param frame: list coming from newFrame (None = nothing is done)
+    :param failure: boolean : if the detection of the frame failed
+    :param params: parameters of the table (default : parameters module)
+    :return: nothing
+    """
+    if frame is None or (params.debugPolicy == "failure" and not failure):
+        return
+    for path, image in frame:
+        __enqueue(path, image, params)
+
+
+# FUNCTION to write a single image in the background
+def saveImage(path, image, params=p):
+    """ FUNCTION to write a single image in the background (keystone, game display), except with the policy 'never'
+
+    Source : Mulnard T.
+
+    :param path: string : path of the image
+    :param image: image array
+    :param params: parameters of the table (default : parameters module)
+    :return: nothing
+    """
+    if params.debugPolicy != "never":
+        __enqueue(path, image.copy(), params)
+
+
+# FUNCTION to wait until all the images are written
+def flush():
+    """ FUNCTION to wait until all the images of the queue are written (before leaving the program)
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    if writerThread is not None:
+        imageQueue.join()
@@ -0,0 +1,230 @@
+""" Detection gate part of the project
+This script skips the detection of the frames where nothing moved : a small thumbnail of each frame is compared with
+the thumbnail of the last analysed frame. Without any change the balls of that frame are given again, with a few
+small changes only the regions of the table around them are warped and analysed (the tags, the warp and the color of
+the table are kept), and the whole frame is analysed otherwise. The frames and the time of each case are kept for the
+report, with the time saved compared to a full analysis
+"""
+
+import cv2
+import numpy as np
+from scripts import imgProcess, parameters as p
+
+# size (w, h) of the thumbnails (one pixel for 20 x 20 pixels of the camera frame)
+THUMB_SIZE = (100, 72)
+
+# largest share of the table covered by the changed regions analysed alone (a larger change analyses the whole frame)
+MAX_REGION_SHARE = 0.25
+
+# margin (pixels of the warped image) around a changed region : largest radius of a ball and half of the morphology
+# kernel of the background removal
+REGION_MARGIN = 90
+
+# resolution (pixels) of the accumulator of the circle detection : the regions start on its grid, so a ball is found
+# at the same position as in the whole warped image
+ACCUMULATOR_STEP = 7
+
+# distance (pixels of the thumbnails) between a tag and a change that needs the whole frame (the tags may have moved)
+TAG_CLEARANCE = 3
+
+# results of the gate : balls of the last analysed frame, analysis of the changed regions, analysis of the frame
+STATES = ("hit", "region", "full")
+
+
+# FUNCTION to create the gate of the detection
+def newGate(params=p):
+    """ FUNCTION to create the gate of the detection
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table (threshold of the gate)
+    :return: dictionary : state of the gate
+    """
+    return {"threshold": params.gateThreshold,
+            "thumb": None,
+            "frameShape": None,
+            "reference": None,
+            "balls": None,
+            "scale": 1.0,
+            "tags": None,
+            "matrix": None,
+            "tableRange": None,
+            "frames": dict.fromkeys(STATES, 0),
+            "time": dict.fromkeys(STATES, 0.0)}
+
+
+# PRIVATE FUNCTION to get a changed region in the warped image
+def __tableRegion(gate, rect, frameShape, params):
+    """ PRIVATE FUNCTION to get the region of the warped image seen by a rectangle of the thumbnail
+
+    :param gate: dictionary : state of the gate
+    :param rect: integer tuple : changed rectangle (x, y, w, h) of the thumbnail
+    :param frameShape: tuple : shape of the camera frame
+    :param params: parameters of the table (size of the warped image)
+    :return: dictionary : changed rectangle of the thumbnail, changed part of the table (x0, y0, x1, y1) and analysed
+             part with its margin, None if the change is outside the table
+    """
+    x, y, w, h = rect
+    scaleX, scaleY = frameShape[1] / THUMB_SIZE[0], frameShape[0] / THUMB_SIZE[1]
+    corners = np.float32([[[x, y], [x + w, y], [x + w, y + h], [x, y + h]]]) * (scaleX, scaleY)
+    corners = cv2.perspectiveTransform(corners, gate["matrix"])[0]
+    x0, y0 = np.floor(corners.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(corners.max(axis=0)).astype(int)
+    core = (max(x0, 0), max(y0, 0), min(x1, params.width), min(y1, params.height))
+    if core[0] >= core[2] or core[1] >= core[3]:
+        return None
+    area = (max(x0 - REGION_MARGIN, 0) // ACCUMULATOR_STEP * ACCUMULATOR_STEP,
+            max(y0 - REGION_MARGIN, 0) // ACCUMULATOR_STEP * ACCUMULATOR_STEP,
+            min(x1 + REGION_MARGIN, params.width), min(y1 + REGION_MARGIN, params.height))
+    return {"thumb": rect, "core": core, "area": area}
+
+
+# FUNCTION to compare a frame with the last analysed frame
+def checkFrame(gate, image, params=p, scale=1.0):
+    """ FUNCTION to compare a frame with the last analysed frame (largest difference of the BGR values of each pixel
+    of the thumbnails)
+
+    Source : Mulnard T.
+
+    :param gate: dictionary : state of the gate
+    :param image: image array : frame of the camera
+    :param params: parameters of the table (size of the warped image)
+    :param scale: float : working scale of the caller (the balls of a frame analysed at a lower scale are less
+                  accurate than asked : the whole frame is analysed)
+    :return: string : result of the gate (see STATES), list of the changed regions to analyse (see analyseRegions)
+    """
+    gate["thumb"] = cv2.resize(image, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    gate["frameShape"] = image.shape[:2]
+    if gate["threshold"] <= 0 or gate["balls"] is None or gate["scale"] < scale:
+        return "full", []
+
+    difference = cv2.absdiff(gate["thumb"], gate["reference"]).max(axis=2)
+    changed = (difference > gate["threshold"]).astype(np.uint8)
+    if not changed.any():
+        return "hit", []
+
+    # one region per group of changed pixels, the whole frame if a tag may have moved or if the regions are too large
+    count, _, stats, _ = cv2.connectedComponentsWithStats(cv2.dilate(changed, np.ones((3, 3), np.uint8)))
+    thumbScale = np.float32([THUMB_SIZE[0] / image.shape[1], THUMB_SIZE[1] / image.shape[0]])
+    tags = np.float32(list(gate["tags"].values())) * thumbScale
+    regions = []
+    for x, y, w, h, _ in stats[1:count].tolist():
+        if np.any((tags[:, 0] > x - TAG_CLEARANCE) & (tags[:, 0] < x + w + TAG_CLEARANCE) &
+                  (tags[:, 1] > y - TAG_CLEARANCE) & (tags[:, 1] < y + h + TAG_CLEARANCE)):
+            return "full", []
+        region = __tableRegion(gate, (x, y, w, h), image.shape, params)
+        if region is not None:
+            regions.append(region)
+    covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in (region["area"] for region in regions))
+    if covered > MAX_REGION_SHARE * params.width * params.height:
+        return "full", []
+    return "region", regions
+
+
+# FUNCTION to analyse the changed regions of a frame
+def analyseRegions(gate, image, regions, params=p, classifier=None):
+    """ FUNCTION to analyse the changed regions of a frame : each region is warped with the warp of the last analysed
+    frame, its background is removed with the color of the table of that frame and its balls replace the balls of the
+    last analysed frame in the changed part of the table (same settings as scriptDP.detectBallTags at full scale)
+
+    Source : Mulnard T.
+
+    :param gate: dictionary : state of the gate
+    :param image: image array : frame of the camera
+    :param regions: list coming from checkFrame
+    :param params: parameters of the table
+    :param classifier: dictionary : lookup classifier of the learned colors (see imgProcess.classifyCircles)
+    :return: structured array of the balls (imgProcess.BALL_DTYPE)
+    """
+    balls = gate["balls"]
+    for region in regions:
+        x0, y0, x1, y1 = region["area"]
+        shift = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+        roi = cv2.warpPerspective(image, shift @ gate["matrix"], (x1 - x0, y1 - y0))
+        roi = imgProcess.removeBackground(roi, params.bRectDist, params.bCircRad, params=params, origin=(x0, y0),
+                                          tableRange=gate["tableRange"])
+        found = imgProcess.circleDetection(roi, dp=ACCUMULATOR_STEP, minDist=50, minRadius=15, maxRadius=70,
+                                           imgDisplayOut=False, params=params, param2=100, structured=True,
+                                           classifier=classifier)[1]
+        found["x"] += x0
+        found["y"] += y0
+
+        # the balls of the changed part come from the region, the others from the last analysed frame
+        cx0, cy0, cx1, cy1 = region["core"]
+        balls = np.concatenate([
+            balls[~((balls["x"] >= cx0) & (balls["x"] < cx1) & (balls["y"] >= cy0) & (balls["y"] < cy1))],
+            found[(found["x"] >= cx0) & (found["x"] < cx1) & (found["y"] >= cy0) & (found["y"] < cy1)]])
+        x, y, w, h = region["thumb"]
+        gate["reference"][y:y + h, x:x + w] = gate["thumb"][y:y + h, x:x + w]
+
+    gate["balls"] = balls
+    return balls
+
+
+# FUNCTION to keep the result of a full analysis
+def storeFrame(gate, balls, tagCenters, params=p, scale=1.0):
+    """ FUNCTION to keep the result of the full analysis of the last checked frame : thumbnail, balls, tags, warp and
+    color of the table (the next frames are compared with this one)
+
+    Source : Mulnard T.
+
+    :param gate: dictionary : state of the gate
+    :param balls: structured array of the balls (imgProcess.BALL_DTYPE)
+    :param tagCenters: dictionary : centers of the 4 tags of the frame (coming from imgProcess.tagDetect), empty if
+                       the tags were not found (nothing is kept)
+    :param params: parameters of the table
+    :param scale: float : working scale of the analysis of the frame (1 = image_resolution)
+    :return: nothing
+    """
+    if tagCenters == {}:
+        gate["balls"] = None
+        return
+    gate["reference"] = gate["thumb"]
+    gate["balls"] = balls.copy()
+    gate["scale"] = scale
+    gate["tags"] = dict(tagCenters)
+    gate["matrix"] = imgProcess.warpMatrix(tagCenters, params.warpOffset, params)
+
+    # color of the table in the thumbnail warped at a tenth of the warped image
+    height, width = gate["frameShape"]
+    toFrame = np.diag([width / THUMB_SIZE[0], height / THUMB_SIZE[1], 1])
+    small = cv2.warpPerspective(gate["thumb"], np.diag([0.1, 0.1, 1]) @ gate["matrix"] @ toFrame,
+                                (params.width // 10, params.height // 10))
+    gate["tableRange"] = imgProcess.tableColorRange(small, params)
+
+
+# FUNCTION to add a checked frame to the report
+def recordFrame(gate, state, duration):
+    """ FUNCTION to add a checked frame to the report of the gate
+
+    Source : Mulnard T.
+
+    :param gate: dictionary : state of the gate
+    :param state: string : result of the gate (see STATES)
+    :param duration: float : duration (seconds) of the detection of the frame
+    :return: nothing
+    """
+    gate["frames"][state] += 1
+    gate["time"][state] += duration
+
+
+# FUNCTION to get the report of the gate
+def gateReport(gate):
+    """ FUNCTION to get the report of the gate : share of the frames and mean duration of each result, time saved
+    compared to a full analysis of every frame
+
+    Source : Mulnard T.
+
+    :param gate: dictionary : state of the gate
+    :return: dictionary : frames, hit rate (balls given again or changed regions only), time saved (seconds) and for
+             each result the share of the frames and the mean duration (seconds)
+    """
+    frames = sum(gate["frames"].values())
+    fullTime = gate["time"]["full"] / gate["frames"]["full"] if gate["frames"]["full"] > 0 else 0.0
+    report = {"frames": frames,
+              "hitRate": (frames - gate["frames"]["full"]) / frames if frames > 0 else 0.0,
+              "saved": sum(gate["frames"][state] * fullTime - gate["time"][state] for state in ("hit", "region"))}
+    for state in STATES:
+        report[state] = {"share": gate["frames"][state] / frames if frames > 0 else 0.0,
+                         "time": gate["time"][state] / gate["frames"][state] if gate["frames"][state] > 0 else 0.0}
+    return report
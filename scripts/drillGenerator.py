@@ -0,0 +1,263 @@
+""" Drill generator part of the project
+This script generates drills from a few parameters (number of targets, radius of the zones, obstacles) along a
+difficulty ladder. A generated drill has the same definition as the json files (see gameEngine.py) with fixed
+coordinates, and it is drawn straight into the projected image : only the geometry of the zones goes through the
+keystone matrix, instead of warping a full template image and detecting its targets
+"""
+
+import cv2
+import numpy as np
+import time
+from scripts import gameEngine, parameters as p
+
+# first id of the generated drills (id of a generated drill = GENERATED_ID + level, for the statistics per level)
+GENERATED_ID = 100
+
+# difficulty ladder : number of targets, radius of the targets (part of game_zone_radius), number of obstacles, minimum
+# distance (pixels) between the start and the target of a ball and maximum distance (pixels) of the obstacles to the
+# line of the shot
+LEVELS = ({"targets": 1, "radius": 1.5, "obstacles": 0, "distance": 300, "lane": 0},
+          {"targets": 1, "radius": 1.0, "obstacles": 0, "distance": 500, "lane": 0},
+          {"targets": 1, "radius": 1.0, "obstacles": 1, "distance": 500, "lane": 200},
+          {"targets": 1, "radius": 0.8, "obstacles": 2, "distance": 600, "lane": 120},
+          {"targets": 2, "radius": 1.0, "obstacles": 0, "distance": 400, "lane": 0},
+          {"targets": 2, "radius": 0.8, "obstacles": 1, "distance": 500, "lane": 150},
+          {"targets": 2, "radius": 0.6, "obstacles": 2, "distance": 600, "lane": 100})
+
+# balls sent to a target with the color of their target, and balls used as obstacles
+TARGET_BALLS = (("WHITE", "BROWN"), ("YELLOW", "CYAN"))
+OBSTACLE_BALLS = ("RED", "BLUE")
+
+# playing area of the table (part of the width and height of the image, as in the images of assets/games/)
+PLAY_AREA = (0.12, 0.12, 0.88, 0.88)
+
+# radius (pixels) of the marks of the balls and of the targets, and number of points of the drawn circles
+MARK_RADIUS = 28
+CIRCLE_POINTS = 72
+
+# colors (BGR) of the marks of the balls, of the playing area and of the border of the projected image
+MARK_COLORS = {"WHITE": (255, 255, 255), "YELLOW": (0, 255, 255), "RED": (0, 0, 255), "BLUE": (255, 0, 0)}
+AREA_COLOR = (0, 0, 0)
+BORDER_COLOR = (54, 54, 54)
+
+# sub-pixel bits of the drawn polygons
+DRAW_SHIFT = 4
+
+# maximum number of random positions tried for each ball or target
+PLACE_ATTEMPTS = 500
+
+
+# PRIVATE FUNCTION to place a point away from the other points
+def __placePoint(generator, low, high, placed, clearance, origin=None, minDistance=0, lane=None):
+    """ PRIVATE FUNCTION to draw random points until one is far enough from the other points
+
+    :param generator: numpy random generator
+    :param low: float tuple : smallest coordinates of the playing area
+    :param high: float tuple : largest coordinates of the playing area
+    :param placed: list of tuples : points already placed (x, y, clearance)
+    :param clearance: float : free radius needed around the point
+    :param origin: float tuple : point from which the new point is at least at minDistance
+    :param minDistance: float : minimum distance to the origin
+    :param lane: tuple : start, end and half width of the lane where the point is drawn (default : whole area)
+    :return: float tuple : new point (ValueError if no point fits)
+    """
+    for _ in range(PLACE_ATTEMPTS):
+        if lane is None:
+            point = generator.uniform(low, high)
+        else:
+            start, end, halfWidth = lane
+            along = end - start
+            normal = np.array([-along[1], along[0]]) / max(np.hypot(*along), 1e-6)
+            point = start + generator.uniform(0.3, 0.7) * along + generator.uniform(-halfWidth, halfWidth) * normal
+            if np.any(point < low) or np.any(point > high):
+                continue
+        if origin is not None and np.hypot(*(point - origin)) < minDistance:
+            continue
+        if all(np.hypot(point[0] - x, point[1] - y) >= clearance + other for x, y, other in placed):
+            placed.append((point[0], point[1], clearance))
+            return point
+    raise ValueError("no free position found for the drill, use a smaller zone radius")
+
+
+# FUNCTION to generate a drill
+def generateDrill(level, seed=None, targetRadius=p.zoneRadius, placementRadius=100, params=p):
+    """ FUNCTION to generate a drill of a level of the difficulty ladder
+
+    Each target ball gets a start position and a target far enough from it, then the obstacles are put near the line
+    of a shot : an obstacle must not move (hold zone with the penalty of the obstacle game).
+
+    Source : Mulnard T.
+
+    :param level: integer : level of the ladder (1 = easiest, see LEVELS)
+    :param seed: integer : seed of the positions (None = new drill at each call)
+    :param targetRadius: integer : radius of the finish zones of the ladder (default : parameter game_zone_radius)
+    :param placementRadius: integer : radius for the correct start position
+    :param params: parameters of the table (size of the image)
+    :return: dictionary : drill definition (see gameEngine.loadDrill), with its level and seed
+    """
+    level = min(max(level, 1), len(LEVELS))
+    ladder = LEVELS[level - 1]
+    generator = np.random.default_rng(seed)
+    radius = int(round(targetRadius * ladder["radius"]))
+    low = np.array([PLAY_AREA[0] * params.width, PLAY_AREA[1] * params.height]) + MARK_RADIUS
+    high = np.array([PLAY_AREA[2] * params.width, PLAY_AREA[3] * params.height]) - MARK_RADIUS
+
+    placed = []
+    balls = []
+    zones = []
+    terms = []
+    shots = []
+    for ball, color in TARGET_BALLS[:ladder["targets"]]:
+        start = __placePoint(generator, low, high, placed, placementRadius / 2)
+        finish = __placePoint(generator, low, high, placed, radius, start, ladder["distance"])
+        shots.append((start, finish))
+        balls.append(ball)
+        zones.append({"name": ball.lower() + " start", "kind": "start", "ball": ball,
+                      "center": [round(float(start[0]), 1), round(float(start[1]), 1)], "radius": "placement"})
+        zones.append({"name": ball.lower() + " finish", "kind": "target", "ball": ball,
+                      "center": [round(float(finish[0]), 1), round(float(finish[1]), 1)], "radius": radius,
+                      "color": color, "message": "The {} ball is not in its target".format(ball.lower())})
+        terms.append({"ball": ball, "zone": ball.lower() + " finish", "weight": 1})
+
+    for index, ball in enumerate(OBSTACLE_BALLS[:ladder["obstacles"]]):
+        start, finish = shots[index % len(shots)]
+        obstacle = __placePoint(generator, low, high, placed, placementRadius / 2,
+                                lane=(start, finish, ladder["lane"]))
+        center = [round(float(obstacle[0]), 1), round(float(obstacle[1]), 1)]
+        balls.append(ball)
+        zones.append({"name": ball.lower() + " start", "kind": "start", "ball": ball, "center": center,
+                      "radius": "placement"})
+        zones.append({"name": ball.lower() + " obstacle", "kind": "hold", "ball": ball, "center": center,
+                      "radius": "placement", "message": "The {} ball moved".format(ball.lower()),
+                      "penalty": {"terms": [{"ball": ball, "zone": ball.lower() + " obstacle", "weight": 2}],
+                                  "divisor": 1}})
+
+    return {"id": GENERATED_ID + level,
+            "name": "level {}".format(level),
+            "description": "send {} in {} without moving the other balls".format(
+                " and ".join(ball.lower() for ball, _ in TARGET_BALLS[:ladder["targets"]]),
+                "its zone" if ladder["targets"] == 1 else "their zones"),
+            "level": level,
+            "seed": seed,
+            "balls": balls,
+            "zones": zones,
+            "score": {"terms": terms, "divisor": len(terms)}}
+
+
+# PRIVATE FUNCTION to get the points of circles
+def __circlePoints(centers, radius):
+    """ PRIVATE FUNCTION to get the points of circles (polygons of CIRCLE_POINTS points)
+
+    :param centers: float array (n, 2) : centers of the circles
+    :param radius: float array (n) : radius of the circles
+    :return: float array (n, CIRCLE_POINTS, 2) : points of the circles
+    """
+    angles = np.linspace(0, 2 * np.pi, CIRCLE_POINTS, endpoint=False)
+    unit = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    return centers[:, None, :] + radius[:, None, None] * unit[None, :, :]
+
+
+# FUNCTION to draw a drill in the projected image
+def renderDrill(drill, targetRadius=p.zoneRadius, placementRadius=100, matrixTransform=None, params=p, dst=None):
+    """ FUNCTION to draw a drill with fixed coordinates in the projected image, and compile its layout
+
+    The playing area, the marks of the balls and the targets are polygons of the table : all their points go through
+    the keystone matrix at once and are drawn with sub-pixel precision. The centers of the layout are moved the same
+    way, as the targets detected in the warped image of gameEngine.prepareDrill.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d6/d6e/group__imgproc__draw.html
+
+    :param drill: dictionary : drill definition with fixed coordinates (see generateDrill)
+    :param targetRadius: integer : radius of the finish zones named 'target'
+    :param placementRadius: integer : radius for the correct start position
+    :param matrixTransform: float array : keystone matrix (default : loaded from the keystone data file)
+    :param params: parameters of the table (size of the image and colors of the games)
+    :param dst: image array : projected image to draw in (see bufferPool.py), None to allocate a new one
+    :return: image array to display, dictionary : compiled layout of the drill
+    """
+    if matrixTransform is None:
+        matrixTransform = np.loadtxt(p.kstData, delimiter=",")
+    layout = gameEngine.compileDrill(drill, {}, targetRadius, placementRadius)
+
+    # marks of the balls at their start, marks and outlines of the targets
+    marks, colors, outlines = [], [], []
+    for i, zone in enumerate(drill["zones"]):
+        if zone["kind"] == "start":
+            marks.append(i)
+            colors.append(MARK_COLORS[zone["ball"]])
+        elif zone["kind"] == "target":
+            marks.append(i)
+            colors.append(tuple(getattr(params, "gmCol" + zone["color"] + "Max")))
+            outlines.append(i)
+    centers = layout["centers"].astype(np.float64)
+    circles = np.concatenate([__circlePoints(centers[marks], np.full(len(marks), MARK_RADIUS)),
+                              __circlePoints(centers[outlines], layout["radius"][outlines])])
+    area = np.array([[PLAY_AREA[0] * params.width, PLAY_AREA[1] * params.height],
+                     [PLAY_AREA[2] * params.width, PLAY_AREA[1] * params.height],
+                     [PLAY_AREA[2] * params.width, PLAY_AREA[3] * params.height],
+                     [PLAY_AREA[0] * params.width, PLAY_AREA[3] * params.height]])
+
+    # every point of the drill (area, circles, centers) through the keystone matrix in a single call
+    points = np.concatenate([area, circles.reshape((-1, 2)), centers]).astype(np.float32)
+    projected = cv2.perspectiveTransform(points[None], matrixTransform)[0]
+    fixed = np.round(projected * (1 << DRAW_SHIFT)).astype(np.int32)
+    circles = fixed[4:4 + circles.shape[0] * CIRCLE_POINTS].reshape((-1, CIRCLE_POINTS, 2))
+    layout["centers"] = projected[-len(centers):]
+
+    if dst is None:
+        dst = np.empty((params.height, params.width, 3), dtype=np.uint8)
+    cv2.rectangle(dst, (0, 0), (params.width, params.height), BORDER_COLOR, -1)
+    cv2.fillPoly(dst, [fixed[:4]], AREA_COLOR, cv2.LINE_AA, DRAW_SHIFT)
+    for circle, color in zip(circles[:len(marks)], colors):
+        cv2.fillPoly(dst, [circle], color, cv2.LINE_AA, DRAW_SHIFT)
+    for circle, i in zip(circles[len(marks):], outlines):
+        cv2.polylines(dst, [circle], True, tuple(getattr(params, "gmCol" + drill["zones"][i]["color"] + "Max")), 4,
+                      cv2.LINE_AA, DRAW_SHIFT)
+
+    return dst, layout
+
+
+# FUNCTION to move on the difficulty ladder
+def nextLevel(level, win):
+    """ FUNCTION to move on the difficulty ladder : one level up after a win, one level down after a loss
+
+    Source : Mulnard T.
+
+    :param level: integer : level of the last drill
+    :param win: boolean : if the last drill is won
+    :return: integer : level of the next drill
+    """
+    return min(level + 1, len(LEVELS)) if win else max(level - 1, 1)
+
+
+# FUNCTION to measure the setup of the generated drills
+def benchmark(count=200, matrixTransform=None, params=p):
+    """ FUNCTION to measure the setup of the generated drills (generation and drawing) against a template drill
+    (warp of the image and detection of its targets)
+
+    Source : Mulnard T.
+
+    :param count: integer : number of generated drills
+    :param matrixTransform: float array : keystone matrix (default : loaded from the keystone data file)
+    :param params: parameters of the table
+    :return: dictionary : mean setup (milliseconds) of a generated and of a template drill, number of generated drills
+             per level
+    """
+    if matrixTransform is None:
+        matrixTransform = np.loadtxt(p.kstData, delimiter=",")
+    image = np.empty((params.height, params.width, 3), dtype=np.uint8)
+    levels = [0] * len(LEVELS)
+
+    timeStart = time.perf_counter()
+    for seed in range(count):
+        drill = generateDrill(seed % len(LEVELS) + 1, seed, params.zoneRadius, params=params)
+        renderDrill(drill, params.zoneRadius, matrixTransform=matrixTransform, params=params, dst=image)
+        levels[drill["level"] - 1] += 1
+    generated = (time.perf_counter() - timeStart) / count
+
+    timeStart = time.perf_counter()
+    gameEngine.prepareDrill(gameEngine.loadDrill(p.gm1Drill), params.zoneRadius, matrixTransform=matrixTransform,
+                            params=params)
+    template = time.perf_counter() - timeStart
+
+    return {"generated": 1000 * generated, "template": 1000 * template, "levels": levels}
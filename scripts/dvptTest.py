@@ -2,9 +2,14 @@
 This file is used for different test when developping the program to avoid to clustering the main menu
 """
 
-from scripts import scriptDP, imgProcess, parameters as p
+from scripts import scriptDP, imgProcess, ballRack, bufferPool, cameras, colorLearning, drillGenerator, frameBus, \
+    keystoneMonitor, latencyTest, motionPredict, parallelTiles, projectors, samplingProfiler, shotCapture, shotLog, \
+    tableRuntime, tagAccuracy, virtualRig, parameters as p
 import cv2
 import datetime as t
+import multiprocessing
+import numpy as np
+import time
 
 
 # FUNCTION to display the test menu
@@ -19,6 +24,23 @@ def testsMenu():
         print("{:50s} │".format("│ 4. test image : circle detection"))
         print("{:50s} │".format("│ 5. test image : projector keystone"))
         print("{:50s} │".format("│ 6. batch test : tag detection"))
+        print("{:50s} │".format("│ 7. shot log : heatmap report"))
+        print("{:50s} │".format("│ 8. multi-table : run the tables"))
+        print("{:50s} │".format("│ 9. memory : allocations per frame"))
+        print("{:50s} │".format("│ 10. strips : background removal scaling"))
+        print("{:50s} │".format("│ 11. motion : rest prediction of a shot"))
+        print("{:50s} │".format("│ 12. shot capture : replay of recorded frames"))
+        print("{:50s} │".format("│ 13. latency : projector to detection loop"))
+        print("{:50s} │".format("│ 14. frame bus : reader process"))
+        print("{:50s} │".format("│ 15. full rack : detection from 2 to 22 balls"))
+        print("{:50s} │".format("│ 16. keystone : drift check of the test image"))
+        print("{:50s} │".format("│ 17. tags : accuracy of the detection modes"))
+        print("{:50s} │".format("│ 18. generated drills : setup of 200 drills"))
+        print("{:50s} │".format("│ 19. virtual rig : unattended games"))
+        print("{:50s} │".format("│ 20. colors : learned colors against the ranges"))
+        print("{:50s} │".format("│ 21. detection gate : frames without changes"))
+        print("{:50s} │".format("│ 22. cameras : table covered by two cameras"))
+        print("{:50s} │".format("│ 23. profiler : where the time of the shot goes"))
         print("{:50s} │".format("│ 0. go to main menu"))
         print("╰──────────────────────────────────────────────────╯")
         cmdInput = input("[tests] Enter you option : ")
@@ -93,6 +115,233 @@ def testsMenu():
             print("      > time | total of {} with average time of {} and max (N°{}) of {}".format(
                 timeTotal, timeTotal / len(timeList), idFile, timeMax))
 
+        # shot log : dispersion report and heatmap of the final positions
+        elif option == 7:
+            print("[tests] Heatmap report of the shot log")
+            ball = input("      > which ball ? (WHITE / YELLOW / RED / BLUE) : ").upper() or "WHITE"
+            drill = input("      > which drill id ? ('Enter' for all) : ")
+            try:
+                shotLog.showReport(p.shotLogDir, ball, int(drill) if drill != "" else None)
+            except ValueError:
+                print("<Error> Please enter a valid ball and drill id")
+
+        # multi-table : run every table of the configuration file
+        elif option == 8:
+            print("[tests] Multi-table run of " + p.tablesConfig)
+            try:
+                tableRuntime.showRun(int(input("      > how many frames per table ? : ")))
+            except ValueError:
+                print("<Error> Please enter a valid number")
+
+        # memory : allocations per frame of the detection, with and without the buffer pool
+        elif option == 9:
+            print("[tests] Allocations per frame of the detection on the test image")
+            image = cv2.imread(p.testImgPath)
+            if image is None:
+                print("<Error> test image not found : " + p.testImgPath)
+            else:
+                frame = image.copy()
+                scriptDP.verbose = False
+
+                def detectFrame():
+                    frame[...] = image
+                    scriptDP.detectBallFrame(frame, debugOut=False)
+
+                for useBufferPool in (False, True):
+                    scriptDP.useBufferPool = useBufferPool
+                    report = bufferPool.memoryReport(detectFrame)
+                    print("      > buffer pool {:3s} : peak of {:6.1f} MB per frame (max {:6.1f} MB) | {:5.1f} kB kept "
+                          "per frame | {} new buffers | pool of {:.1f} MB".format(
+                            "on" if useBufferPool else "off", report["meanPeak"] / 1e6, report["maxPeak"] / 1e6,
+                            report["keptPerFrame"] / 1e3, report["newBuffers"], report["poolSize"] / 1e6))
+                scriptDP.verbose = True
+
+        # strips : scaling of the tile-parallel background removal with the number of workers
+        elif option == 10:
+            print("[tests] Background removal in parallel strips on the test image")
+            image = cv2.imread(p.testImgPath)
+            tagCenters = {} if image is None else imgProcess.tagDetect(image, p.tagType)[0]
+            if image is None:
+                print("<Error> test image not found : " + p.testImgPath)
+            elif tagCenters == {}:
+                print("<Error> Failed to detect the tags of the test image")
+            else:
+                image = imgProcess.warpPerspective(image, tagCenters, p.warpOffset)
+                lower, upper = imgProcess.tableColorRange(image)
+                for workers, duration, speedUp in parallelTiles.benchmark(image, lower, upper):
+                    print("      > {:2d} worker(s) : {:6.1f} ms | speed-up x{:.2f}".format(
+                        workers, duration * 1000, speedUp))
+
+        # motion : prediction of the rest position along a simulated shot
+        elif option == 11:
+            print("[tests] Rest prediction along a simulated shot")
+            positions, rest = motionPredict.simulateShot()
+            predictor = motionPredict.newPredictor()
+            print("      > real rest position : {} after {:.1f} s".format(rest, positions[-1][0]))
+            for frame, (timeFrame, position) in enumerate(positions):
+                motionPredict.addPosition(predictor, timeFrame, position)
+                prediction = motionPredict.predictRest(predictor)
+                if prediction is not None and frame % 10 == 0:
+                    preview = motionPredict.zonePreview(prediction, rest, p.zoneRadius)
+                    print("      > {:4.1f} s : rest {} | error {:4.0f} px | confidence {:4.0%} | in zone {:4.0%}".format(
+                        timeFrame, prediction["rest"], ((prediction["rest"][0] - rest[0]) ** 2 +
+                                                        (prediction["rest"][1] - rest[1]) ** 2) ** 0.5,
+                        prediction["confidence"], preview["chance"]))
+
+        # shot capture : window of the table at a high frame rate, with a replay instead of the camera
+        elif option == 12:
+            print("[tests] Shot capture on a replay")
+            source = input("      > frames to replay (glob pattern or video, 'Enter' = last camera frame) : ") or \
+                p.pathCamIN
+            try:
+                camera = cameras.ReplayCameraBackend(source)
+            except IOError:
+                print("<Error> No frame found for " + source)
+            else:
+                record = shotCapture.captureShot(camera, maxDuration=5, frames=200)
+                camera.close()
+                if record is not None:
+                    print("      > window {} read at {} | {} frames at {} fps | {} ms per frame | {} late frames".format(
+                        record["roi"], record["resolution"], record["frames"], record["fps"], record["processMs"],
+                        record["late"]))
+                    for event in record["events"]:
+                        print("      > {:7.3f} s : {}".format(event[0], " ".join(str(value) for value in event[1:])))
+                    shotCapture.saveRecord(record)
+                    print("      > record appended to " + p.shotEventsPath)
+
+        # latency : blinking tag projected and detected by the camera, or read back from the projector without hardware
+        elif option == 13:
+            print("[tests] Latency of the loop projector -> camera -> detection")
+            mode = input("      > 1 = projector and camera, 'Enter' = loopback without hardware : ")
+            try:
+                if mode == "1":
+                    projector = projectors.WindowProjector()
+                    camera = cameras.PiCameraBackend(p.camRes, p.camRot)
+                else:
+                    projector = projectors.BufferProjector(delay=0.02)
+                    camera = cameras.LoopbackCameraBackend(projector, fps=60)
+            except ImportError:
+                print("<Error> camera module not found, use the loopback mode")
+            else:
+                latencyTest.showLatency(projector, camera)
+                camera.close()
+                projector.close()
+
+        # frame bus : detections of the test image read by another process
+        elif option == 14:
+            print("[tests] Frame bus read by another process")
+            image = cv2.imread(p.testImgPath)
+            if image is None:
+                print("<Error> test image not found : " + p.testImgPath)
+            else:
+                # the bus of the menu is used when it is already started ("frame_bus_enabled")
+                ownBus = frameBus.activeBus is None
+                if ownBus:
+                    frameBus.startBus()
+                reader = multiprocessing.Process(target=frameBus.followBus, args=(p.busName, 3.0))
+                verbose, scriptDP.verbose = scriptDP.verbose, False
+                try:
+                    reader.start()
+                    time.sleep(0.5)
+                    timings = {}
+                    for _ in range(10):
+                        # the tag detection draws on the image
+                        scriptDP.detectBallFrame(image.copy(), timings=timings, debugOut=False)
+                        time.sleep(0.1)
+                finally:
+                    scriptDP.verbose = verbose
+                    if reader.pid is not None:
+                        reader.join()
+                    if ownBus:
+                        frameBus.stopBus()
+
+        # full rack : detection and assignment with more and more balls
+        elif option == 15:
+            print("[tests] Full rack : detection, color identification and assignment from 2 to 22 balls")
+            ballRack.showBenchmark()
+
+        # keystone monitor : reprojection error of the test image with the stored matrix and with shifted projectors
+        elif option == 16:
+            print("[tests] Keystone drift check of the test image")
+            image = cv2.imread(p.testKstIN)
+            result = keystoneMonitor.checkFrame(image)
+            if result is None:
+                print("<Error> the tags of the table and of the projector are not all visible")
+            else:
+                print("      > stored matrix : error {:.1f} px (max {:.1f} px)".format(result["error"], result["max"]))
+                for shift in (0, 2, 5, 10, 20):
+                    # matrix of a projector moved by 'shift' pixels since the calibration
+                    moved = np.array([[1, 0, shift], [0, 1, 0], [0, 0, 1]]) @ result["matrix"]
+                    error = keystoneMonitor.checkFrame(image, moved)["error"]
+                    print("      > projector moved by {:2d} px : error {:5.1f} px -> {}".format(
+                        shift, error, "recalibration" if error > p.kstMaxError else "ok"))
+
+        # tags : error of the warp with each mode of the tag detection, on rendered frames with known tags
+        elif option == 17:
+            print("[tests] Accuracy of the tag detection on rendered frames")
+            tagAccuracy.showBenchmark()
+
+        # generated drills : generation and drawing through the keystone against the warp of a drill image
+        elif option == 18:
+            print("[tests] Setup of the generated drills")
+            try:
+                result = drillGenerator.benchmark()
+            except IOError:
+                print("<Error> matrix data not found, please set the keystone before")
+            else:
+                print("      > generated drill : {:6.2f} ms | drill image : {:6.2f} ms | drills per level : {}".format(
+                    result["generated"], result["template"], result["levels"]))
+
+        # virtual rig : the 3 games played unattended with a simulated projector, camera and player
+        elif option == 19:
+            print("[tests] Unattended games on the virtual rig")
+            try:
+                virtualRig.showThroughput()
+            except IOError:
+                print("<Error> matrix data not found, please set the keystone before")
+
+        # colors : classification of the balls with the learned colors and with the ranges under changing light
+        elif option == 20:
+            print("[tests] Learned colors against the color ranges on simulated frames")
+            colorLearning.showBenchmark()
+
+        # detection gate : balls given again for the frames without changes, analysis of the changed regions only
+        elif option == 21:
+            print("[tests] Detection gate on a sequence of frames of the virtual rig")
+            virtualRig.showGate()
+
+        # cameras : longer table covered by two simulated cameras, balls merged in the overlap of their sections
+        elif option == 22:
+            print("[tests] Table covered by two cameras of the virtual rig")
+            virtualRig.showCameras()
+
+        # profiler : sampled stacks of the next frames of the camera or games of the virtual rig
+        elif option == 23:
+            print("[tests] Sampling profiler of the detection")
+            try:
+                source = int(input("      > frames of the camera (1) or games of the virtual rig (2) ? : "))
+                number = int(input("      > how many frames / games ? : "))
+            except ValueError:
+                print("<Error> Please enter a valid number")
+                source = 0
+            if source in (1, 2):
+                profiler = samplingProfiler.startProfiler()
+                try:
+                    if source == 1:
+                        scriptDP.verbose = False
+                        for _ in range(number):
+                            scriptDP.imgTake(p.pathCamIN)
+                            scriptDP.detectBall(p.pathCamIN)
+                    else:
+                        virtualRig.runThroughput(shots=number)
+                except IOError:
+                    print("<Error> matrix data not found, please set the keystone before")
+                finally:
+                    scriptDP.verbose = True
+                    samplingProfiler.stopProfiler(profiler)
+                samplingProfiler.writeCollapsed(profiler)
+                samplingProfiler.showSummary(profiler)
+
         # go back to main menu
         elif option == 0:
             print("[tests] Going back to main menu")
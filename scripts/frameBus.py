@@ -0,0 +1,339 @@
+""" Frame bus part of the project
+This script shares the frames (raw camera frames and warped images) and the last detection with the other processes
+of the Raspberry Pi (scoreboard, recorder, analytics) through shared memory, without any copy or encoding on the side
+of the vision loop. Each frame slot and the detection record are protected by a sequence number (seqlock) : the
+writer never waits, a reader checks that the sequence number did not change while it was reading
+
+Reader example : python -m scripts.frameBus (prints the detections of the running program)
+"""
+
+import numpy as np
+import time
+from multiprocessing import parent_process, resource_tracker, shared_memory
+from scripts import parameters as p
+
+# number of frames kept in each ring
+FRAME_SLOTS = 4
+
+# maximum number of balls in the detection record
+MAX_BALLS = 24
+
+# names of the balls in the detection record (index stored in the record)
+BALL_NAMES = ["WHITE", "YELLOW", "RED", "BLUE", "CYAN", "BROWN", ""]
+
+# number of attempts of a reader when the writer changes the data during the read
+READ_ATTEMPTS = 5
+
+# version of the memory layout (a reader refuses a bus with another version)
+LAYOUT_VERSION = 1
+
+# bus of the vision loop (None = the frames are not shared)
+activeBus = None
+
+# id of the last published raw frame
+frameCounter = 0
+
+
+# PRIVATE FUNCTION to map the arrays of a frame ring on its shared memory
+def __mapRing(memory, slots, capacity):
+    """ PRIVATE FUNCTION to map the arrays of a frame ring on its shared memory
+
+    Layout : header (version, slots, capacity, last frame counter), one header per slot (sequence number, frame id,
+    time in ns, height, width, channels) and the pixels of the slots.
+
+    :param memory: SharedMemory
+    :param slots: integer : number of slots
+    :param capacity: integer : bytes of a slot
+    :return: dictionary : arrays of the ring
+    """
+    header = np.ndarray((4,), dtype=np.int64, buffer=memory.buf)
+    slotHeaders = np.ndarray((slots, 8), dtype=np.int64, buffer=memory.buf, offset=64)
+    data = np.ndarray((slots, capacity), dtype=np.uint8, buffer=memory.buf, offset=64 + slots * 64)
+    return {"memory": memory, "header": header, "slots": slotHeaders, "data": data}
+
+
+# PRIVATE FUNCTION to map the arrays of the detection record on its shared memory
+def __mapRecord(memory):
+    """ PRIVATE FUNCTION to map the arrays of the detection record on its shared memory
+
+    Layout : header (sequence number, frame id, capture time in ns, detection time in ns, number of balls) and one
+    row (ball name index, x, y) per ball.
+
+    :param memory: SharedMemory
+    :return: dictionary : arrays of the record
+    """
+    header = np.ndarray((8,), dtype=np.int64, buffer=memory.buf)
+    balls = np.ndarray((MAX_BALLS, 3), dtype=np.float32, buffer=memory.buf, offset=64)
+    return {"memory": memory, "header": header, "balls": balls}
+
+
+# PRIVATE FUNCTION to attach an existing shared memory
+def __attach(name):
+    """ PRIVATE FUNCTION to attach an existing shared memory without taking its ownership
+
+    The resource tracker of python would remove the shared memory when the reader leaves, so the reader unregisters it
+    (except in a child process of the vision loop, which shares the resource tracker of its parent).
+
+    :param name: string : name of the shared memory
+    :return: SharedMemory
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    if parent_process() is None:
+        resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+
+# FUNCTION to create the bus of the vision loop
+def startBus(params=p, prefix=p.busName):
+    """ FUNCTION to create the bus of the vision loop (the next frames and detections are published)
+
+    Source : Mulnard T. and https://docs.python.org/3/library/multiprocessing.shared_memory.html
+
+    :param params: parameters of the table (resolution of the camera and of the warped image)
+    :param prefix: string : prefix of the names of the shared memories
+    :return: nothing
+    """
+    global activeBus
+    bus = {"prefix": prefix}
+    for kind, (width, height) in (("raw", params.camRes), ("warped", (params.width, params.height))):
+        capacity = width * height * 3
+        memory = shared_memory.SharedMemory(name="{}_{}".format(prefix, kind), create=True,
+                                            size=64 + FRAME_SLOTS * (64 + capacity))
+        bus[kind] = __mapRing(memory, FRAME_SLOTS, capacity)
+        bus[kind]["header"][:] = (LAYOUT_VERSION, FRAME_SLOTS, capacity, 0)
+        bus[kind]["slots"][:] = 0
+    memory = shared_memory.SharedMemory(name=prefix + "_detections", create=True, size=64 + MAX_BALLS * 12)
+    bus["detections"] = __mapRecord(memory)
+    bus["detections"]["header"][:] = 0
+    activeBus = bus
+    print("   > frame bus started ({})".format(prefix))
+
+
+# FUNCTION to remove the bus of the vision loop
+def stopBus():
+    """ FUNCTION to remove the bus of the vision loop (the attached readers keep their mapping until they leave)
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    global activeBus
+    if activeBus is None:
+        return
+    for kind in ("raw", "warped", "detections"):
+        memory = activeBus[kind]["memory"]
+        activeBus[kind] = None
+        memory.close()
+        memory.unlink()
+    activeBus = None
+
+
+# FUNCTION to publish a frame
+def publishFrame(kind, image):
+    """ FUNCTION to publish a frame (never blocks, does nothing if the bus is not started)
+
+    Source : Mulnard T. and https://en.wikipedia.org/wiki/Seqlock
+
+    :param kind: string : 'raw' (camera frame, gives a new frame id) or 'warped'
+    :param image: image array (uint8)
+    :return: nothing
+    """
+    global frameCounter
+    if activeBus is None:
+        return
+    if kind == "raw":
+        frameCounter += 1
+    ring = activeBus[kind]
+    if image.nbytes > ring["data"].shape[1]:
+        return
+
+    counter = int(ring["header"][3]) + 1
+    slot = counter % FRAME_SLOTS
+    slotHeader = ring["slots"][slot]
+    # odd sequence number : the slot is being written
+    slotHeader[0] += 1
+    np.copyto(ring["data"][slot, :image.nbytes].reshape(image.shape), image)
+    slotHeader[1:6] = (frameCounter, time.time_ns()) + tuple(image.shape) + (1,) * (3 - image.ndim)
+    slotHeader[0] += 1
+    ring["header"][3] = counter
+
+
+# FUNCTION to publish the detected balls of the last frame
+def publishDetections(listBalls, captureTime=None):
+    """ FUNCTION to publish the detected balls of the last frame (never blocks, does nothing if the bus is not
+    started)
+
+    Source : Mulnard T.
+
+    :param listBalls: dictionary : name and coordinates of the detected balls, or structured array of all the balls
+                      (see imgProcess.BALL_DTYPE)
+    :param captureTime: float : time of the capture (time.time), default : time of the last raw frame
+    :return: nothing
+    """
+    if activeBus is None:
+        return
+    record = activeBus["detections"]
+    header, balls = record["header"], record["balls"]
+    header[0] += 1
+    header[1] = frameCounter
+    header[2] = int(captureTime * 1e9) if captureTime is not None else activeBus["raw"]["slots"][
+        int(activeBus["raw"]["header"][3]) % FRAME_SLOTS][2]
+    header[3] = time.time_ns()
+    if isinstance(listBalls, dict):
+        listBalls = [(name, x, y) for name, (x, y) in listBalls.items()]
+    else:
+        listBalls = zip(listBalls["label"].tolist(), listBalls["x"].tolist(), listBalls["y"].tolist())
+    count = 0
+    for name, x, y in list(listBalls)[:MAX_BALLS]:
+        balls[count] = (BALL_NAMES.index(name) if name in BALL_NAMES else len(BALL_NAMES) - 1, x, y)
+        count += 1
+    header[4] = count
+    header[0] += 1
+
+
+# FUNCTION to attach the bus of a running vision loop
+def attachBus(prefix=p.busName):
+    """ FUNCTION to attach the bus of a running vision loop (reader side)
+
+    Source : Mulnard T.
+
+    :param prefix: string : prefix of the names of the shared memories
+    :return: dictionary : bus, None if no vision loop publishes on this prefix
+    """
+    bus = {"prefix": prefix}
+    try:
+        for kind in ("raw", "warped"):
+            memory = __attach("{}_{}".format(prefix, kind))
+            header = np.ndarray((4,), dtype=np.int64, buffer=memory.buf)
+            if header[0] != LAYOUT_VERSION:
+                print("<Error> frame bus '{}' has another layout version".format(prefix))
+                return None
+            bus[kind] = __mapRing(memory, int(header[1]), int(header[2]))
+        bus["detections"] = __mapRecord(__attach(prefix + "_detections"))
+    except FileNotFoundError:
+        return None
+    return bus
+
+
+# FUNCTION to leave the bus
+def detachBus(bus):
+    """ FUNCTION to leave the bus (reader side)
+
+    Source : Mulnard T.
+
+    :param bus: dictionary coming from attachBus
+    :return: nothing
+    """
+    for kind in ("raw", "warped", "detections"):
+        memory = bus[kind]["memory"]
+        bus[kind] = None
+        memory.close()
+
+
+# FUNCTION to read the last frame of a ring
+def latestFrame(bus, kind, copy=True):
+    """ FUNCTION to read the last frame of a ring
+
+    Without copy, the image is a view on the shared memory : it stays valid until the writer uses the slot again
+    (FRAME_SLOTS frames later), frameValid tells if it is still the case.
+
+    Source : Mulnard T.
+
+    :param bus: dictionary coming from attachBus
+    :param kind: string : 'raw' or 'warped'
+    :param copy: boolean : copy the image out of the shared memory
+    :return: dictionary : frame id, time (seconds), image and token for frameValid, None if no frame is readable
+    """
+    ring = bus[kind]
+    for _ in range(READ_ATTEMPTS):
+        counter = int(ring["header"][3])
+        if counter == 0:
+            return None
+        slot = counter % ring["slots"].shape[0]
+        sequence = int(ring["slots"][slot, 0])
+        if sequence % 2:
+            continue
+        frameId, timeNs, height, width, channels = (int(value) for value in ring["slots"][slot, 1:6])
+        image = ring["data"][slot, :height * width * channels].reshape((height, width, channels))
+        if copy:
+            image = image.copy()
+        if int(ring["slots"][slot, 0]) == sequence:
+            return {"frame": frameId, "time": timeNs / 1e9, "image": image, "token": (kind, slot, sequence)}
+    return None
+
+
+# FUNCTION to check if a frame read without copy is still valid
+def frameValid(bus, token):
+    """ FUNCTION to check if a frame read without copy is still valid (the writer did not use its slot again)
+
+    Source : Mulnard T.
+
+    :param bus: dictionary coming from attachBus
+    :param token: tuple coming from latestFrame
+    :return: boolean
+    """
+    kind, slot, sequence = token
+    return int(bus[kind]["slots"][slot, 0]) == sequence
+
+
+# FUNCTION to read the last detection
+def latestDetections(bus):
+    """ FUNCTION to read the last detection
+
+    Source : Mulnard T.
+
+    :param bus: dictionary coming from attachBus
+    :return: dictionary : frame id, capture and detection times (seconds), name and coordinates of the balls ('balls' :
+             one per color, 'full' : list of (name, x, y) with every ball of a full rack), None if no detection is
+             readable
+    """
+    record = bus["detections"]
+    for _ in range(READ_ATTEMPTS):
+        sequence = int(record["header"][0])
+        if sequence == 0:
+            return None
+        if sequence % 2:
+            continue
+        header = record["header"].copy()
+        balls = record["balls"][:int(header[4])].copy()
+        if int(record["header"][0]) == sequence:
+            full = [(BALL_NAMES[int(index)], float(x), float(y)) for index, x, y in balls]
+            return {"frame": int(header[1]), "captured": header[2] / 1e9, "detected": header[3] / 1e9,
+                    "balls": {name: (x, y) for name, x, y in full}, "full": full}
+    return None
+
+
+# FUNCTION to follow the detections of the bus
+def followBus(prefix=p.busName, duration=float("inf")):
+    """ FUNCTION to follow the detections of the bus (prints each new detection, example of a reader process)
+
+    Source : Mulnard T.
+
+    :param prefix: string : prefix of the names of the shared memories
+    :param duration: float : duration of the reading (seconds)
+    :return: nothing
+    """
+    readerBus = attachBus(prefix)
+    if readerBus is None:
+        print("<Error> no frame bus found, enable 'frame_bus_enabled' in the parameters and start the program")
+        return
+    lastFrame = -1
+    timeStart = time.perf_counter()
+    try:
+        while time.perf_counter() - timeStart < duration:
+            detection = latestDetections(readerBus)
+            if detection is not None and detection["frame"] != lastFrame:
+                lastFrame = detection["frame"]
+                frame = latestFrame(readerBus, "warped", copy=False)
+                size = "no image" if frame is None else "warped image {}x{}".format(frame["image"].shape[1],
+                                                                                   frame["image"].shape[0])
+                print("   [bus] frame {} | {:.1f} ms after the capture | {} | {}".format(
+                    lastFrame, (detection["detected"] - detection["captured"]) * 1000, size, detection["balls"]))
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    detachBus(readerBus)
+
+
+if __name__ == "__main__":
+    followBus()
@@ -0,0 +1,232 @@
+""" Game engine part of the project
+This script loads the drill definitions (json files in assets/games/drills/) and compiles them into numpy
+arrays so that every ball can be checked against every zone in a single vectorised step per frame
+"""
+
+import cv2
+import json
+import numpy as np
+from scripts import imgProcess, parameters as p
+
+# kinds of zones that can be used in a drill definition
+ZONE_KINDS = ("start", "target", "hold", "forbidden")
+
+# special ball name to apply a zone to every ball of the drill
+ANY_BALL = "ANY"
+
+
+# FUNCTION to load a drill definition from a json file
+def loadDrill(drillPath):
+    """ FUNCTION to load a drill definition from a json file
+
+    Source : Mulnard T.
+
+    :param drillPath: string : path of the json drill definition
+    :return: dictionary : drill definition
+    """
+    with open(drillPath, "r") as drillFile:
+        drill = json.load(drillFile)
+
+    # verify the definition before using it to avoid errors in the middle of a game
+    for zone in drill["zones"]:
+        if zone["kind"] not in ZONE_KINDS:
+            raise ValueError("zone '{}' has an unknown kind '{}'".format(zone["name"], zone["kind"]))
+        if zone["ball"] != ANY_BALL and zone["ball"] not in drill["balls"]:
+            raise ValueError("zone '{}' uses the ball '{}' which is not in the drill".format(zone["name"],
+                                                                                             zone["ball"]))
+
+    return drill
+
+
+# PRIVATE FUNCTION to compile a scoring formula into a weight matrix
+def __compileScore(formula, ballNames, zoneNames):
+    """ PRIVATE FUNCTION to compile a scoring formula into a weight matrix
+
+    Source : Mulnard T.
+
+    :param formula: dictionary : 'terms' (ball, zone, weight) and 'divisor' of the formula
+    :param ballNames: string list : names of the balls in the drill
+    :param zoneNames: string list : names of the zones in the drill
+    :return: float array (balls x zones) : weight of each ball/zone distance in the score
+    """
+    weights = np.zeros((len(ballNames), len(zoneNames)), dtype=np.float32)
+    for term in formula["terms"]:
+        weights[ballNames.index(term["ball"]), zoneNames.index(term["zone"])] += term.get("weight", 1)
+
+    return weights / formula.get("divisor", 1)
+
+
+# FUNCTION to compile a drill definition into numpy arrays
+def compileDrill(drill, listTargets, targetRadius, placementRadius=100):
+    """ FUNCTION to compile a drill definition into numpy arrays
+
+    Source : Mulnard T.
+
+    :param drill: dictionary : drill definition coming from loadDrill
+    :param listTargets: dictionary : name and coordinates of the targets detected in the game image
+    :param targetRadius: integer : radius of the finish zones
+    :param placementRadius: integer : radius for the correct start position
+    :return: dictionary : compiled layout of the drill
+    """
+    ballNames = list(drill["balls"])
+    zones = drill["zones"]
+    zoneNames = [zone["name"] for zone in zones]
+    namedRadius = {"target": targetRadius, "placement": placementRadius}
+
+    centers = np.zeros((len(zones), 2), dtype=np.float32)
+    radius = np.zeros(len(zones), dtype=np.float32)
+    kinds = np.zeros(len(zones), dtype=np.int8)
+    applies = np.zeros((len(ballNames), len(zones)), dtype=bool)
+    penalties = np.zeros((len(zones), len(ballNames), len(zones)), dtype=np.float32)
+    hasPenalty = np.zeros(len(zones), dtype=bool)
+
+    for i, zone in enumerate(zones):
+        # the center is either the name of a target detected in the image or fixed coordinates
+        if isinstance(zone["center"], str):
+            centers[i] = listTargets[zone["center"]]
+        else:
+            centers[i] = zone["center"]
+        radius[i] = namedRadius.get(zone["radius"], zone["radius"])
+        kinds[i] = ZONE_KINDS.index(zone["kind"])
+
+        if zone["ball"] == ANY_BALL:
+            applies[:, i] = True
+        else:
+            applies[ballNames.index(zone["ball"]), i] = True
+
+        if "penalty" in zone:
+            penalties[i] = __compileScore(zone["penalty"], ballNames, zoneNames)
+            hasPenalty[i] = True
+
+    return {"id": drill["id"],
+            "balls": ballNames,
+            "zones": zoneNames,
+            "messages": [zone.get("message", "") for zone in zones],
+            "colors": [zone.get("color", "") for zone in zones],
+            "centers": centers,
+            "radius2": radius ** 2,
+            "radius": radius,
+            "kinds": kinds,
+            "applies": applies,
+            "weights": __compileScore(drill["score"], ballNames, zoneNames),
+            "penalties": penalties,
+            "hasPenalty": hasPenalty}
+
+
+# FUNCTION to evaluate the position of all the balls against all the zones
+def evaluateDrill(layout, listBalls):
+    """ FUNCTION to evaluate the position of all the balls against all the zones
+
+    Source : Mulnard T.
+
+    :param layout: dictionary : compiled drill coming from compileDrill
+    :param listBalls: dictionary : name and coordinates of the detected balls
+    :return: dictionary : placement state, win state, score and names of the failed zones
+    """
+    # missing balls are set to NaN so that they are never inside a zone
+    ballsXY = np.full((len(layout["balls"]), 2), np.nan, dtype=np.float32)
+    for i, name in enumerate(layout["balls"]):
+        if name in listBalls:
+            ballsXY[i] = listBalls[name]
+
+    # distance of every ball to every zone center (balls x zones)
+    delta = ballsXY[:, None, :] - layout["centers"][None, :, :]
+    inside = (delta ** 2).sum(axis=2) <= layout["radius2"][None, :]
+    manhattan = np.abs(delta).sum(axis=2)
+
+    # a zone is satisfied if all of its balls are inside, a forbidden one if none of its balls are inside
+    applies = layout["applies"]
+    allInside = np.all(inside | ~applies, axis=0)
+    anyInside = np.any(inside & applies, axis=0)
+    kinds = layout["kinds"]
+    isForbidden = kinds == ZONE_KINDS.index("forbidden")
+    satisfied = np.where(isForbidden, ~anyInside, allInside)
+
+    placed = bool(np.all(satisfied[kinds == ZONE_KINDS.index("start")]))
+    failed = ~satisfied & (kinds != ZONE_KINDS.index("start"))
+
+    # the score uses the penalty formula of the first failed zone with one, the normal formula otherwise
+    penalized = np.flatnonzero(failed & layout["hasPenalty"])
+    weights = layout["penalties"][penalized[0]] if penalized.size else layout["weights"]
+    score = float(np.nansum(weights * manhattan)) if not np.isnan(manhattan[weights != 0]).any() else None
+
+    return {"placed": placed,
+            "win": not failed.any(),
+            "score": score,
+            "inside": inside,
+            "failed": [layout["zones"][i] for i in np.flatnonzero(failed)],
+            "misplaced": [layout["zones"][i] for i in np.flatnonzero(~satisfied & ~failed)]}
+
+
+# FUNCTION to get the target of each ball
+def ballTargets(layout):
+    """ FUNCTION to get the target of each ball (center of its first target zone)
+
+    Source : Mulnard T.
+
+    :param layout: dictionary : compiled drill coming from compileDrill
+    :return: dictionary : name of the ball and coordinates of its target
+    """
+    listTargets = {}
+    for i in np.flatnonzero(layout["kinds"] == ZONE_KINDS.index("target")):
+        for j in np.flatnonzero(layout["applies"][:, i]):
+            listTargets.setdefault(layout["balls"][j], tuple(layout["centers"][i]))
+
+    return listTargets
+
+
+# FUNCTION to build the message of a finished drill
+def resultMessage(layout, result):
+    """ FUNCTION to build the message of a finished drill
+
+    Source : Mulnard T.
+
+    :param layout: dictionary : compiled drill coming from compileDrill
+    :param result: dictionary : evaluation coming from evaluateDrill
+    :return: string : information to display
+    """
+    if result["win"]:
+        return "WIN ! You are the best"
+
+    messages = [layout["messages"][layout["zones"].index(name)] for name in result["failed"]]
+    messages = [message for message in messages if message != ""]
+    if messages:
+        return "LOSE ! " + " / ".join(messages)
+    return "LOSE ! Better luck next time"
+
+
+# FUNCTION to prepare the image and the layout of a drill
+def prepareDrill(drill, targetRadius, placementRadius=100, matrixTransform=None, params=p, maps=None):
+    """ FUNCTION to prepare the image and the layout of a drill
+
+    Source : Mulnard T.
+
+    :param drill: dictionary : drill definition coming from loadDrill
+    :param targetRadius: integer : radius of the finish zones
+    :param placementRadius: integer : radius for the correct start position
+    :param matrixTransform: float array : keystone matrix (default : loaded from the keystone data file)
+    :param params: parameters of the table (default : parameters module)
+    :param maps: remap tables of the keystone (see calibSnapshot.keystoneMaps), used instead of the matrix
+    :return: image array to display, dictionary : compiled layout of the drill
+    """
+    image = cv2.imread(drill["image"])
+    image = cv2.resize(image, (params.width, params.height))
+
+    # warping the image and detecting the targets
+    if maps is not None:
+        image = cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR)
+    else:
+        if matrixTransform is None:
+            matrixTransform = np.loadtxt(p.kstData, delimiter=",")
+        image = cv2.warpPerspective(image, matrixTransform, (params.width, params.height))
+    image, listTargets = imgProcess.circleDetection(image, dp=7, minDist=100, minRadius=20, maxRadius=80,
+                                                    imgDisplayOut=False, params=params)
+    layout = compileDrill(drill, listTargets, targetRadius, placementRadius)
+
+    # drawing the zones with a color around their target
+    for i, color in enumerate(layout["colors"]):
+        if color != "":
+            center = (int(layout["centers"][i][0]), int(layout["centers"][i][1]))
+            cv2.circle(image, center, int(layout["radius"][i]), getattr(params, "gmCol" + color + "Max"), 4)
+
+    return image, layout
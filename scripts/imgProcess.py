@@ -8,88 +8,112 @@ import cv2.aruco
 import numpy as np
 import shutil
 import sys
-from scripts import parameters as p
+from scripts import bufferPool, debugWriter, parallelTiles, parameters as p
 
-width = p.width
-height = p.height
+# detected circle : center and radius (pixels), color name ('' if unidentified) and confidence of the color (0-1)
+BALL_DTYPE = np.dtype([("x", np.int32), ("y", np.int32), ("r", np.int32), ("label", "U8"), ("confidence", np.float32)])
 
 
-# FUNCTION to detect ArUCo tags
-def tagDetect(image, tagType):
-    """ Function to detect ArUCo tags
+# ArUco dictionaries built into the OpenCV library
+ARUCO_DICT = {
+    "DICT_5X5_50": cv2.aruco.DICT_5X5_50,
+    "DICT_5X5_100": cv2.aruco.DICT_5X5_100,
+    "DICT_5X5_250": cv2.aruco.DICT_5X5_250,
+    "DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
+    "DICT_6X6_100": cv2.aruco.DICT_6X6_100,
+    "DICT_6X6_250": cv2.aruco.DICT_6X6_250,
+    "DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
+    "DICT_7X7_50": cv2.aruco.DICT_7X7_50,
+    "DICT_7X7_100": cv2.aruco.DICT_7X7_100,
+    "DICT_7X7_250": cv2.aruco.DICT_7X7_250,
+    "DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
+    "DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
+}
 
-    Source : MULNARD T. and https://www.pyimagesearch.com/2020/12/21/detecting-aruco-markers-with-opencv-and-python/
+# bits of every marker and rotation of the dictionaries already used by registerTags
+dictionaryBits = {}
 
-    :param image: image array : coming from cv2.imread
-    :param tagType: string : used aruco tag type
-    :return: list of the centers of each tags, image array with the detected tags
-    """
+# sub-pixel refinement of the tag corners : points measured on each side of a tag, step (pixels) of the profiles across
+# the sides and half width (pixels) of the edge around its strongest gradient
+EDGE_SAMPLES = 24
+EDGE_STEP = 0.25
+EDGE_WIDTH = 1.5
+
+# lookup classifier of the colors learned by colorLearning.py (names, lut, bits), None = color ranges of the parameters
+colorClassifier = None
+
+# share of the pixels of a circle that must vote for a color of the lookup classifier
+MIN_VOTE = 0.5
 
-    tagList = []
-    tempList = []
-    tagCenters = {}
 
-    # ArUco dictionaries built into the OpenCV library.
-    ARUCO_DICT = {
-        "DICT_5X5_50": cv2.aruco.DICT_5X5_50,
-        "DICT_5X5_100": cv2.aruco.DICT_5X5_100,
-        "DICT_5X5_250": cv2.aruco.DICT_5X5_250,
-        "DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
-        "DICT_6X6_100": cv2.aruco.DICT_6X6_100,
-        "DICT_6X6_250": cv2.aruco.DICT_6X6_250,
-        "DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
-        "DICT_7X7_50": cv2.aruco.DICT_7X7_50,
-        "DICT_7X7_100": cv2.aruco.DICT_7X7_100,
-        "DICT_7X7_250": cv2.aruco.DICT_7X7_250,
-        "DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
-        "DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
-    }
+# PRIVATE FUNCTION to get an ArUco dictionary
+def __arucoDictionary(tagType):
+    """ PRIVATE FUNCTION to get an ArUco dictionary (the program stops if the tag type is not supported)
 
+    :param tagType: string : used aruco tag type
+    :return: ArUco dictionary
+    """
     # verify that the supplied ArUCo tag exists and is supported by OpenCV to prevent errors
     if ARUCO_DICT.get(tagType, None) is None:
         print("[info] ArUCo tag of '{}' is not supported".format(tagType))
         sys.exit(0)
+    return cv2.aruco.Dictionary_get(ARUCO_DICT[tagType])
 
-    # load the ArUCo dictionary, instantiate the ArUCo parameters, and detect the markers
-    # corners = (x,y) coordinates of the markers, ids = identifiers of the markers, rejected = potential rejected marks
-    arucoDict = cv2.aruco.Dictionary_get(ARUCO_DICT[tagType])
-    arucoParams = cv2.aruco.DetectorParameters_create()
-    (corners, ids, rejected) = cv2.aruco.detectMarkers(image, arucoDict, parameters=arucoParams)
 
-    # verify at least one ArUco marker was detected
-    if len(corners) > 0:
-        ids = ids.flatten()
+# PRIVATE FUNCTION to get the center of a tag and draw it
+def __tagCenter(image, markerCorner, markerID, draw=True, center=None):
+    """ PRIVATE FUNCTION to get the center of a tag and draw it on the image
 
-        # loop over the detected ArUCo corners
-        for (markerCorner, markerID) in zip(corners, ids):
-            # extract the marker corners (which are always returned in)
-            # top-left, top-right, bottom-right, bottom-left  border
-            corners = markerCorner.reshape((4, 2))
-            (topLeft, topRight, bottomRight, bottomLeft) = corners
-
-            # convert the useful (x,y)-coordinate pairs to integers
-            topLeft = (int(topLeft[0]), int(topLeft[1]))
-            bottomRight = (int(bottomRight[0]), int(bottomRight[1]))
-
-            # draw the bounding box of the ArUCo detection
-            # cv2.rectangle(destination, start, end, color, thickness)
-            cv2.rectangle(image, bottomRight, topLeft, (0, 255, 0), 4)
-
-            # compute and draw the center (x,y)-coordinates of the ArUCo marker
-            # cv2.circle(destination, (cX, cY), radius, color, thickness
-            cX = int((bottomRight[0] + topLeft[0]) / 2.0)
-            cY = int((bottomRight[1] + topLeft[1]) / 2.0)
-            cv2.circle(image, (cX, cY), 3, (0, 0, 255), -1)
-
-            # draw the ArUCo marker ID on the image
-            # cv2.putText( destination, text, start_point, font, size, color, thickness
-            cv2.putText(image, str(markerID), (topLeft[0], topLeft[1] - 15),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-            # append the value to the list
-            tagList.append((cX, cY))
-
-    # algorithm to identify the position of each tags base on the sum of x+y values
+    :param image: image array
+    :param markerCorner: array : corners of the tag (top-left, top-right, bottom-right, bottom-left)
+    :param markerID: integer : id of the tag
+    :param draw: boolean : if the tag is drawn on the image
+    :param center: float tuple : precise center of the tag (default : middle of the top-left and bottom-right corners,
+                   in integers)
+    :return: tuple : center (x, y) of the tag
+    """
+    # extract the marker corners (which are always returned in)
+    # top-left, top-right, bottom-right, bottom-left  border
+    corners = markerCorner.reshape((4, 2))
+    (topLeft, topRight, bottomRight, bottomLeft) = corners
+
+    # convert the useful (x,y)-coordinate pairs to integers
+    topLeft = (int(topLeft[0]), int(topLeft[1]))
+    bottomRight = (int(bottomRight[0]), int(bottomRight[1]))
+
+    # compute the center (x,y)-coordinates of the ArUCo marker
+    if center is None:
+        cX = int((bottomRight[0] + topLeft[0]) / 2.0)
+        cY = int((bottomRight[1] + topLeft[1]) / 2.0)
+    else:
+        cX, cY = float(center[0]), float(center[1])
+
+    if draw:
+        # draw the bounding box of the ArUCo detection
+        # cv2.rectangle(destination, start, end, color, thickness)
+        cv2.rectangle(image, bottomRight, topLeft, (0, 255, 0), 4)
+
+        # draw the center of the ArUCo marker
+        # cv2.circle(destination, (cX, cY), radius, color, thickness
+        cv2.circle(image, (int(round(cX)), int(round(cY))), 3, (0, 0, 255), -1)
+
+        # draw the ArUCo marker ID on the image
+        # cv2.putText( destination, text, start_point, font, size, color, thickness
+        cv2.putText(image, str(markerID), (topLeft[0], topLeft[1] - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+    return cX, cY
+
+
+# PRIVATE FUNCTION to identify the position of each tag
+def __sortTags(tagList):
+    """ PRIVATE FUNCTION to identify the position of each tag based on the sum of x+y values
+
+    :param tagList: list of tuples : centers of the detected tags
+    :return: dictionary : center of each of the 4 tags, empty if less than 4 tags are detected
+    """
+    tempList = []
+    tagCenters = {}
     try:
         for i in range(0, 4):
             # id used to set each (x,y) to its original location in tagCenters
@@ -101,13 +125,227 @@ def tagDetect(image, tagType):
         tagCenters["TOP_L"] = tagList[tempList[2][1]]
         tagCenters["BOT_L"] = tagList[tempList[3][1]]
     except IndexError:
-        return tagCenters, image
+        return {}
+
+    return tagCenters
+
+
+# FUNCTION to refine the corners of a tag at full resolution
+def refineCorners(image, markerCorner, reach=3.0):
+    """ FUNCTION to refine the corners of a tag in a full resolution patch around it (only the patch is converted to
+    grey)
+
+    Each side of the tag is crossed by short profiles : the edge between the white margin and the black border of the
+    tag (bright to dark towards the tag) is placed at the centroid of the gradient, a line is fitted on these points and
+    the corners are the intersections of the lines. The thin white margin of the printed tags puts a second corner a
+    few pixels away from each corner of the tag, where a corner search (cv2.cornerSubPix) drifts.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d5/dae/tutorial_aruco_detection.html
+
+    :param image: image array : full resolution frame
+    :param markerCorner: array : approximate corners of the tag (pixels of the full frame, clockwise)
+    :param reach: float : maximum error (pixels) of the approximate corners
+    :return: array (4, 2) : refined corners of the tag (float)
+    """
+    corners = markerCorner.reshape((4, 2)).astype(np.float32)
+    margin = int(np.ceil(reach)) + 2
+    x0, y0 = np.maximum(np.floor(corners.min(axis=0)) - margin, 0).astype(int)
+    x1, y1 = np.minimum(np.ceil(corners.max(axis=0)) + margin + 1, (image.shape[1], image.shape[0])).astype(int)
+    patch = image[y0:y1, x0:x1]
+    if patch.ndim == 3:
+        patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+    corners -= (x0, y0)
+
+    # profiles across each side (start -> end), away from the corners, along the normal towards the tag
+    start, end = corners, np.roll(corners, -1, axis=0)
+    direction = (end - start) / np.linalg.norm(end - start, axis=1, keepdims=True)
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    normal *= np.sign(np.sum((corners.mean(axis=0) - start) * normal, axis=1))[:, None]
+    points = start[:, None] + np.linspace(0.15, 0.85, EDGE_SAMPLES)[None, :, None] * (end - start)[:, None]
+    steps = np.arange(-reach, reach + EDGE_STEP / 2, EDGE_STEP, dtype=np.float32)
+    profiles = points[:, :, None] + steps[None, None, :, None] * normal[:, None, None]
+    values = cv2.remap(patch.astype(np.float32), profiles.reshape((4 * EDGE_SAMPLES, -1, 2)).astype(np.float32), None,
+                       cv2.INTER_LINEAR)
+
+    # centroid of the bright to dark gradient around its strongest value
+    gradient = np.maximum(-np.diff(values, axis=1), 0)
+    index = np.arange(gradient.shape[1])
+    strongest = np.argmax(gradient, axis=1)
+    gradient[np.abs(index[None, :] - strongest[:, None]) > EDGE_WIDTH / EDGE_STEP] = 0
+    edge = (np.sum(gradient * index, axis=1) / np.maximum(np.sum(gradient, axis=1), 1e-6) + 0.5) * EDGE_STEP - reach
+    edges = (points + edge.reshape((4, EDGE_SAMPLES))[:, :, None] * normal[:, None]).astype(np.float32)
+
+    # lines of the sides (direction, point) and corners at their intersections
+    lines = [cv2.fitLine(sidePoints, cv2.DIST_HUBER, 0, 0.01, 0.01).ravel() for sidePoints in edges]
+    refined = np.empty((4, 2), dtype=np.float32)
+    for side in range(4):
+        (vx1, vy1, px1, py1), (vx2, vy2, px2, py2) = lines[side - 1], lines[side]
+        try:
+            step = np.linalg.solve([[vx1, -vx2], [vy1, -vy2]], [px2 - px1, py2 - py1])[0]
+        except np.linalg.LinAlgError:
+            return markerCorner.reshape((4, 2)).astype(np.float32)
+        refined[side] = (px1 + step * vx1, py1 + step * vy1)
+    return refined + np.float32((x0, y0))
+
+
+# PRIVATE FUNCTION to get the center of a tag from its corners
+def __cornersCenter(corners):
+    """ PRIVATE FUNCTION to get the center of a tag from its corners : intersection of the diagonals (the middle of two
+    opposite corners is not the center of a tag seen in perspective)
+
+    :param corners: array (4, 2) : corners of the tag (top-left, top-right, bottom-right, bottom-left)
+    :return: float tuple : center (x, y) of the tag
+    """
+    topLeft, topRight, bottomRight, bottomLeft = corners.astype(np.float64)
+    diagonal1, diagonal2 = bottomRight - topLeft, bottomLeft - topRight
+    denominator = diagonal1[0] * diagonal2[1] - diagonal1[1] * diagonal2[0]
+    if abs(denominator) < 1e-9:
+        center = corners.mean(axis=0)
+    else:
+        step = ((topRight[0] - topLeft[0]) * diagonal2[1] - (topRight[1] - topLeft[1]) * diagonal2[0]) / denominator
+        center = topLeft + step * diagonal1
+    return float(center[0]), float(center[1])
+
+
+# FUNCTION to detect ArUCo tags
+def tagDetect(image, tagType, scale=0, markerIds=None):
+    """ Function to detect ArUCo tags
 
+    With a scale above 0, the tags are searched in a reduced image, then their corners are refined in full resolution
+    patches (see refineCorners) and the centers are given in floats, from the refined corners.
+
+    Source : MULNARD T. and https://www.pyimagesearch.com/2020/12/21/detecting-aruco-markers-with-opencv-and-python/
+
+    :param image: image array : coming from cv2.imread
+    :param tagType: string : used aruco tag type
+    :param scale: float : scale of the reduced image (0 = detection on the full image, integer centers)
+    :param markerIds: list of integers : ids of the tags to keep (camera seeing the tags of another camera, see
+                      multiCamera.py), None = every detected tag
+    :return: list of the centers of each tags, image array with the detected tags
+    """
+
+    tagList = []
+
+    # load the ArUCo dictionary, instantiate the ArUCo parameters, and detect the markers
+    # corners = (x,y) coordinates of the markers, ids = identifiers of the markers, rejected = potential rejected marks
+    arucoDict = __arucoDictionary(tagType)
+    arucoParams = cv2.aruco.DetectorParameters_create()
+    if scale > 0:
+        reduced = image if scale == 1 else cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        (corners, ids, rejected) = cv2.aruco.detectMarkers(reduced, arucoDict, parameters=arucoParams)
+    else:
+        (corners, ids, rejected) = cv2.aruco.detectMarkers(image, arucoDict, parameters=arucoParams)
+
+    # verify at least one ArUco marker was detected
+    if len(corners) > 0:
+        ids = ids.flatten()
+        if markerIds is not None:
+            corners = [markerCorner for markerCorner, markerID in zip(corners, ids) if markerID in markerIds]
+            ids = [markerID for markerID in ids if markerID in markerIds]
+
+        # back to the pixels of the full image (centers of the pixels) and refinement of the corners, before any
+        # drawing on the image (the error of the reduced image is about one of its pixels)
+        if scale > 0:
+            corners = [refineCorners(image, (markerCorner + 0.5) / scale - 0.5, 1.5 / scale)
+                       for markerCorner in corners]
+
+        # loop over the detected ArUCo corners, draw them and append their center to the list
+        for (markerCorner, markerID) in zip(corners, ids):
+            center = __cornersCenter(markerCorner) if scale > 0 else None
+            tagList.append(__tagCenter(image, markerCorner, markerID, center=center))
+
+    return __sortTags(tagList), image
+
+
+# PRIVATE FUNCTION to identify a candidate marker in a dictionary
+def __identifyCandidate(gray, candidate, tagType, arucoParams):
+    """ PRIVATE FUNCTION to identify a candidate marker (square rejected by the detection of another dictionary)
+
+    The candidate is unwarped, thresholded (Otsu) and read cell by cell, then its bits are compared with the bits of
+    every marker and rotation of the dictionary at once (Hamming distance).
+
+    :param gray: grey image array
+    :param candidate: array : corners of the candidate
+    :param tagType: string : aruco tag type of the dictionary
+    :param arucoParams: ArUco detector parameters
+    :return: id and corners (top-left first) of the marker, None if the candidate is not a marker of the dictionary
+    """
+    arucoDict = __arucoDictionary(tagType)
+    if tagType not in dictionaryBits:
+        dictionaryBits[tagType] = np.array([arucoDict.getBitsFromByteList(arucoDict.bytesList[markerID:markerID + 1],
+                                                                          arucoDict.markerSize).ravel()
+                                            for markerID in range(arucoDict.bytesList.shape[0])], dtype=bool)
+
+    # unwarp the candidate, one square of pixels per cell
+    border = arucoParams.markerBorderBits
+    cellSize = arucoParams.perspectiveRemovePixelPerCell
+    cells = arucoDict.markerSize + 2 * border
+    size = cells * cellSize
+    corners = candidate.reshape((4, 2)).astype(np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, np.float32([[0, 0], [size - 1, 0], [size - 1, size - 1], [0, size - 1]]))
+    patch = cv2.warpPerspective(gray, matrix, (size, size), flags=cv2.INTER_NEAREST)
+    if patch.std() < arucoParams.minOtsuStdDev:
+        return None
+    patch = cv2.threshold(patch, 125, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+
+    # value of each cell, without its margin
+    margin = int(cellSize * arucoParams.perspectiveRemoveIgnoredMarginPerCell)
+    bits = patch.reshape((cells, cellSize, cells, cellSize))[:, margin:cellSize - margin, :, margin:cellSize - margin]
+    bits = bits.mean(axis=(1, 3)) > 127
+
+    # the border of a marker is black
+    inner = bits[border:-border, border:-border]
+    if bits.sum() - inner.sum() > int(arucoDict.markerSize ** 2 * arucoParams.maxErroneousBitsInBorderRate):
+        return None
+
+    # Hamming distance of the 4 rotations of the candidate to every marker
+    rotations = np.array([np.rot90(inner, rotation).ravel() for rotation in range(4)])
+    distances = np.count_nonzero(dictionaryBits[tagType][:, None, :] != rotations[None, :, :], axis=2)
+    markerID, rotation = np.unravel_index(np.argmin(distances), distances.shape)
+    if distances[markerID, rotation] > int(arucoDict.maxCorrectionBits * arucoParams.errorCorrectionRate):
+        return None
+    return int(markerID), np.roll(corners, -rotation, axis=0)
+
+
+# FUNCTION to detect the tags of several dictionaries in a single pass
+def registerTags(image, tagTypes=(p.tagType, p.tagTypePRJ), draw=True):
+    """ FUNCTION to detect the tags of several dictionaries with a single thresholding / contour pass
+
+    The detection of the first dictionary finds every square of the image : the squares it rejects are then read with
+    the other dictionaries, without any new pass over the image. The tags are drawn once everything is detected.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d5/dae/tutorial_aruco_detection.html
+
+    :param image: image array : coming from cv2.imread
+    :param tagTypes: list of strings : aruco tag types (the first one is the most frequent in the image)
+    :param draw: boolean : if the tags are drawn on the image
+    :return: dictionary : centers of the 4 tags of each tag type (see tagDetect), image array with the detected tags
+    """
+    arucoParams = cv2.aruco.DetectorParameters_create()
+    corners, ids, rejected = cv2.aruco.detectMarkers(image, __arucoDictionary(tagTypes[0]), parameters=arucoParams)
+    markers = {tagType: {} for tagType in tagTypes}
+    if ids is not None:
+        markers[tagTypes[0]] = dict(zip(ids.flatten().tolist(), corners))
+
+    if len(tagTypes) > 1 and len(rejected) > 0:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        for candidate in rejected:
+            for tagType in tagTypes[1:]:
+                marker = __identifyCandidate(gray, candidate, tagType, arucoParams)
+                if marker is not None:
+                    markers[tagType].setdefault(marker[0], marker[1])
+                    break
+
+    tagCenters = {}
+    for tagType in tagTypes:
+        tagList = [__tagCenter(image, markerCorner, markerID, draw)
+                   for markerID, markerCorner in markers[tagType].items()]
+        tagCenters[tagType] = __sortTags(tagList)
     return tagCenters, image
 
 
 # FUNCTION to warp perspective of the image
-def warpPerspective(image, tagList, offset=0):
+def warpPerspective(image, tagList, offset=0, params=p, scale=1.0, dst=None):
     """ FUNCTION to warp perspective of the image
 
     Source : Mulnard T. and Vachaudez J.
@@ -115,22 +353,69 @@ def warpPerspective(image, tagList, offset=0):
     :param image: image array : coming from cv2.imread
     :param tagList: list : with the coordinates tuple of the 4 detected tags
     :param offset: integer : horizontal offset if the tags are not exactly in the corner
+    :param params: parameters of the table (default : parameters module)
+    :param scale: float : working scale of the output image (1 = image_resolution)
+    :param dst: image array : preallocated output (see bufferPool.py), None to allocate a new one
     :return: image array : unwarped image
     """
+    width = int(params.width * scale)
+    height = int(params.height * scale)
+    matrix = warpMatrix(tagList, offset, params, scale)
+    unwarped_img = cv2.warpPerspective(image, matrix, (width, height), dst=dst)
+
+    # return the image array
+    return unwarped_img
+
+
+# FUNCTION to get the matrix of the warp of the image
+def warpMatrix(tagList, offset=0, params=p, scale=1.0):
+    """ FUNCTION to get the matrix of the warp of the image (camera frame -> warped image, see warpPerspective)
+
+    Source : Mulnard T. and Vachaudez J.
+
+    :param tagList: list : with the coordinates tuple of the 4 detected tags
+    :param offset: integer : horizontal offset if the tags are not exactly in the corner
+    :param params: parameters of the table (default : parameters module)
+    :param scale: float : working scale of the output image (1 = image_resolution)
+    :return: float array (3, 3) : perspective matrix
+    """
+    width = int(params.width * scale)
+    height = int(params.height * scale)
     original = np.float32([[tagList["TOP_R"][0] - offset, tagList["TOP_R"][1]],
                            [tagList["TOP_L"][0] + offset, tagList["TOP_L"][1]],
                            [tagList["BOT_L"][0] + offset, tagList["BOT_L"][1]],
                            [tagList["BOT_R"][0] - offset, tagList["BOT_R"][1]]])
     unwarped = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
-    matrix = cv2.getPerspectiveTransform(original, unwarped)
-    unwarped_img = cv2.warpPerspective(image, matrix, (width, height))
+    return cv2.getPerspectiveTransform(original, unwarped)
 
-    # return the image array
-    return unwarped_img
+
+# FUNCTION to get the color range of the pool table
+def tableColorRange(image, params=p):
+    """ FUNCTION to get the color range of the pool table from the most dominant color of the image
+
+    Source : Mulnard T.
+
+    :param image: image array : warped image
+    :param params: parameters of the table (default : parameters module)
+    :return: tuple of arrays : lower and upper BGR limits of the table color
+    """
+    domColors = __dominantcolor(image)
+
+    # define the lower and upper limits based on the most dominant color of the image
+    if (domColors[1] > domColors[0]) and (domColors[1] > domColors[2]):   # Pool table is green
+        return np.array(params.tableGREENMin), np.array(params.tableGREENMax)
+    elif (domColors[0] > domColors[1]) and (domColors[0] > domColors[2]):  # Pool table is blue
+        return np.array(params.tableBLUEMin), np.array(params.tableBLUEMax)
+    elif (domColors[2] > domColors[1]) and (domColors[2] > domColors[0]):  # Pool table is red
+        return np.array(params.tableREDMin), np.array(params.tableREDMax)
+
+    print("<error> pool table color not correctly detected")
+    return np.array([0, 0, 0]), np.array([255, 255, 255])
 
 
 # FUNCTION to remove the background in an image using the most dominant color
-def removeBackground(image, rectOffset, circOffset, onlyCountour=False):
+def removeBackground(image, rectOffset, circOffset, onlyCountour=False, params=p, kernelSize=40, dst=None,
+                     origin=None, tableRange=None):
     """ FUNCTION to remove the background in an image using the most dominant color
 
     Source : Mulnard T. and https://stackoverflow.com/a/56878194
@@ -139,51 +424,40 @@ def removeBackground(image, rectOffset, circOffset, onlyCountour=False):
     :param rectOffset: integer : width of the black rectangle on the four sides
     :param circOffset: integer : radius of the black circles in each corners for holes removal
     :param onlyCountour: boolean : to bypass the background removing process and only show the black circles/rectangles
+    :param params: parameters of the table (default : parameters module)
+    :param kernelSize: integer : size of the morphology kernel (scaled with the working resolution)
+    :param dst: image array : preallocated output (see bufferPool.py), None to allocate a new one
+    :param origin: integer tuple : position (x, y) of the image in the warped image when it is only a region of it
+                   (the sides and corners are the ones of the table), None = whole warped image
+    :param tableRange: tuple of arrays : known lower and upper BGR limits of the table color (see tableColorRange),
+                       None = from the most dominant color of the image
     :return: image array : unwarped image
     """
-    domColors = __dominantcolor(image)
-
     # threshold based on the most dominant color of the image
-    # define the lower and upper limits based on the most dominant color of the image
     if not onlyCountour:
-        if (domColors[1] > domColors[0]) and (domColors[1] > domColors[2]):   # Pool table is green
-            lower = np.array(p.tableGREENMin)
-            upper = np.array(p.tableGREENMax)
-        elif (domColors[0] > domColors[1]) and (domColors[0] > domColors[2]):  # Pool table is blue
-            lower = np.array(p.tableBLUEMin)
-            upper = np.array(p.tableBLUEMax)
-        elif (domColors[2] > domColors[1]) and (domColors[2] > domColors[0]):  # Pool table is red
-            lower = np.array(p.tableREDMin)
-            upper = np.array(p.tableREDMax)
-        else:
-            print("<error> pool table color not correctly detected")
-            lower = np.array([0, 0, 0])
-            upper = np.array([255, 255, 255])
-
-        # Create mask to only select the desired color
-        thresh = cv2.inRange(image, lower, upper)
-
-        # apply morphology and creating mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (40, 40))
-        mask = 255 - cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-
-        # apply mask to image
-        image = cv2.bitwise_and(image, image, mask=mask)
+        lower, upper = tableColorRange(image, params) if tableRange is None else tableRange
+
+        # threshold, morphology, inverted mask and bitwise_and (strip by strip on several cores, see parallelTiles.py)
+        image = parallelTiles.maskBackground(image, lower, upper, kernelSize, dst,
+                                             parallelTiles.workerCount(params.parallelWorkers))
 
     # create black rectangles on the 4 sides
     clR = (0, 0, 0)
     h, w, channels = image.shape
-    cv2.rectangle(image, (0, 0), (w, rectOffset), clR, -1)
-    cv2.rectangle(image, (0, 0), (rectOffset, h), clR, -1)
-    cv2.rectangle(image, (0, h), (w, h - rectOffset), clR, -1)
-    cv2.rectangle(image, (w, 0), (w - rectOffset, h), clR, -1)
+    x0, y0 = (0, 0) if origin is None else (-origin[0], -origin[1])
+    if origin is not None:
+        w, h = params.width + x0, params.height + y0
+    cv2.rectangle(image, (x0, y0), (w, y0 + rectOffset), clR, -1)
+    cv2.rectangle(image, (x0, y0), (x0 + rectOffset, h), clR, -1)
+    cv2.rectangle(image, (x0, h), (w, h - rectOffset), clR, -1)
+    cv2.rectangle(image, (w, y0), (w - rectOffset, h), clR, -1)
 
     # create black circles in the 4 corners
     clC = (0, 0, 0)
-    cv2.circle(image, (0, 0), circOffset, clC, -1)
-    cv2.circle(image, (0, height), circOffset, clC, -1)
-    cv2.circle(image, (width, 0), circOffset, clC, -1)
-    cv2.circle(image, (width, height), circOffset, clC, -1)
+    cv2.circle(image, (x0, y0), circOffset, clC, -1)
+    cv2.circle(image, (x0, h), circOffset, clC, -1)
+    cv2.circle(image, (w, y0), circOffset, clC, -1)
+    cv2.circle(image, (w, h), circOffset, clC, -1)
     # return results
     return image
 
@@ -198,40 +472,138 @@ def __dominantcolor(image):
     :return: list : detected BGR (blue, green, red) value
     """
     listBGR = []
-    data = np.reshape(image, (-1, 3))
-    data = np.float32(data)
 
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 5, 1.0)
-    flags = cv2.KMEANS_RANDOM_CENTERS
-    compactness, labels, centers = cv2.kmeans(data, 1, None, criteria, 5, flags)
-    listBGR.append(int(centers[0][0]))  # blue value of most dominant color in the image
-    listBGR.append(int(centers[0][1]))  # green value of most dominant color in the image
-    listBGR.append(int(centers[0][2]))  # red value of most dominant color in the image
+    # the center of a k-means with a single cluster is the mean color, computed without any float32 copy
+    centers = cv2.mean(image)
+    listBGR.append(int(centers[0]))  # blue value of most dominant color in the image
+    listBGR.append(int(centers[1]))  # green value of most dominant color in the image
+    listBGR.append(int(centers[2]))  # red value of most dominant color in the image
 
     return listBGR
 
 
-# FUNCTION to see if the detected BGR color is in range of the threshold
-def __colorInRange(listBGR, colorMIN, colorMAX):
-    """ PRIVATE FUNCTION to see if the detected BGR color is in range of the threshold
+# PRIVATE FUNCTION to get the color ranges of the balls and targets
+def __colorRanges(params=p):
+    """ PRIVATE FUNCTION to get the color ranges of the balls and targets, in the order they are checked
+
+    :param params: parameters of the table (default : parameters module)
+    :return: array of the names, arrays of the minimum and maximum BGR thresholds
+    """
+    ranges = [("WHITE", params.colWHITEMin, params.colWHITEMax),
+              ("YELLOW", params.colYELLOWMin, params.colYELLOWMax),
+              ("WHITE", params.gmColWHITEMin, params.gmColWHITEMax),
+              ("YELLOW", params.gmColYELLOWMin, params.gmColYELLOWMax),
+              ("CYAN", params.gmColCYANMin, params.gmColCYANMax),
+              ("BROWN", params.gmColBROWNMin, params.gmColBROWNMax),
+              ("BLUE", params.colBLUEMin, params.colBLUEMax),
+              ("RED", params.colREDMin, params.colREDMax)]
+    names = np.array([name for name, _, _ in ranges])
+    return names, np.array([low for _, low, _ in ranges]), np.array([high for _, _, high in ranges])
+
+
+# FUNCTION to identify the color of the circles
+def classifyCircles(image, circles, params=p, offset=0.8, classifier=None, exclude=()):
+    """ FUNCTION to identify the color of all the circles at once
+
+    The mean color of the square inside each circle is read in the integral image (4 values per circle whatever its
+    size), then compared to every color range with array operations. The confidence goes from 0.5 (mean color on the
+    limit of its range) to 1 (center of the range), 0 for an unidentified circle.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d7/d1b/group__imgproc__misc.html#ga97b87bec26908237e8ba0f6e96d23e28
+
+    :param image: image array : image without background
+    :param circles: structured array of the circles (BALL_DTYPE), its fields label and confidence are filled
+    :param params: parameters of the table (default : parameters module)
+    :param offset: float : half size of the square compared to the radius
+    :param classifier: dictionary coming from colorLearning.getClassifier : the pixels vote with the learned colors
+                       instead of the mean color compared to the ranges (the colors never learned keep their ranges),
+                       None = color ranges
+    :param exclude: list of strings : colors whose ranges are not used
+    :return: structured array of the circles
+    """
+    if circles.size == 0:
+        return circles
+    if classifier is not None:
+        circles["label"], circles["confidence"] = "", 0
+        circles = __voteColors(image, circles, classifier, offset)
+        missing = circles["label"] == ""
+        if missing.any():
+            circles[missing] = classifyCircles(image, circles[missing], params, offset, exclude=classifier["names"])
+        return circles
+    h, w = image.shape[:2]
+    integral = cv2.integral(image, sdepth=cv2.CV_32S)
+    half = (circles["r"] * offset).astype(np.int32)
+    x0, x1 = np.clip(circles["x"] - half, 0, w), np.clip(circles["x"] + half, 0, w)
+    y0, y1 = np.clip(circles["y"] - half, 0, h), np.clip(circles["y"] + half, 0, h)
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    means = sums // np.maximum((x1 - x0) * (y1 - y0), 1)[:, None]
+
+    names, lows, highs = __colorRanges(params)
+    kept = ~np.isin(names, exclude)
+    if not kept.any():
+        return circles
+    names, lows, highs = names[kept], lows[kept], highs[kept]
+    inRange = np.all((means[:, None, :] >= lows) & (means[:, None, :] <= highs), axis=2)
+    # a black square is the removed background, not a ball
+    found = inRange.any(axis=1) & means.any(axis=1)
+    first = inRange.argmax(axis=1)
+    margins = np.minimum(means[:, None, :] - lows, highs - means[:, None, :]) / np.maximum((highs - lows) / 2, 1)
+    margin = np.clip(margins.min(axis=2)[np.arange(len(circles)), first], 0, 1)
+
+    circles["label"] = np.where(found, names[first], "")
+    circles["confidence"] = np.where(found, 0.5 + 0.5 * margin, 0)
+    return circles
+
+
+# PRIVATE FUNCTION to identify the color of the circles with the lookup classifier
+def __voteColors(image, circles, classifier, offset):
+    """ PRIVATE FUNCTION to identify the color of the circles with the lookup classifier : each pixel of the square
+    inside a circle (except the removed background) votes for the color of its cell of the table, the confidence is
+    the share of the pixels voting for the chosen color
+
+    :param image: image array : image without background
+    :param circles: structured array of the circles (BALL_DTYPE), its fields label and confidence are filled
+    :param classifier: dictionary coming from colorLearning.getClassifier
+    :param offset: float : half size of the square compared to the radius
+    :return: structured array of the circles
+    """
+    h, w = image.shape[:2]
+    shift = 8 - classifier["bits"]
+    lut, names = classifier["lut"], classifier["names"]
+    for circle in circles:
+        half = int(circle["r"] * offset)
+        patch = image[max(circle["y"] - half, 0):min(circle["y"] + half, h),
+                      max(circle["x"] - half, 0):min(circle["x"] + half, w)].reshape((-1, 3))
+        patch = patch[patch.any(axis=1)] >> shift
+        if len(patch) == 0:
+            continue
+        votes = np.bincount(lut[patch[:, 0], patch[:, 1], patch[:, 2]], minlength=len(names) + 1)
+        best = votes[1:].argmax()
+        if votes[best + 1] >= MIN_VOTE * len(patch):
+            circle["label"] = names[best]
+            circle["confidence"] = votes[best + 1] / len(patch)
+    return circles
+
+
+# FUNCTION to keep one ball per color
+def ballDict(balls):
+    """ FUNCTION to keep one ball per color (the most confident one), as used by the games
 
     Source : Mulnard T.
 
-    :param listBGR: list of BGR (blue, green, red) value
-    :param colorMIN: parameter : minimum threshold
-    :param colorMAX: parameter : maximum threshold
-    :return: boolean (true if in range)
+    :param balls: structured array of the balls (BALL_DTYPE)
+    :return: dictionary : name and coordinates of the balls
     """
-    inRange = True
-    for i in range(0, 3):
-        if colorMIN[i] > listBGR[i] or colorMAX[i] < listBGR[i]:
-            inRange = False
-
-    return inRange
+    listBalls = {}
+    for ball in balls[np.argsort(balls["confidence"], kind="stable")]:
+        if ball["label"] != "":
+            listBalls[str(ball["label"])] = (int(ball["x"]), int(ball["y"]))
+    return listBalls
 
 
 # FUNCTION to detect circles in the image
-def circleDetection(image, dp=7, minDist=50, minRadius=15, maxRadius=70, imgDisplayOut=True):
+def circleDetection(image, dp=7, minDist=50, minRadius=15, maxRadius=70, imgDisplayOut=True, params=p, param2=100,
+                    structured=False, classifier=None):
     """ FUNCTION to detect circles in the image
 
     Source : Mulnard T.
@@ -242,82 +614,69 @@ def circleDetection(image, dp=7, minDist=50, minRadius=15, maxRadius=70, imgDisp
     :param minRadius: integer - parameter of cv2.HoughCircles
     :param maxRadius : integer - parameter of cv2.HoughCircles
     :param imgDisplayOut: boolean : if the modification should be done on the output image
-    :return: image array with results, list of the detected circles with their data
+    :param params: parameters of the table (default : parameters module)
+    :param param2: integer - accumulator threshold of cv2.HoughCircles
+    :param structured: boolean : give all the circles (any number per color) as a structured array (BALL_DTYPE)
+                       instead of one ball per color
+    :param classifier: dictionary : lookup classifier of the learned colors (see classifyCircles), None = color ranges
+    :return: image array with results, detected circles (dictionary of one ball per color or structured array)
     """
+    grayImg = parallelTiles.grayImage(image, bufferPool.getBuffer("gray", image.shape[:2]),
+                                      parallelTiles.workerCount(params.parallelWorkers))
 
-    listCircles = {}
-    circText = ""
-    circColor = (255, 255, 255)
-    grayImg = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    circles = cv2.HoughCircles(grayImg, cv2.HOUGH_GRADIENT, dp, minDist, param2=param2, minRadius=minRadius,
+                               maxRadius=maxRadius)
 
-    circles = cv2.HoughCircles(grayImg, cv2.HOUGH_GRADIENT, dp, minDist, minRadius=minRadius, maxRadius=maxRadius)
-
-    # ensure at least some circles were found
+    # convert the (x, y) coordinates and radius of the circles to integers, then identify their color
+    balls = np.zeros(0 if circles is None else circles.shape[1], dtype=BALL_DTYPE)
     if circles is not None:
+        circles = np.round(circles[0, :]).astype(np.int32)
+        balls["x"], balls["y"], balls["r"] = circles[:, 0], circles[:, 1], circles[:, 2]
+        balls = classifyCircles(image, balls, params, classifier=classifier)
+
+    # draw the circle in the output image, then draw a rectangle corresponding to the center of the circle
+    # put text to know the color of the ball
+    if imgDisplayOut:
+        names, _, highs = __colorRanges(params)
+        for x, y, r, label, _ in balls.tolist():
+            if label != "":
+                circColor = tuple(int(value) for value in highs[list(names).index(label)])
+                cv2.putText(image, label, (x, y + r), cv2.FONT_HERSHEY_SIMPLEX, 2, circColor, 2)
+            cv2.circle(image, (x, y), r, (0, 255, 0), 4)
+            cv2.rectangle(image, (x - 5, y - 5), (x + 5, y + 5), (0, 128, 255), -1)
+
+    if structured:
+        return image, balls
+    return image, ballDict(balls)
+
+
+# FUNCTION to compute the keystone matrix from the two sets of tags
+def prjMatrix(tagListTAB, tagListPRJ):
+    """ FUNCTION to compute the keystone matrix from the tags of the table and the tags of the projector
+
+    Source : Mulnard T.
 
-        # convert the (x, y) coordinates and radius of the circles to integers
-        circles = np.round(circles[0, :]).astype("int")
-        # loop over the (x, y) coordinates and radius of the circles
-        for (x, y, r) in circles:
-            # creating an image by taking the zone where the circle is
-            # offset is there to detect the best color possible
-            offset = 0.8
-            imgTemp = image[(y - int(r * offset)):(y + int(r * offset)), (x - int(r * offset)):(x + int(r * offset))]
-
-            # detecting the most dominant color then check for every color
-            listBGR = __dominantcolor(imgTemp)
-
-            if (listBGR[0] != 0) or (listBGR[1] != 0) or (listBGR[2] != 0):
-                # check if WHITE ball
-                if __colorInRange(listBGR, p.colWHITEMin, p.colWHITEMax):
-                    circText = "WHITE"
-                    circColor = p.colWHITEMax
-
-                # check if YELLOW ball
-                elif __colorInRange(listBGR, p.colYELLOWMin, p.colYELLOWMax):
-                    circText = "YELLOW"
-                    circColor = p.colYELLOWMax
-
-                # check if WHITE target
-                elif __colorInRange(listBGR, p.gmColWHITEMin, p.gmColWHITEMax):
-                    circText = "WHITE"
-                    circColor = p.gmColWHITEMax
-
-                # check if YELLOW target
-                elif __colorInRange(listBGR, p.gmColYELLOWMin, p.gmColYELLOWMax):
-                    circText = "YELLOW"
-                    circColor = p.gmColYELLOWMax
-
-                # check if CYAN target
-                elif __colorInRange(listBGR, p.gmColCYANMin, p.gmColCYANMax):
-                    circText = "CYAN"
-                    circColor = p.gmColCYANMax
-
-                # check if BROWN target
-                elif __colorInRange(listBGR, p.gmColBROWNMin, p.gmColBROWNMax):
-                    circText = "BROWN"
-                    circColor = p.gmColBROWNMax
-
-                # check if BLUE ball
-                elif __colorInRange(listBGR, p.colBLUEMin, p.colBLUEMax):
-                    circText = "BLUE"
-                    circColor = p.colBLUEMax
-
-                # check if RED ball
-                elif __colorInRange(listBGR, p.colREDMin, p.colREDMax):
-                    circText = "RED"
-                    circColor = p.colREDMax
-
-                listCircles[circText] = (x, y)
-
-            # draw the circle in the output image, then draw a rectangle corresponding to the center of the circle
-            # put text to know the color of the ball as stated in the dictionnary
-            if imgDisplayOut:
-                cv2.putText(image, circText, (x, y + r), cv2.FONT_HERSHEY_SIMPLEX, 2, circColor, 2)
-                cv2.circle(image, (x, y), r, (0, 255, 0), 4)
-                cv2.rectangle(image, (x - 5, y - 5), (x + 5, y + 5), (0, 128, 255), -1)
-
-    return image, listCircles
+    :param tagListTAB: dictionary : centers of the 4 tags of the pool table
+    :param tagListPRJ: dictionary : centers of the 4 tags of the projected image
+    :return: transformation matrix (KeyError if a tag is missing)
+    """
+    # offset for each set of tags if necessary in the future
+    offsetPRJ = (0, 0)
+    offsetTAB = (0, 0)
+
+    # tags on the projected image, initial positions
+    original = np.float32([[tagListPRJ["TOP_R"][0] - offsetPRJ[0], tagListPRJ["TOP_R"][1] - offsetPRJ[1]],
+                           [tagListPRJ["TOP_L"][0] + offsetPRJ[0], tagListPRJ["TOP_L"][1] + offsetPRJ[1]],
+                           [tagListPRJ["BOT_L"][0] + offsetPRJ[0], tagListPRJ["BOT_L"][1] + offsetPRJ[1]],
+                           [tagListPRJ["BOT_R"][0] - offsetPRJ[0], tagListPRJ["BOT_R"][1] + offsetPRJ[1]]])
+    # tags on the pool table, target positions
+    unwarped = np.float32([[tagListTAB["TOP_R"][0] - offsetTAB[0], tagListTAB["TOP_R"][1] - offsetTAB[1]],
+                           [tagListTAB["TOP_L"][0] + offsetTAB[0], tagListTAB["TOP_L"][1] + offsetTAB[1]],
+                           [tagListTAB["BOT_L"][0] + offsetTAB[0], tagListTAB["BOT_L"][1] + offsetTAB[1]],
+                           [tagListTAB["BOT_R"][0] - offsetTAB[0], tagListTAB["BOT_R"][1] + offsetTAB[1]]])
+
+    # matrix to modify the image
+    return cv2.getPerspectiveTransform(original, unwarped)
 
 
 # FUNCTION to warp the image send via the projector onto the table
@@ -340,32 +699,15 @@ def getPrjMatrix(fromTestImg=False):
     imgIN = cv2.imread(imgPath)
     imgIN = cv2.resize(imgIN, (p.width, p.height))
 
-    # offset for each set of tags if necessary in the future
-    offsetPRJ = (0, 0)
-    offsetTAB = (0, 0)
-
-    # detecting and sorting the tags to get their positions + output of an image
+    # detecting and sorting the two sets of tags in a single pass to get their positions + output of an image
     print("   > detecting the tags...")
-    tagListTAB, image = tagDetect(imgIN, p.tagType)
-    cv2.imwrite(p.kstTagged, image)
-    tagListPRJ, image = tagDetect(image, p.tagTypePRJ)
-    cv2.imwrite(p.kstTagged, image)
+    tagLists, image = registerTags(imgIN, (p.tagType, p.tagTypePRJ))
+    debugWriter.saveImage(p.kstTagged, image)
 
-    # tags on the pool table, target positions
+    # matrix from the tags on the pool table (target positions) and on the projected image (initial positions)
     print("   > analysing the data...")
     try:
-        original = np.float32([[tagListPRJ["TOP_R"][0] - offsetPRJ[0], tagListPRJ["TOP_R"][1] - offsetPRJ[1]],
-                               [tagListPRJ["TOP_L"][0] + offsetPRJ[0], tagListPRJ["TOP_L"][1] + offsetPRJ[1]],
-                               [tagListPRJ["BOT_L"][0] + offsetPRJ[0], tagListPRJ["BOT_L"][1] + offsetPRJ[1]],
-                               [tagListPRJ["BOT_R"][0] - offsetPRJ[0], tagListPRJ["BOT_R"][1] + offsetPRJ[1]]])
-        # tags on the projected image, initial positions
-        unwarped = np.float32([[tagListTAB["TOP_R"][0] - offsetTAB[0], tagListTAB["TOP_R"][1] - offsetTAB[1]],
-                               [tagListTAB["TOP_L"][0] + offsetTAB[0], tagListTAB["TOP_L"][1] + offsetTAB[1]],
-                               [tagListTAB["BOT_L"][0] + offsetTAB[0], tagListTAB["BOT_L"][1] + offsetTAB[1]],
-                               [tagListTAB["BOT_R"][0] - offsetTAB[0], tagListTAB["BOT_R"][1] + offsetTAB[1]]])
-
-        # matrix to modify the image
-        matrix = cv2.getPerspectiveTransform(original, unwarped)
+        matrix = prjMatrix(tagLists[p.tagType], tagLists[p.tagTypePRJ])
 
         # output of the image for a visual representation
         image = cv2.imread(p.kstTemplateIN)
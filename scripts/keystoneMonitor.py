@@ -0,0 +1,217 @@
+""" Keystone monitor part of the project
+This script checks in the background that the projector did not move since the keystone calibration : at a low rate,
+a frame of the camera is taken from the vision loop and the tags of the table and of the projector are detected in a
+single pass. The reprojection error of the projector tags through the stored matrix is measured, and the matrix is
+computed again when the projector has shifted. Each table of the multi-table runtime has its own monitor and its own
+matrix
+
+The projector tags are only in the keystone template : the projected drills do not have them (they would cover the
+tags of the table, see imgProcess.getPrjMatrix), so a monitor only checks the frames taken while the template is
+projected (see showTemplate). During the games, the drift is only found by the next calibration. The single table
+program has no vision loop while the template is projected : its keystone option checks the template frame directly
+(see scriptDP.setKstMatrix)
+"""
+
+import cv2
+import numpy as np
+import os
+import queue
+import threading
+import time
+from scripts import imgProcess, parameters as p
+
+# number of checks in a row above the maximum error before the recalibration (a hand over a tag is not a shift)
+CONFIRM_CHECKS = 2
+
+
+# FUNCTION to create a keystone monitor
+def newMonitor(params=p, matrixPath=p.kstData):
+    """ FUNCTION to create the keystone monitor of a table (started with startMonitor)
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table (check period, maximum error and size of the images)
+    :param matrixPath: string : path of the keystone matrix of the table (csv)
+    :return: dictionary : state of the monitor
+    """
+    return {"params": params,
+            "matrixPath": matrixPath,
+            # frame waiting to be checked (only one, the next frames are dropped while it is checked)
+            "queue": queue.Queue(maxsize=1),
+            # thread checking the frames (None = monitor stopped)
+            "thread": None,
+            # if the keystone template is projected (the other frames do not have the projector tags)
+            "template": False,
+            # last matrix computed by the monitor (None = no recalibration since the start)
+            "matrix": None,
+            # checks done, frames without the tags, checks above the maximum error, recalibrations, last mean error
+            # (pixels) and time of the last submitted frame
+            "status": {"checks": 0, "skipped": 0, "drifts": 0, "recalibrations": 0, "error": None, "lastSubmit": 0.0}}
+
+
+# FUNCTION to measure the reprojection error of the projector tags
+def reprojectionError(matrix, tagListTAB, tagListPRJ):
+    """ FUNCTION to measure the reprojection error of the projector tags through the keystone matrix
+
+    Right after the calibration, the matrix sends each projector tag exactly on the matching table tag : the distance
+    between them grows when the projector (or the camera) moves.
+
+    Source : Mulnard T.
+
+    :param matrix: keystone matrix (see imgProcess.getPrjMatrix)
+    :param tagListTAB: dictionary : centers of the 4 tags of the pool table
+    :param tagListPRJ: dictionary : centers of the 4 tags of the projected image
+    :return: array : error (pixels) of each tag
+    """
+    names = ["TOP_R", "TOP_L", "BOT_L", "BOT_R"]
+    projected = cv2.perspectiveTransform(np.float32([[tagListPRJ[name] for name in names]]), matrix)[0]
+    return np.hypot(*(projected - np.float32([tagListTAB[name] for name in names])).T)
+
+
+# FUNCTION to check the keystone with a frame
+def checkFrame(image, matrix=None, params=p, matrixPath=p.kstData):
+    """ FUNCTION to check the keystone matrix with a frame of the camera
+
+    Source : Mulnard T.
+
+    :param image: image array : frame of the camera (not modified)
+    :param matrix: keystone matrix (default : matrix stored in matrixPath)
+    :param params: parameters of the table (size of the images)
+    :param matrixPath: string : path of the keystone matrix of the table (csv)
+    :return: dictionary : mean and max error (pixels), new matrix computed from the frame, None if the tags are not
+             all visible
+    """
+    if matrix is None:
+        matrix = np.loadtxt(matrixPath, delimiter=",")
+    image = cv2.resize(image, (params.width, params.height))
+    tagLists = imgProcess.registerTags(image, (params.tagType, params.tagTypePRJ), draw=False)[0]
+    if tagLists[params.tagType] == {} or tagLists[params.tagTypePRJ] == {}:
+        return None
+    errors = reprojectionError(matrix, tagLists[params.tagType], tagLists[params.tagTypePRJ])
+    return {"error": float(errors.mean()), "max": float(errors.max()),
+            "matrix": imgProcess.prjMatrix(tagLists[params.tagType], tagLists[params.tagTypePRJ])}
+
+
+# PRIVATE FUNCTION to replace the stored matrix
+def __saveMatrix(matrix, matrixPath):
+    """ PRIVATE FUNCTION to replace the stored matrix (a game loading it at the same time reads the old or the new
+    file, never a part of it)
+
+    :param matrix: keystone matrix
+    :param matrixPath: string : path of the keystone matrix of the table (csv)
+    """
+    temporary = matrixPath + ".tmp"
+    np.savetxt(temporary, matrix, delimiter=",")
+    os.replace(temporary, matrixPath)
+
+
+# PRIVATE FUNCTION run by the monitor thread
+def __monitor(monitor):
+    """ PRIVATE FUNCTION run by the monitor thread : check the frames and recalibrate after a shift
+
+    :param monitor: dictionary coming from newMonitor
+    """
+    params, status = monitor["params"], monitor["status"]
+    shifted = 0
+    while True:
+        image = monitor["queue"].get()
+        if image is None:
+            return
+        try:
+            result = checkFrame(image, params=params, matrixPath=monitor["matrixPath"])
+        except OSError:
+            # no calibration yet
+            result = None
+        if result is None:
+            status["skipped"] += 1
+            continue
+
+        status["checks"] += 1
+        status["error"] = result["error"]
+        if result["error"] <= params.kstMaxError:
+            shifted = 0
+            continue
+        status["drifts"] += 1
+        shifted += 1
+        if shifted >= CONFIRM_CHECKS:
+            __saveMatrix(result["matrix"], monitor["matrixPath"])
+            monitor["matrix"] = result["matrix"]
+            status["recalibrations"] += 1
+            shifted = 0
+            print("   > keystone recalibrated (the projector moved by {:.1f} pixels)".format(result["error"]))
+
+
+# FUNCTION to start a monitor
+def startMonitor(monitor):
+    """ FUNCTION to start a monitor (the vision loop then submits its frames with submitFrame)
+
+    Source : Mulnard T.
+
+    :param monitor: dictionary coming from newMonitor
+    :return: nothing
+    """
+    if monitor["thread"] is not None:
+        return
+    monitor["thread"] = threading.Thread(target=__monitor, args=(monitor,), daemon=True)
+    monitor["thread"].start()
+
+
+# FUNCTION to stop a monitor
+def stopMonitor(monitor):
+    """ FUNCTION to stop a monitor (the frame being checked is finished)
+
+    Source : Mulnard T.
+
+    :param monitor: dictionary coming from newMonitor
+    :return: nothing
+    """
+    if monitor["thread"] is None:
+        return
+    while True:
+        try:
+            monitor["queue"].put_nowait(None)
+            break
+        except queue.Full:
+            # the monitor is busy with a frame : the next one is replaced by the stop
+            try:
+                monitor["queue"].get_nowait()
+            except queue.Empty:
+                pass
+    monitor["thread"].join()
+    monitor["thread"] = None
+
+
+# FUNCTION to tell a monitor if the keystone template is projected
+def showTemplate(monitor, shown):
+    """ FUNCTION to tell a monitor if the keystone template is projected : only these frames have the projector tags,
+    the other frames are not checked
+
+    Source : Mulnard T.
+
+    :param monitor: dictionary coming from newMonitor
+    :param shown: boolean : if the projected image is the keystone template
+    :return: nothing
+    """
+    monitor["template"] = shown
+
+
+# FUNCTION to submit a frame of the vision loop
+def submitFrame(monitor, image):
+    """ FUNCTION to submit a frame of the vision loop (never blocks : the frame is only copied while the keystone
+    template is projected, once per check period, and dropped if the monitor is busy)
+
+    Source : Mulnard T.
+
+    :param monitor: dictionary coming from newMonitor
+    :param image: image array : frame of the camera
+    :return: nothing
+    """
+    now = time.perf_counter()
+    if monitor["thread"] is None or not monitor["template"] or \
+            now - monitor["status"]["lastSubmit"] < monitor["params"].kstCheckPeriod:
+        return
+    monitor["status"]["lastSubmit"] = now
+    try:
+        monitor["queue"].put_nowait(image.copy())
+    except queue.Full:
+        pass
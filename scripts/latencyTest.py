@@ -0,0 +1,132 @@
+""" Latency test part of the project
+This script measures the real delay of the loop projector -> table -> camera -> detection. A tag of the projector
+dictionary (DICT_7X7_100) changes at every cycle, and the time until the camera sees the new tag is measured stage
+by stage over many cycles
+"""
+
+import cv2
+import cv2.aruco
+import numpy as np
+import time
+from scripts import parameters as p
+
+# size (pixels) of the projected tag
+TAG_SIZE = 400
+
+# maximum waiting time (seconds) for the new tag before the cycle is counted as missed
+CYCLE_TIMEOUT = 2.0
+
+# stages of a cycle : drawing of the pattern, projection call, wait until the camera gives the frame with the new tag,
+# tag detection of that frame, and the whole loop
+STAGES = ["render", "display", "camera", "detect", "total"]
+
+
+# PRIVATE FUNCTION to draw the pattern of a cycle
+def __drawPattern(canvas, tagId, arucoDict):
+    """ PRIVATE FUNCTION to draw the pattern of a cycle (one tag in the center of a white image)
+
+    :param canvas: image array : projected image (overwritten)
+    :param tagId: integer : id of the tag in the dictionary
+    :param arucoDict: ArUco dictionary
+    :return: image array : projected image
+    """
+    canvas.fill(255)
+    tag = cv2.aruco.drawMarker(arucoDict, tagId, TAG_SIZE)
+    top = (canvas.shape[0] - TAG_SIZE) // 2
+    left = (canvas.shape[1] - TAG_SIZE) // 2
+    canvas[top:top + TAG_SIZE, left:left + TAG_SIZE] = tag[:, :, None]
+    return canvas
+
+
+# FUNCTION to measure the loop latency
+def measureLatency(projector, camera, cycles=100, tagType=p.tagTypePRJ):
+    """ FUNCTION to measure the latency of the loop projector -> camera -> detection
+
+    At each cycle a new tag is projected, then the frames of the camera are analysed until this tag is found. The
+    frames still showing the previous tag are counted as stale frames.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d5/dae/tutorial_aruco_detection.html
+
+    :param projector: projector with a show(image) method (see projectors.py)
+    :param camera: camera backend (see cameras.py)
+    :param cycles: integer : number of measured cycles
+    :param tagType: string : ArUco dictionary of the projected tags
+    :return: dictionary : duration (seconds) of each stage for each cycle, stale frames per cycle, missed cycles
+    """
+    arucoDict = cv2.aruco.Dictionary_get(getattr(cv2.aruco, tagType))
+    arucoParams = cv2.aruco.DetectorParameters_create()
+    canvas = np.empty((p.height, p.width, 3), dtype=np.uint8)
+    results = {stage: [] for stage in STAGES}
+    results["stale"] = []
+    results["missed"] = 0
+
+    for cycle in range(cycles):
+        # two different tags in a row, so the camera cannot confuse the new one with the previous one
+        tagId = cycle % 2 + 1
+        timeStart = time.perf_counter()
+        image = __drawPattern(canvas, tagId, arucoDict)
+        timeRender = time.perf_counter()
+        projector.show(image)
+        timeDisplay = time.perf_counter()
+
+        stale = 0
+        found = False
+        while not found and time.perf_counter() - timeDisplay < CYCLE_TIMEOUT:
+            frame = camera.capture()
+            timeCamera = time.perf_counter()
+            if frame is None:
+                continue
+            ids = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)[1]
+            timeDetect = time.perf_counter()
+            found = ids is not None and tagId in ids.flatten()
+            stale += not found
+
+        if not found:
+            results["missed"] += 1
+            continue
+        results["render"].append(timeRender - timeStart)
+        results["display"].append(timeDisplay - timeRender)
+        results["camera"].append(timeCamera - timeDisplay)
+        results["detect"].append(timeDetect - timeCamera)
+        results["total"].append(timeDetect - timeStart)
+        results["stale"].append(stale)
+
+    return results
+
+
+# FUNCTION to summarise the distribution of each stage
+def latencyReport(results):
+    """ FUNCTION to summarise the distribution of each stage
+
+    Source : Mulnard T.
+
+    :param results: dictionary coming from measureLatency
+    :return: dictionary : mean, median, 95th percentile and max (milliseconds) of each stage
+    """
+    report = {}
+    for stage in STAGES:
+        values = np.array(results[stage]) * 1000
+        if values.size == 0:
+            continue
+        report[stage] = {"mean": values.mean(), "median": np.median(values), "p95": np.percentile(values, 95),
+                         "max": values.max()}
+    return report
+
+
+# FUNCTION to run the test and print the report
+def showLatency(projector, camera, cycles=100):
+    """ FUNCTION to run the test and print the report
+
+    Source : Mulnard T.
+
+    :param projector: projector with a show(image) method (see projectors.py)
+    :param camera: camera backend (see cameras.py)
+    :param cycles: integer : number of measured cycles
+    :return: nothing
+    """
+    results = measureLatency(projector, camera, cycles)
+    print("      > {} cycles measured, {} missed, {:.1f} stale frames per cycle".format(
+        len(results["total"]), results["missed"], np.mean(results["stale"]) if results["stale"] else 0))
+    for stage, stats in latencyReport(results).items():
+        print("      > {:8s} : mean {:7.2f} ms | median {:7.2f} ms | p95 {:7.2f} ms | max {:7.2f} ms".format(
+            stage, stats["mean"], stats["median"], stats["p95"], stats["max"]))
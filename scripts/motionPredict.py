@@ -0,0 +1,340 @@
+""" Motion prediction part of the project
+This script predicts where a ball will stop from its first positions after the shot. Between two cushions the ball
+rolls in a straight line with a constant deceleration (rolling friction) : each axis is fitted with a second degree
+polynomial of the time, updated incrementally with every new frame. The rest of the way is then simulated with the
+reflections on the cushions
+"""
+
+import math
+import numpy as np
+from scripts import parameters as p
+
+# radius of a ball on the warped image (pixels)
+BALL_RADIUS = 30
+
+# expected deceleration of a rolling ball (pixels / s²), used until enough positions are known
+DECELERATION = 120
+
+# relative uncertainty of the expected deceleration
+PRIOR_SPREAD = 0.5
+
+# standard deviation of the detected positions (pixels), used while the fit has no residual error
+DETECTION_NOISE = 2.0
+
+# part of the speed kept by a ball after a cushion
+CUSHION_RESTITUTION = 0.75
+
+# speed under which the ball is considered stopped (pixels / s)
+STOP_SPEED = 15
+
+# maximum number of cushions simulated for the prediction
+MAX_CUSHIONS = 10
+
+
+# FUNCTION to create a predictor for one ball
+def newPredictor(params=p, decel=DECELERATION):
+    """ FUNCTION to create a predictor for one ball
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table (size of the warped image and width of the cushions)
+    :param decel: float : expected deceleration of the ball (pixels / s²)
+    :return: dictionary : state of the predictor
+    """
+    margin = params.bRectDist + BALL_RADIUS
+    return {"bounds": (margin, margin, params.width - margin, params.height - margin),
+            "decel": decel,
+            "cushions": 0,
+            "positions": 0,
+            "segment": __newSegment(None)}
+
+
+# PRIVATE FUNCTION to start a new straight segment of the ball path
+def __newSegment(start):
+    """ PRIVATE FUNCTION to start a new straight segment of the ball path (after the shot or a cushion)
+
+    :param start: tuple : (time, x, y) of the first position of the segment, None if unknown
+    :return: dictionary : running sums of the least squares fit of the segment
+    """
+    segment = {"t0": None, "n": 0, "sumT": np.zeros(5), "sumXT": np.zeros((2, 3)), "sumX2": np.zeros(2),
+               "coefs": None, "last": None}
+    if start is not None:
+        __addToSegment(segment, *start)
+    return segment
+
+
+# PRIVATE FUNCTION to add a position to the running sums of a segment
+def __addToSegment(segment, t, x, y):
+    """ PRIVATE FUNCTION to add a position to the running sums of a segment and update its fit
+
+    :param segment: dictionary : segment coming from __newSegment
+    :param t: float : time of the position (seconds)
+    :param x: float : coordinate x of the ball
+    :param y: float : coordinate y of the ball
+    """
+    if segment["t0"] is None:
+        segment["t0"] = t
+    t -= segment["t0"]
+    powers = t ** np.arange(5)
+    segment["n"] += 1
+    segment["sumT"] += powers
+    segment["sumXT"] += np.outer((x, y), powers[:3])
+    segment["sumX2"] += (x * x, y * y)
+    segment["last"] = (t, x, y)
+
+    # normal equations of x(t) = c0 + c1 t + c2 t² (a straight line while there are only two positions)
+    degree = min(segment["n"], 3)
+    normal = np.array([[segment["sumT"][i + j] for j in range(degree)] for i in range(degree)])
+    try:
+        coefs = np.linalg.solve(normal, segment["sumXT"][:, :degree].T).T
+    except np.linalg.LinAlgError:
+        return
+    segment["coefs"] = np.pad(coefs, ((0, 0), (0, 3 - degree)))
+
+
+# PRIVATE FUNCTION to get the state of the ball at a time of the segment
+def __segmentState(segment, t):
+    """ PRIVATE FUNCTION to get the fitted position, speed and acceleration at a time of the segment
+
+    :param segment: dictionary : segment with a fit
+    :param t: float : time since the start of the segment
+    :return: tuple of arrays : position, speed, acceleration
+    """
+    c = segment["coefs"]
+    return c[:, 0] + c[:, 1] * t + c[:, 2] * t * t, c[:, 1] + 2 * c[:, 2] * t, 2 * c[:, 2]
+
+
+# PRIVATE FUNCTION to get the state of the ball at the last position with a known deceleration
+def __brakedState(segment, decel):
+    """ PRIVATE FUNCTION to get the position and speed of the ball at the last position, fitted with a known
+    deceleration (the free second degree term is too noisy with the first positions of a segment)
+
+    :param segment: dictionary : segment with a fit
+    :param decel: float : deceleration (pixels / s²)
+    :return: tuple of arrays : position, speed
+    """
+    t = segment["last"][0]
+    speed = __segmentState(segment, t)[1]
+    if segment["n"] < 3 or np.linalg.norm(speed) < STOP_SPEED:
+        return __segmentState(segment, t)[:2]
+
+    # x(t) + decel * t² / 2 * direction = x0 + v0 t : straight line fitted on the corrected positions
+    direction = segment["coefs"][:, 1] / max(np.linalg.norm(segment["coefs"][:, 1]), 1e-9)
+    sumT = segment["sumT"]
+    normal = np.array([[sumT[0], sumT[1]], [sumT[1], sumT[2]]])
+    rhs = segment["sumXT"][:, :2] + 0.5 * decel * np.outer(direction, sumT[2:4])
+    try:
+        x0, v0 = np.linalg.solve(normal, rhs.T)
+    except np.linalg.LinAlgError:
+        return __segmentState(segment, t)[:2]
+    return x0 + v0 * t - 0.5 * decel * t * t * direction, v0 - decel * t * direction
+
+
+# PRIVATE FUNCTION to get the residual error of the fit of a segment
+def __segmentError(segment):
+    """ PRIVATE FUNCTION to get the root mean square distance between the positions and the fit of a segment
+
+    :param segment: dictionary : segment with a fit
+    :return: float : error in pixels
+    """
+    if segment["n"] <= 3:
+        return 0.0
+    c = segment["coefs"]
+    normal = np.array([[segment["sumT"][i + j] for j in range(3)] for i in range(3)])
+    squares = segment["sumX2"] - 2 * np.sum(c * segment["sumXT"], axis=1) + np.einsum("ai,ij,aj->a", c, normal, c)
+    return math.sqrt(max(np.sum(squares), 0) / (segment["n"] - 3))
+
+
+# FUNCTION to add a tracked position of the ball
+def addPosition(predictor, t, position):
+    """ FUNCTION to add a tracked position of the ball (one call per frame)
+
+    A cushion is detected when the ball, close to a side of the table, goes back along that axis. The fit then
+    starts again from that position, with the deceleration measured before as the expected one.
+
+    Source : Mulnard T.
+
+    :param predictor: dictionary : state coming from newPredictor
+    :param t: float : time of the frame (seconds)
+    :param position: tuple : coordinates (x, y) of the ball on the warped image
+    :return: nothing
+    """
+    segment = predictor["segment"]
+    x, y = float(position[0]), float(position[1])
+    predictor["positions"] += 1
+
+    if segment["n"] >= 2 and segment["coefs"] is not None:
+        speed = __segmentState(segment, segment["last"][0])[1]
+        moved = (x - segment["last"][1], y - segment["last"][2])
+        xMin, yMin, xMax, yMax = predictor["bounds"]
+        nearX = min(x - xMin, xMax - x) < 2 * BALL_RADIUS
+        nearY = min(y - yMin, yMax - y) < 2 * BALL_RADIUS
+        # the move back must be larger than the detection noise
+        backX = moved[0] * speed[0] < 0 and abs(moved[0]) > 2 * DETECTION_NOISE
+        backY = moved[1] * speed[1] < 0 and abs(moved[1]) > 2 * DETECTION_NOISE
+        if (nearX and backX) or (nearY and backY):
+            predictor["decel"] = __deceleration(predictor, segment)[0]
+            predictor["cushions"] += 1
+            predictor["segment"] = __newSegment((t, x, y))
+            return
+
+    __addToSegment(segment, t, x, y)
+
+
+# PRIVATE FUNCTION to get the deceleration of the ball
+def __deceleration(predictor, segment):
+    """ PRIVATE FUNCTION to get the deceleration of the ball : fitted value and expected one weighted by the inverse
+    of their variance (the variance of a fitted second degree term is about 180 sigma² / (n T⁴))
+
+    :param predictor: dictionary : state of the predictor
+    :param segment: dictionary : current segment
+    :return: tuple of floats : deceleration (pixels / s²) and its standard deviation
+    """
+    varPrior = (PRIOR_SPREAD * predictor["decel"]) ** 2
+    duration = segment["last"][0] if segment["last"] is not None else 0
+    if segment["n"] < 4 or duration <= 0:
+        return predictor["decel"], math.sqrt(varPrior)
+    speed, acceleration = __segmentState(segment, duration)[1:]
+    norm = np.linalg.norm(speed)
+    if norm < STOP_SPEED:
+        return predictor["decel"], math.sqrt(varPrior)
+
+    fitted = -float(np.dot(acceleration, speed)) / norm
+    noise = max(__segmentError(segment), DETECTION_NOISE)
+    varFit = 720 * noise * noise / (segment["n"] * duration ** 4)
+    decel = (fitted / varFit + predictor["decel"] / varPrior) / (1 / varFit + 1 / varPrior)
+    return max(decel, 0.2 * predictor["decel"]), math.sqrt(1 / (1 / varFit + 1 / varPrior))
+
+
+# PRIVATE FUNCTION to simulate the way of the ball with the cushions
+def __simulate(bounds, position, speed, decel, duration=math.inf):
+    """ PRIVATE FUNCTION to simulate the way of the ball with the reflections on the cushions
+
+    :param bounds: tuple : limits (xMin, yMin, xMax, yMax) of the center of the ball
+    :param position: array : current position
+    :param speed: array : current speed (pixels / s)
+    :param decel: float : deceleration (pixels / s²)
+    :param duration: float : simulated time (seconds, default : until the ball stops)
+    :return: tuple : position, speed, time, number of cushions and distance at the end of the simulation
+    """
+    position, speed = np.array(position, dtype=float), np.array(speed, dtype=float)
+    totalTime, distance, cushions = 0.0, 0.0, 0
+
+    while totalTime < duration:
+        norm = np.linalg.norm(speed)
+        if norm < 1e-6:
+            break
+        direction = speed / norm
+        endTime = min(norm / decel, duration - totalTime)
+
+        # first side reached before the end (time when the travelled distance reaches the side along each axis)
+        hitTime, hitAxis = endTime, None
+        for axis in (0, 1):
+            if abs(direction[axis]) < 1e-9:
+                continue
+            limit = bounds[axis + 2] if direction[axis] > 0 else bounds[axis]
+            length = max((limit - position[axis]) / direction[axis], 0)
+            # norm * t - decel * t² / 2 = length
+            delta = norm * norm - 2 * decel * length
+            if delta >= 0:
+                time = (norm - math.sqrt(delta)) / decel
+                if time < hitTime:
+                    hitTime, hitAxis = time, axis
+
+        travelled = norm * hitTime - decel * hitTime * hitTime / 2
+        position += direction * travelled
+        distance += travelled
+        totalTime += hitTime
+        speed = direction * max(norm - decel * hitTime, 0)
+        if hitAxis is None:
+            break
+
+        # reflection on the cushion, which absorbs part of the speed
+        speed *= CUSHION_RESTITUTION
+        speed[hitAxis] = -speed[hitAxis]
+        cushions += 1
+        if cushions >= MAX_CUSHIONS:
+            break
+
+    return np.clip(position, bounds[:2], bounds[2:]), speed, totalTime, cushions, distance
+
+
+# FUNCTION to predict the rest position of the ball
+def predictRest(predictor):
+    """ FUNCTION to predict the rest position of the ball from the positions received so far
+
+    The uncertainty (sigma, pixels) adds the residual error of the fit to the error of the remaining distance
+    (speed² / 2 deceleration) coming from the errors of the speed and of the deceleration. The confidence goes from
+    0 to 1 (sigma equal to a ball radius = 0.5).
+
+    Source : Mulnard T.
+
+    :param predictor: dictionary : state coming from newPredictor
+    :return: dictionary : rest position, remaining time, cushions to come, sigma and confidence (None if unknown)
+    """
+    segment = predictor["segment"]
+    if segment["coefs"] is None or segment["n"] < 2:
+        return None
+
+    decel, decelError = __deceleration(predictor, segment)
+    position, speed = __brakedState(segment, decel)
+    norm = np.linalg.norm(speed)
+    if norm < STOP_SPEED:
+        rest, remaining, cushions, distance = position, 0.0, 0, 0.0
+    else:
+        rest, _, remaining, cushions, distance = __simulate(predictor["bounds"], position, speed, decel)
+
+    # error of the speed of a straight line fit : about sigma * sqrt(12 / n) / T
+    noise = max(__segmentError(segment), DETECTION_NOISE)
+    speedError = noise * math.sqrt(12 / segment["n"]) / max(segment["last"][0], 1e-3)
+    relativeError = math.hypot(2 * speedError / max(norm, STOP_SPEED), decelError / decel)
+    sigma = math.hypot(noise, distance * relativeError)
+    return {"rest": (int(round(rest[0])), int(round(rest[1]))),
+            "time": remaining,
+            "cushions": cushions,
+            "sigma": sigma,
+            "confidence": 1 / (1 + sigma / BALL_RADIUS),
+            "moving": remaining > 0}
+
+
+# FUNCTION to preview if the ball will stop in a target zone
+def zonePreview(prediction, targetCenter, targetRadius):
+    """ FUNCTION to preview if the ball will stop in a target zone
+
+    Source : Mulnard T.
+
+    :param prediction: dictionary coming from predictRest
+    :param targetCenter: integer tuple : coordinates of the target
+    :param targetRadius: integer : radius of the target zone
+    :return: dictionary : predicted result (same test as the games) and chance of success (0-1)
+    """
+    distance = math.hypot(prediction["rest"][0] - targetCenter[0], prediction["rest"][1] - targetCenter[1])
+    # normal distribution of the error along the line between the target and the predicted position
+    chance = 0.5 * (1 + math.erf((targetRadius - distance) / (max(prediction["sigma"], 1) * math.sqrt(2))))
+    return {"inZone": distance <= targetRadius, "chance": chance}
+
+
+# FUNCTION to simulate the tracked positions of a shot
+def simulateShot(params=p, start=(400, 400), speed=(900, 350), decel=DECELERATION, fps=30, noise=2.0, seed=0):
+    """ FUNCTION to simulate the tracked positions of a shot (test of the predictor without camera)
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table
+    :param start: tuple : position of the ball after the hit
+    :param speed: tuple : speed of the ball after the hit (pixels / s)
+    :param decel: float : deceleration of the ball (pixels / s²)
+    :param fps: float : frame rate of the camera
+    :param noise: float : standard deviation of the detection error (pixels)
+    :param seed: integer : seed of the random noise
+    :return: tuple : list of (time, (x, y)) until the ball stops and the real rest position
+    """
+    bounds = newPredictor(params)["bounds"]
+    random = np.random.default_rng(seed)
+    position, velocity = np.array(start, dtype=float), np.array(speed, dtype=float)
+    positions = [(0.0, tuple(position + random.normal(0, noise, 2)))]
+    while np.linalg.norm(velocity) > 1e-6:
+        position, velocity = __simulate(bounds, position, velocity, decel, 1 / fps)[:2]
+        positions.append((len(positions) / fps, tuple(position + random.normal(0, noise, 2))))
+
+    return positions, (int(round(position[0])), int(round(position[1])))
@@ -0,0 +1,242 @@
+""" Multi-camera part of the project
+This script covers one table with several cameras. Each camera sees the 4 tags around its part of the table (section)
+and has its own homography into the coordinates of the whole warped image. The cameras are detected in parallel and
+the balls seen by two cameras where their sections overlap are merged into one, so the games get the same balls as
+with a single camera. The latency of each camera and of the merged frame are kept for the report
+"""
+
+import concurrent.futures
+import cv2
+import numpy as np
+import time
+import types
+from scripts import bufferPool, cameras, imgProcess, parameters as p
+
+# distance (pixels of the warped image) between two balls of different cameras seen as the same ball (radius of a ball)
+MERGE_DISTANCE = 30
+
+# distance (pixels of the warped image) to the inner edge of a section over which a ball is fully trusted : closer to
+# the edge, the ball may be cut by the edge of the warp and the other camera gets more weight in the merge
+EDGE_RAMP = 100
+
+# lowest weight of a ball in the merge (ball on the inner edge of its section)
+MIN_EDGE_WEIGHT = 0.05
+
+# scale of the frames in the overview given to the motion check of the power scheduler (see powerScheduler.py)
+OVERVIEW_SCALE = 0.25
+
+
+# CLASS with the cameras of one table
+class CameraGroup:
+    """ CLASS with the cameras of one table, each one with its section of the table and its tags
+
+    A section is warped with the tags of its camera (same tag offset as a single camera, see imgProcess.warpMatrix),
+    at full resolution. The background removal only blacks out the sides and the corners of the whole table, so the
+    balls near the inner edges of a section stay visible : the sections should overlap by more than a ball.
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, cameraList, sections, params=p, tagIds=None, offsets=None):
+        """ Create the group of cameras
+
+        :param cameraList: list of camera backends (see cameras.py)
+        :param sections: list of integer tuples : part (x0, y0, x1, y1) of the warped image seen by each camera
+        :param params: parameters of the table (size of the whole warped image)
+        :param tagIds: list of integer lists : ids of the 4 tags of each camera, None = the 4 tags it sees
+        :param offsets: list of integers : horizontal tag offset of each camera, None = parameter of the table
+        """
+        self.cameras = list(cameraList)
+        self.sections = [tuple(int(value) for value in section) for section in sections]
+        self.params = params
+        self.tagIds = list(tagIds) if tagIds is not None else [None] * len(self.cameras)
+        self.offsets = [params.warpOffset if offset is None else offset
+                        for offset in (offsets if offsets is not None else [None] * len(self.cameras))]
+
+        # one worker per camera : the capture and the detection of a camera stay on its thread, so the cameras do not
+        # share the buffers of the pool (see bufferPool.py)
+        self.executors = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for _ in self.cameras]
+
+        # homography (camera frame -> warped image) and duration of each stage of the last frame of each camera
+        self.matrices = [None] * len(self.cameras)
+        self.timings = [{} for _ in self.cameras]
+
+        # latency (seconds) of each camera and of the merged frames
+        self.latency = {"cameras": [[] for _ in self.cameras], "merged": []}
+
+    def capture(self):
+        """ Take a picture with every camera at the same time
+
+        :return: list of image arrays (BGR), None at the end of the frames of a camera
+        """
+        jobs = [executor.submit(camera.capture) for executor, camera in zip(self.executors, self.cameras)]
+        frames = [job.result() for job in jobs]
+        return None if any(frame is None for frame in frames) else frames
+
+    def overview(self, frames):
+        """ Put reduced frames of the cameras side by side (motion check of the whole table)
+
+        :param frames: list of image arrays coming from capture
+        :return: image array
+        """
+        return cv2.hconcat([cv2.resize(frame, None, fx=OVERVIEW_SCALE, fy=OVERVIEW_SCALE,
+                                       interpolation=cv2.INTER_AREA) for frame in frames])
+
+    def detect(self, frames, structured=False):
+        """ Detect the balls of every camera in parallel and merge them
+
+        :param frames: list of image arrays coming from capture
+        :param structured: boolean : give all the detected balls as a structured array (see imgProcess.BALL_DTYPE)
+        :return: dictionary : name and coordinates of the detected balls in the warped image of the whole table (one
+                 per color), or structured array of all the balls
+        """
+        timeStart = time.perf_counter()
+        jobs = [executor.submit(self.__detectCamera, index, frame)
+                for index, (executor, frame) in enumerate(zip(self.executors, frames))]
+        ballLists = [job.result() for job in jobs]
+        balls = mergeBalls(ballLists, self.sections, self.params)
+        self.latency["merged"].append(time.perf_counter() - timeStart)
+        return balls if structured else imgProcess.ballDict(balls)
+
+    def __detectCamera(self, index, image):
+        """ Detect the balls of one camera in its section
+
+        :param index: integer : index of the camera
+        :param image: image array : frame of the camera
+        :return: structured array of the balls (imgProcess.BALL_DTYPE) in the coordinates of the whole warped image
+        """
+        timeStart = time.perf_counter()
+        timings = self.timings[index]
+        tagCenters = imgProcess.tagDetect(image, self.params.tagType, self.params.tagScale, self.tagIds[index])[0]
+        timings["tags"] = time.perf_counter() - timeStart
+        if tagCenters == {}:
+            self.matrices[index] = None
+            self.latency["cameras"][index].append(time.perf_counter() - timeStart)
+            return np.zeros(0, dtype=imgProcess.BALL_DTYPE)
+
+        # own homography of the camera : warp of its section, moved to the place of the section in the table
+        timeStage = time.perf_counter()
+        x0, y0, x1, y1 = self.sections[index]
+        shape = (y1 - y0, x1 - x0, 3)
+        matrix = imgProcess.warpMatrix(tagCenters, self.offsets[index],
+                                       types.SimpleNamespace(width=x1 - x0, height=y1 - y0))
+        self.matrices[index] = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=np.float64) @ matrix
+        warped = cv2.warpPerspective(image, matrix, shape[1::-1], dst=bufferPool.getBuffer("sectionWarped", shape))
+        timings["warp"] = time.perf_counter() - timeStage
+
+        timeStage = time.perf_counter()
+        warped = imgProcess.removeBackground(warped, self.params.bRectDist, self.params.bCircRad, params=self.params,
+                                             dst=bufferPool.getBuffer("sectionNoBackground", shape), origin=(x0, y0))
+        timings["background"] = time.perf_counter() - timeStage
+
+        timeStage = time.perf_counter()
+        balls = imgProcess.circleDetection(warped, dp=7, minDist=50, minRadius=15, maxRadius=70, imgDisplayOut=False,
+                                           params=self.params, param2=100, structured=True,
+                                           classifier=imgProcess.colorClassifier)[1]
+        balls["x"] += x0
+        balls["y"] += y0
+        timings["circles"] = time.perf_counter() - timeStage
+        timings["detect"] = time.perf_counter() - timeStart
+        self.latency["cameras"][index].append(timings["detect"])
+        return balls
+
+    def report(self):
+        """ Get the latency of each camera and of the merged frames
+
+        :return: dictionary : number of frames, mean and maximum latency (seconds) of each camera ('cameras' list) and
+                 of the merged frames ('merged', detection of every camera and merge)
+        """
+        def stats(durations):
+            return {"frames": len(durations),
+                    "mean": float(np.mean(durations)) if durations else 0.0,
+                    "max": float(np.max(durations)) if durations else 0.0}
+
+        return {"cameras": [stats(durations) for durations in self.latency["cameras"]],
+                "merged": stats(self.latency["merged"])}
+
+    def close(self):
+        """ Release the cameras and the workers """
+        for executor in self.executors:
+            executor.shutdown()
+        for camera in self.cameras:
+            camera.close()
+
+
+# FUNCTION to merge the balls seen by several cameras
+def mergeBalls(ballLists, sections, params=p):
+    """ FUNCTION to merge the balls seen by several cameras : the balls of different cameras closer than MERGE_DISTANCE
+    are one ball, at the mean position of the detections weighted by their confidence and by their distance to the
+    inner edge of their section, with the label and the confidence of the heaviest detection
+
+    Source : Mulnard T.
+
+    :param ballLists: list of structured arrays of the balls of each camera (imgProcess.BALL_DTYPE), in the
+                      coordinates of the whole warped image
+    :param sections: list of integer tuples : part (x0, y0, x1, y1) of the warped image seen by each camera
+    :param params: parameters of the table (size of the whole warped image)
+    :return: structured array of the balls (imgProcess.BALL_DTYPE)
+    """
+    balls = np.concatenate([np.zeros(0, dtype=imgProcess.BALL_DTYPE)] + list(ballLists))
+    if len(balls) == 0:
+        return balls
+    cameraIndex = np.concatenate([np.full(len(cameraBalls), index) for index, cameraBalls in enumerate(ballLists)])
+
+    # distance of each ball to the inner edges of its section (the sides of the table are not inner edges)
+    edges = np.full(len(balls), np.inf)
+    for index, (x0, y0, x1, y1) in enumerate(sections):
+        mine = cameraIndex == index
+        for edge, distance in ((x0, balls["x"] - x0), (y0, balls["y"] - y0),
+                               (params.width - x1, x1 - balls["x"]), (params.height - y1, y1 - balls["y"])):
+            if edge > 0:
+                edges[mine] = np.minimum(edges[mine], distance[mine])
+    weights = np.maximum(balls["confidence"], 1e-3) * np.clip(edges / EDGE_RAMP, MIN_EDGE_WEIGHT, 1)
+
+    # the heaviest detections first, each one takes the detections of the other cameras around it
+    merged = []
+    used = np.zeros(len(balls), dtype=bool)
+    for index in np.argsort(-weights, kind="stable"):
+        if used[index]:
+            continue
+        group = ~used & (np.hypot(balls["x"] - balls["x"][index], balls["y"] - balls["y"][index]) < MERGE_DISTANCE)
+        group &= (cameraIndex != cameraIndex[index]) | (np.arange(len(balls)) == index)
+        used |= group
+        ball = balls[index].copy()
+        for field in ("x", "y", "r"):
+            ball[field] = np.round(np.average(balls[field][group], weights=weights[group]))
+        merged.append(ball)
+
+    return np.array(merged, dtype=imgProcess.BALL_DTYPE)
+
+
+# FUNCTION to open the cameras of a table from their configuration
+def openGroup(configList, params=p):
+    """ FUNCTION to open the cameras of a table from their configuration (see tableRuntime.loadTables)
+
+    Source : Mulnard T.
+
+    :param configList: list of dictionaries : options of each camera backend (see cameras.openCamera) with its
+                       'section' (x0, y0, x1, y1), and optionally the 'tags' ids and the tag 'offset' of the camera
+    :param params: parameters of the table
+    :return: CameraGroup
+    """
+    return CameraGroup([cameras.openCamera(config, params) for config in configList],
+                       [config["section"] for config in configList], params,
+                       tagIds=[config.get("tags") for config in configList],
+                       offsets=[config.get("offset") for config in configList])
+
+
+# FUNCTION to print the latency of a group of cameras
+def showLatency(report):
+    """ FUNCTION to print the latency of each camera and of the merged frames of a group of cameras
+
+    Source : Mulnard T.
+
+    :param report: dictionary coming from CameraGroup.report
+    :return: nothing
+    """
+    for index, stats in enumerate(report["cameras"]):
+        print("      > camera {} : {:4d} frames | mean {:6.2f} ms | max {:6.2f} ms".format(
+            index, stats["frames"], 1000 * stats["mean"], 1000 * stats["max"]))
+    stats = report["merged"]
+    print("      > merged   : {:4d} frames | mean {:6.2f} ms | max {:6.2f} ms".format(
+        stats["frames"], 1000 * stats["mean"], 1000 * stats["max"]))
@@ -0,0 +1,188 @@
+""" Tile-parallel part of the project
+This script splits the warped image into horizontal strips processed on a thread pool (OpenCV releases the GIL in
+inRange, morphologyEx, bitwise_and and cvtColor). Each strip is read with an overlap of the size of the morphology
+kernel, so the merged mask is exactly the one of the full image
+"""
+
+import concurrent.futures
+import cv2
+import os
+import time
+from scripts import bufferPool
+
+# number of threads used by OpenCV before any change (restored when the strips are not used)
+defaultCvThreads = cv2.getNumThreads()
+
+# thread pools, one per number of workers
+executors = {}
+
+
+# FUNCTION to set the number of threads used inside OpenCV
+def setThreadPolicy(parallelJobs):
+    """ FUNCTION to set the number of threads used inside OpenCV
+
+    When the program runs several jobs in parallel (strips or tables), each OpenCV call must stay on its own thread,
+    otherwise every call would start its own threads on the same cores.
+
+    Source : Mulnard T.
+
+    :param parallelJobs: integer : number of jobs run in parallel by the program
+    :return: nothing
+    """
+    cv2.setNumThreads(1 if parallelJobs > 1 else defaultCvThreads)
+
+
+# FUNCTION to get the number of workers from the parameter
+def workerCount(workers):
+    """ FUNCTION to get the number of workers from the parameter, and set the thread policy of OpenCV for them
+
+    Source : Mulnard T.
+
+    :param workers: integer : parameter parallel_workers (0 = one per core)
+    :return: integer : number of workers
+    """
+    count = workers if workers > 0 else os.cpu_count()
+
+    # the strips replace the threads of OpenCV (a single worker keeps the policy of the caller, see runTables)
+    if count > 1 and cv2.getNumThreads() != 1:
+        setThreadPolicy(count)
+    return count
+
+
+# PRIVATE FUNCTION to get the thread pool
+def __getExecutor(workers):
+    """ PRIVATE FUNCTION to get the thread pool (created once per number of workers)
+
+    :param workers: integer : number of workers
+    :return: ThreadPoolExecutor
+    """
+    if workers not in executors:
+        executors[workers] = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="strip")
+    return executors[workers]
+
+
+# PRIVATE FUNCTION to split the rows of an image into strips
+def __strips(height, workers):
+    """ PRIVATE FUNCTION to split the rows of an image into strips
+
+    :param height: integer : number of rows
+    :param workers: integer : number of strips
+    :return: list of tuples : (first row, last row + 1) of each strip
+    """
+    step = -(-height // workers)
+    return [(top, min(top + step, height)) for top in range(0, height, step)]
+
+
+# PRIVATE FUNCTION to remove the background of one strip
+def __maskStrip(image, lower, upper, kernelSize, dst, top, bottom):
+    """ PRIVATE FUNCTION to remove the background of one strip (rows top to bottom of dst)
+
+    :param image: image array : full warped image
+    :param lower: array : lower BGR limit of the table color
+    :param upper: array : upper BGR limit of the table color
+    :param kernelSize: integer : size of the morphology kernel
+    :param dst: image array : full output image
+    :param top: integer : first row of the strip
+    :param bottom: integer : last row + 1 of the strip
+    """
+    # a closing (dilation then erosion) needs half a kernel of neighbours for each of its two steps
+    start = max(top - kernelSize, 0)
+    end = min(bottom + kernelSize, image.shape[0])
+    window = image[start:end]
+
+    thresh = cv2.inRange(window, lower, upper, dst=bufferPool.getBuffer("thresh", window.shape[:2]))
+    mask = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, bufferPool.getKernel(kernelSize),
+                            dst=bufferPool.getBuffer("mask", window.shape[:2]))
+    mask = mask[top - start:bottom - start]
+    cv2.bitwise_not(mask, dst=mask)
+
+    # the masked pixels are not written by bitwise_and, so the strip of the output is cleared first
+    out = dst[top:bottom]
+    out.fill(0)
+    cv2.bitwise_and(image[top:bottom], image[top:bottom], dst=out, mask=mask)
+
+
+# FUNCTION to remove the pixels of the table color
+def maskBackground(image, lower, upper, kernelSize, dst=None, workers=1):
+    """ FUNCTION to remove the pixels of the table color (threshold, closing, inverted mask, bitwise_and)
+
+    Source : Mulnard T.
+
+    :param image: image array : warped image
+    :param lower: array : lower BGR limit of the table color
+    :param upper: array : upper BGR limit of the table color
+    :param kernelSize: integer : size of the morphology kernel
+    :param dst: image array : preallocated output, None to allocate a new one
+    :param workers: integer : number of strips processed in parallel
+    :return: image array : image without the background
+    """
+    if dst is None:
+        dst = image.copy()
+
+    if workers <= 1:
+        __maskStrip(image, lower, upper, kernelSize, dst, 0, image.shape[0])
+        return dst
+
+    jobs = [__getExecutor(workers).submit(__maskStrip, image, lower, upper, kernelSize, dst, top, bottom)
+            for top, bottom in __strips(image.shape[0], workers)]
+    for job in jobs:
+        job.result()
+
+    return dst
+
+
+# FUNCTION to convert an image to grey levels
+def grayImage(image, dst, workers=1):
+    """ FUNCTION to convert an image to grey levels, strip by strip
+
+    Source : Mulnard T.
+
+    :param image: image array : BGR image
+    :param dst: image array : preallocated grey output
+    :param workers: integer : number of strips processed in parallel
+    :return: image array : grey image
+    """
+    if workers <= 1:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+    jobs = [__getExecutor(workers).submit(cv2.cvtColor, image[top:bottom], cv2.COLOR_BGR2GRAY, dst=dst[top:bottom])
+            for top, bottom in __strips(image.shape[0], workers)]
+    for job in jobs:
+        job.result()
+
+    return dst
+
+
+# FUNCTION to measure the scaling of the background removal with the number of workers
+def benchmark(image, lower, upper, kernelSize=40, maxWorkers=0, repeat=10):
+    """ FUNCTION to measure the scaling of the background removal with the number of workers
+
+    Source : Mulnard T.
+
+    :param image: image array : warped image
+    :param lower: array : lower BGR limit of the table color
+    :param upper: array : upper BGR limit of the table color
+    :param kernelSize: integer : size of the morphology kernel
+    :param maxWorkers: integer : largest number of workers (0 = one per core, at least 4)
+    :param repeat: integer : number of runs per measure
+    :return: list of tuples : (workers, mean time in seconds, speed-up against one worker)
+    """
+    maxWorkers = maxWorkers if maxWorkers > 0 else max(os.cpu_count(), 4)
+    dst = image.copy()
+    reference = maskBackground(image, lower, upper, kernelSize).copy()
+    results = []
+
+    for workers in range(1, maxWorkers + 1):
+        setThreadPolicy(workers)
+        maskBackground(image, lower, upper, kernelSize, dst, workers)
+        if (dst != reference).any():
+            raise RuntimeError("the strips with {} workers do not give the same image".format(workers))
+
+        timeStart = time.perf_counter()
+        for _ in range(repeat):
+            maskBackground(image, lower, upper, kernelSize, dst, workers)
+        duration = (time.perf_counter() - timeStart) / repeat
+        results.append((workers, duration, results[0][1] / duration if results else 1.0))
+    setThreadPolicy(1)
+
+    return results
@@ -4,67 +4,141 @@ to another. Others parameters aren't subject to change (image  path for example)
 """
 
 import json
+import types
 
-# load user-modifiable parameters from the 'parameters.json' file
-with open("assets/parameters.json", "r") as parametersFile:
-    pFile = json.load(parametersFile)
+
+# FUNCTION to load the user-modifiable parameters of a table
+def loadParameters(paramPath, defaultPath="assets/defaultParameters.json"):
+    """ FUNCTION to load the user-modifiable parameters of a table
+
+    Source : Mulnard T.
+
+    :param paramPath: string : path of the json parameters file
+    :param defaultPath: string : path of the json default parameters file (values of the keys missing in the
+                        parameters file, written before these keys were added)
+    :return: namespace : parameters with the same names as the variables of this module
+    """
+    params = types.SimpleNamespace()
+    with open(defaultPath, "r") as defaultFile:
+        defaults = json.load(defaultFile)
+    with open(paramPath, "r") as parametersFile:
+        pFile = json.load(parametersFile)
+    pFile = {key: pFile.get(key, value) for key, value in defaults.items()}
 
     # camera parameters
-    camRes = pFile['camera_resolution']
-    camRot = pFile['camera_rotation'][0]
-    camWait = pFile['camera_waitTime'][0]
+    params.camRes = pFile['camera_resolution']
+    params.camRot = pFile['camera_rotation'][0]
+    params.camWait = pFile['camera_waitTime'][0]
 
     # general width and height of the images
-    width = pFile['image_resolution'][0]
-    height = pFile['image_resolution'][1]
+    params.width = pFile['image_resolution'][0]
+    params.height = pFile['image_resolution'][1]
 
     # offset distance for the tags in the perspective warper
-    warpOffset = pFile['tag_horizontal_offset'][0]
+    params.warpOffset = pFile['tag_horizontal_offset'][0]
 
     # offset for the contour in the background removing process
-    bRectDist = pFile['background_rectangle_offset'][0]
-    bCircRad = pFile['background_circle_radius'][0]
+    params.bRectDist = pFile['background_rectangle_offset'][0]
+    params.bCircRad = pFile['background_circle_radius'][0]
 
     # variable BGR for the color detection of the pool table
-    tableGREENMin = pFile['table_GREEN_min_value']
-    tableGREENMax = pFile['table_GREEN_max_value']
-    tableBLUEMin = pFile['table_BLUE_min_value']
-    tableBLUEMax = pFile['table_BLUE_max_value']
-    tableREDMin = pFile['table_RED_min_value']
-    tableREDMax = pFile['table_RED_max_value']
+    params.tableGREENMin = pFile['table_GREEN_min_value']
+    params.tableGREENMax = pFile['table_GREEN_max_value']
+    params.tableBLUEMin = pFile['table_BLUE_min_value']
+    params.tableBLUEMax = pFile['table_BLUE_max_value']
+    params.tableREDMin = pFile['table_RED_min_value']
+    params.tableREDMax = pFile['table_RED_max_value']
 
     # variable BGR for the color detection of the balls
-    colYELLOWMin = pFile['ball_YELLOW_min_value']
-    colYELLOWMax = pFile['ball_YELLOW_max_value']
-    colWHITEMin = pFile['ball_WHITE_min_value']
-    colWHITEMax = pFile['ball_WHITE_max_value']
-    colBLUEMin = pFile['ball_BLUE_min_value']
-    colBLUEMax = pFile['ball_BLUE_max_value']
-    colREDMin = pFile['ball_RED_min_value']
-    colREDMax = pFile['ball_RED_max_value']
+    params.colYELLOWMin = pFile['ball_YELLOW_min_value']
+    params.colYELLOWMax = pFile['ball_YELLOW_max_value']
+    params.colWHITEMin = pFile['ball_WHITE_min_value']
+    params.colWHITEMax = pFile['ball_WHITE_max_value']
+    params.colBLUEMin = pFile['ball_BLUE_min_value']
+    params.colBLUEMax = pFile['ball_BLUE_max_value']
+    params.colREDMin = pFile['ball_RED_min_value']
+    params.colREDMax = pFile['ball_RED_max_value']
 
     # variable BGR for the color of the target of the games
-    gmColYELLOWMax = pFile['game_YELLOW_max_value']
-    gmColYELLOWMin = pFile['game_YELLOW_min_value']
-    gmColWHITEMax = pFile['game_WHITE_max_value']
-    gmColWHITEMin = pFile['game_WHITE_min_value']
-    gmColBROWNMax = pFile['game_BROWN_max_value']
-    gmColBROWNMin = pFile['game_BROWN_min_value']
-    gmColCYANMax = pFile['game_CYAN_max_value']
-    gmColCYANMin = pFile['game_CYAN_min_value']
+    params.gmColYELLOWMax = pFile['game_YELLOW_max_value']
+    params.gmColYELLOWMin = pFile['game_YELLOW_min_value']
+    params.gmColWHITEMax = pFile['game_WHITE_max_value']
+    params.gmColWHITEMin = pFile['game_WHITE_min_value']
+    params.gmColBROWNMax = pFile['game_BROWN_max_value']
+    params.gmColBROWNMin = pFile['game_BROWN_min_value']
+    params.gmColCYANMax = pFile['game_CYAN_max_value']
+    params.gmColCYANMin = pFile['game_CYAN_min_value']
 
     # load the radius of the finish zone for the games
-    zoneRadius = pFile["game_zone_radius"][0]
+    params.zoneRadius = pFile["game_zone_radius"][0]
+
+    # latency budget of the detection and smallest working scale (percent) of the adaptive resolution
+    params.latencyBudget = pFile["latency_budget_ms"][0] / 1000
+    params.minScale = pFile["adaptive_min_scale"][0] / 100
+
+    # optional local API server (WebSocket stream and HTTP commands)
+    params.apiEnabled = pFile["api_server_enabled"][0]
+    params.apiPort = pFile["api_server_port"][0]
+
+    # number of strips processed in parallel by the background removal (1 = no strips, 0 = one per core)
+    params.parallelWorkers = pFile["parallel_workers"][0]
+
+    # debug images : policy ('never', 'every' N frames or 'failure' only), format, compression / quality and number of
+    # timestamped files kept per image (0 = always the same file)
+    params.debugPolicy = pFile["debug_image_policy"][0]
+    params.debugEvery = max(pFile["debug_image_policy"][1], 1)
+    params.debugFormat = pFile["debug_image_format"][0]
+    params.debugQuality = pFile["debug_image_format"][1]
+    params.debugKeep = pFile["debug_image_keep"][0]
+
+    # shot capture : frame rate and resolution (percent of the camera resolution) of the window of the table
+    params.shotFps = pFile["shot_capture_fps"][0]
+    params.shotScale = pFile["shot_capture_scale"][0] / 100
+
+    # power states of the live mode : frame rate when active (0 = no limit), frame rate when idle and delay without
+    # motion (seconds) before the idle state
+    params.activeFps = pFile["active_fps"][0]
+    params.idleFps = pFile["idle_fps"][0]
+    params.idleDelay = pFile["idle_delay"][0]
 
-# tag type of the projector
-tagType = "DICT_5X5_50"
-tagTypePRJ = "DICT_7X7_100"
+    # shared memory bus of the frames and detections for the other local processes (see frameBus.py)
+    params.busEnabled = pFile["frame_bus_enabled"][0]
+
+    # keystone monitor : period (seconds, 0 = disabled) of the checks and maximum error (pixels) of the projector tags
+    params.kstCheckPeriod = pFile["keystone_check_period"][0]
+    params.kstMaxError = pFile["keystone_max_error"][0]
+
+    # scale (percent) of the reduced image where the tags are searched before the sub-pixel refinement of their corners
+    # (0 = search on the full image, integer centers)
+    params.tagScale = pFile["tag_detect_scale"][0] / 100
+
+    # change gate of the detection : difference (gray levels) of a pixel of the thumbnails above which a region of the
+    # frame changed (0 = every frame is fully analysed)
+    params.gateThreshold = pFile["detection_gate_threshold"][0]
+
+    # ArUco dictionaries of the tags of the table and of the tags of the projector (not user-modifiable)
+    params.tagType = "DICT_5X5_50"
+    params.tagTypePRJ = "DICT_7X7_100"
+
+    return params
+
+
+# load user-modifiable parameters from the 'parameters.json' file (used by the single table program)
+globals().update(vars(loadParameters("assets/parameters.json")))
+
+# address of the local API server : this computer only ('0.0.0.0' to be reachable from the local network, the commands
+# are not authenticated)
+apiHost = "127.0.0.1"
+
+# prefix of the shared memories of the frame bus
+busName = "deadpool_bus"
 
 # path for the images
 testImgPath = "assets/testImg.png"
 testCamIN = "assets/testCamOUT.png"
 testKstIN = "assets/keystone/kstInputTEST.png"
 pathCamIN = "assets/output/0-cam_input.png"
+pathFailedIN = "assets/output/0-failed_input.png"
 pathWarped = "assets/output/1-warped.png"
 pathNoBack = "assets/output/2-no_background.png"
 pathCircleDtct = "assets/output/3-circle_detect.png"
@@ -73,11 +147,23 @@ kstTemplateOUT = "assets/keystone/kstTemplateOUT.png"
 kstImgPath = "assets/keystone/kstInputCAMERA.png"
 kstTagged = "assets/keystone/kstTagged.png"
 kstData = "assets/keystone/matrix.csv"
+calibSnapshot = "assets/calibration.snap"
+colorModels = "assets/colorModels.json"
+sessionDB = "assets/sessionHistory.db"
+tablesConfig = "assets/tables.json"
+shotLogDir = "assets/shotLog"
+shotEventsPath = "assets/shotEvents.jsonl"
+pathHeatmap = "assets/output/4-heatmap.png"
+pathProfile = "assets/output/5-profile.collapsed"
 gmTemplate = "assets/games/gameTemplate.png"
 gmToDisplay = "assets/games/gameDisplay.png"
 gm1LinePath = "assets/games/game01_Line.png"
 gm2ObstaclePath = "assets/games/game02_Obstacle.png"
 gm3ContactPath = "assets/games/game03_Contact.png"
+gmDrillsDir = "assets/games/drills"
+gm1Drill = "assets/games/drills/drill01_Line.json"
+gm2Drill = "assets/games/drills/drill02_Obstacle.json"
+gm3Drill = "assets/games/drills/drill03_Contact.json"
 
 
 # FUNCTION to play the first game (one ball / one target)
@@ -104,7 +190,8 @@ def __modifyValues(paramFile, nbrValues, condValues, strInfo):
             inputOK = True
             with open("assets/parameters.json", "r") as jsonFile:
                 file = json.load(jsonFile)
-                newValues = file[paramFile]
+            with open("assets/defaultParameters.json", "r") as jsonFile:
+                newValues = file.get(paramFile, json.load(jsonFile)[paramFile])
         # if the user has entered "default"
         elif strValues[0] == "default":
             inputOK = True
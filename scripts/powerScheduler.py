@@ -0,0 +1,165 @@
+""" Power scheduler part of the project
+This script lowers the capture rate of a table when nobody plays : without any drill in progress and without any
+motion in the frames (difference of small grey thumbnails), the table goes to an idle state where the frames are
+only taken at a low rate and the detection is skipped. The first frame with motion brings the table back to the
+active state, and is analysed at once. The time and the CPU used in each state are kept for the report
+"""
+
+import cv2
+import time
+from scripts import bufferPool, parameters as p
+
+# size (w, h) of the thumbnails compared to detect the motion
+THUMB_SIZE = (64, 48)
+
+# mean difference (grey levels) between two thumbnails above which there is motion
+MOTION_THRESHOLD = 4.0
+
+# power states of a table
+STATES = ("active", "idle")
+
+
+# FUNCTION to create a scheduler for one table
+def newScheduler(params=p):
+    """ FUNCTION to create a scheduler for one table
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table (frame rates and delay before the idle state)
+    :return: dictionary : state of the scheduler
+    """
+    now = time.perf_counter()
+    return {"state": "active",
+            "activePeriod": 1 / params.activeFps if params.activeFps > 0 else 0,
+            "idlePeriod": 1 / params.idleFps if params.idleFps > 0 else 0,
+            "idleDelay": params.idleDelay,
+            "thumb": None,
+            "lastMotion": now,
+            "lastFrame": None,
+            "stateSince": now,
+            "time": dict.fromkeys(STATES, 0.0),
+            "cpu": dict.fromkeys(STATES, 0.0),
+            "frames": dict.fromkeys(STATES, 0),
+            "wakeUps": 0}
+
+
+# PRIVATE FUNCTION to change the state of the scheduler
+def __setState(scheduler, state):
+    """ PRIVATE FUNCTION to change the state of the scheduler (the time spent in the previous state is kept)
+
+    :param scheduler: dictionary : state of the scheduler
+    :param state: string : new state
+    """
+    if state == scheduler["state"]:
+        return
+    now = time.perf_counter()
+    scheduler["time"][scheduler["state"]] += now - scheduler["stateSince"]
+    scheduler["stateSince"] = now
+    scheduler["state"] = state
+    if state == "active":
+        scheduler["wakeUps"] += 1
+
+
+# FUNCTION to detect the motion between the frame and the previous one
+def hasMotion(scheduler, image):
+    """ FUNCTION to detect the motion between the frame and the previous one (mean difference of grey thumbnails)
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :param image: image array : frame of the camera
+    :return: boolean : True if there is motion (always True for the first frame)
+    """
+    thumb = cv2.resize(image, THUMB_SIZE, dst=bufferPool.getBuffer("thumbColor", THUMB_SIZE[::-1] + (3,)),
+                       interpolation=cv2.INTER_AREA)
+    thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY, dst=bufferPool.getBuffer("thumb", THUMB_SIZE[::-1]))
+    previous = scheduler["thumb"]
+    scheduler["thumb"] = thumb.copy()
+    if previous is None:
+        return True
+    return cv2.norm(thumb, previous, cv2.NORM_L1) / thumb.size > MOTION_THRESHOLD
+
+
+# FUNCTION to update the scheduler with a new frame
+def updateScheduler(scheduler, image, drillActive=False):
+    """ FUNCTION to update the scheduler with a new frame
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :param image: image array : frame of the camera
+    :param drillActive: boolean : if a drill is in progress on the table
+    :return: boolean : if the frame must be analysed (False in the idle state)
+    """
+    now = time.perf_counter()
+    scheduler["lastFrame"] = now
+    if hasMotion(scheduler, image) or drillActive:
+        scheduler["lastMotion"] = now
+        __setState(scheduler, "active")
+    elif now - scheduler["lastMotion"] > scheduler["idleDelay"]:
+        __setState(scheduler, "idle")
+
+    scheduler["frames"][scheduler["state"]] += 1
+    return scheduler["state"] == "active"
+
+
+# FUNCTION to add the CPU time used by a frame
+def addCpuTime(scheduler, cpuTime):
+    """ FUNCTION to add the CPU time used by a frame to its power state
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :param cpuTime: float : CPU time of the thread which processed the frame (seconds, see time.thread_time)
+    :return: nothing
+    """
+    scheduler["cpu"][scheduler["state"]] += cpuTime
+
+
+# FUNCTION to wake up a table
+def wakeUp(scheduler):
+    """ FUNCTION to wake up a table (drill started, command of the API) : the next frame is taken at once
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :return: nothing
+    """
+    scheduler["lastMotion"] = time.perf_counter()
+    scheduler["lastFrame"] = None
+    __setState(scheduler, "active")
+
+
+# FUNCTION to get the waiting time before the next frame
+def waitTime(scheduler):
+    """ FUNCTION to get the waiting time before the next frame of the table
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :return: float : seconds (0 or less = the frame can be taken now)
+    """
+    if scheduler["lastFrame"] is None:
+        return 0.0
+    period = scheduler["activePeriod"] if scheduler["state"] == "active" else scheduler["idlePeriod"]
+    return scheduler["lastFrame"] + period - time.perf_counter()
+
+
+# FUNCTION to get the report of the power states
+def schedulerReport(scheduler):
+    """ FUNCTION to get the time, the frames and the CPU utilisation of each power state
+
+    Source : Mulnard T.
+
+    :param scheduler: dictionary : state of the scheduler
+    :return: dictionary : for each state, time (seconds), share of the time, frames and CPU utilisation (0-1 of
+             one core)
+    """
+    times = dict(scheduler["time"])
+    times[scheduler["state"]] += time.perf_counter() - scheduler["stateSince"]
+    total = sum(times.values()) or 1
+    return {state: {"time": times[state],
+                    "share": times[state] / total,
+                    "frames": scheduler["frames"][state],
+                    "cpu": scheduler["cpu"][state] / times[state] if times[state] > 0 else 0.0}
+            for state in STATES}
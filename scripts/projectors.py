@@ -0,0 +1,81 @@
+""" Projector part of the project
+This script gives the same interface to the different outputs of the images projected on the table : a fullscreen
+window on the projector, or a buffer which keeps the projected images in memory (used without any projector, the
+loopback camera of cameras.py reads it back)
+"""
+
+import cv2
+import time
+
+
+# CLASS to project the images in a fullscreen window
+class WindowProjector:
+    """ CLASS to project the images in a fullscreen window (the projector is the screen of the Raspberry Pi)
+
+    Source : Mulnard T. and https://gist.github.com/ronekko/dc3747211543165108b11073f929b85e
+    """
+
+    def __init__(self, windowName="projector", fullscreen=True):
+        """ Open the window
+
+        :param windowName: string : name of the window
+        :param fullscreen: boolean : if the window should be in full screen
+        """
+        self.windowName = windowName
+        cv2.namedWindow(windowName, cv2.WND_PROP_FULLSCREEN if fullscreen else cv2.WINDOW_NORMAL)
+        if fullscreen:
+            cv2.setWindowProperty(windowName, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+
+    def show(self, image):
+        """ Show an image without waiting for a key
+
+        :param image: image array
+        :return: nothing
+        """
+        cv2.imshow(self.windowName, image)
+        cv2.waitKey(1)
+
+    def close(self):
+        """ Close the window """
+        cv2.destroyWindow(self.windowName)
+
+
+# CLASS to keep the projected images in memory
+class BufferProjector:
+    """ CLASS to keep the projected images in memory instead of showing them
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, delay=0.0):
+        """ Create the buffer
+
+        :param delay: float : simulated delay (seconds) between the projection and the moment the image is visible
+        """
+        self.delay = delay
+        self.images = []
+
+    def show(self, image):
+        """ Keep a copy of the image with the time of the projection
+
+        :param image: image array
+        :return: nothing
+        """
+        self.images.append((time.perf_counter(), image.copy()))
+
+    def visible(self):
+        """ Get the image visible now on the table
+
+        :return: image array, None if nothing is visible yet
+        """
+        now = time.perf_counter()
+        # the images older than the visible one are not needed anymore
+        while len(self.images) > 1 and self.images[1][0] + self.delay <= now:
+            self.images.pop(0)
+        if self.images and self.images[0][0] + self.delay <= now:
+            return self.images[0][1]
+        return None
+
+    def close(self):
+        """ Release the images """
+        self.images.clear()
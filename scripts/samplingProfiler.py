@@ -0,0 +1,158 @@
+""" Sampling profiler part of the project
+This script finds where the Python time of the program goes without any external tool : a background thread reads
+the call stack of the profiled threads at a fixed interval and counts each stack. The stacks are written in the
+collapsed format (one line per stack, read by speedscope and the flamegraph scripts) and the functions of the detection
+are ranked by their share of the samples
+"""
+
+import os
+import sys
+import threading
+import time
+from scripts import parameters as p
+
+# interval (seconds) between two samples of the stacks
+SAMPLE_INTERVAL = 0.005
+
+# modules of the functions ranked by the summary
+SUMMARY_MODULES = ("imgProcess", "scriptDP")
+
+
+# PRIVATE FUNCTION to get the stack of a frame
+def __frameStack(frame):
+    """ PRIVATE FUNCTION to get the stack of a frame, as a tuple of 'module:function' names (outermost call first)
+
+    :param frame: frame object coming from sys._current_frames
+    :return: tuple of strings
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("{}:{}".format(frame.f_globals.get("__name__", "?"), getattr(code, "co_qualname", code.co_name)))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+# PRIVATE FUNCTION to sample the stacks until the profiler is stopped
+def __sampleLoop(profiler):
+    """ PRIVATE FUNCTION to sample the stacks of the profiled threads until the profiler is stopped
+
+    :param profiler: dictionary : state of the profiler (see startProfiler)
+    :return: nothing
+    """
+    samplerId = threading.get_ident()
+    names = {}
+    while not profiler["stop"].wait(profiler["interval"]):
+        timeSample = time.perf_counter()
+        for threadId, frame in sys._current_frames().items():
+            if threadId == samplerId or (profiler["threadId"] is not None and threadId != profiler["threadId"]):
+                continue
+            stack = __frameStack(frame)
+            if profiler["threadId"] is None:
+                # every thread : the name of the thread is the root of its stacks
+                if threadId not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = ("thread:" + names.get(threadId, str(threadId)),) + stack
+            profiler["stacks"][stack] = profiler["stacks"].get(stack, 0) + 1
+        profiler["samples"] += 1
+        profiler["sampleTime"] += time.perf_counter() - timeSample
+
+
+# FUNCTION to start the sampling profiler
+def startProfiler(interval=SAMPLE_INTERVAL, allThreads=False):
+    """ FUNCTION to start the sampling profiler on a background thread
+
+    Source : Mulnard T. and https://docs.python.org/3/library/sys.html#sys._current_frames
+
+    :param interval: float : interval (seconds) between two samples
+    :param allThreads: boolean : sample every thread of the program (tables of the multi-table runtime, workers of
+                       the cameras), False = only the thread starting the profiler
+    :return: dictionary : state of the profiler, to give to stopProfiler
+    """
+    profiler = {"interval": interval,
+                "threadId": None if allThreads else threading.get_ident(),
+                "stacks": {},
+                "samples": 0,
+                "sampleTime": 0.0,
+                "start": time.perf_counter(),
+                "duration": 0.0,
+                "stop": threading.Event()}
+    profiler["thread"] = threading.Thread(target=__sampleLoop, args=(profiler,), name="samplingProfiler", daemon=True)
+    profiler["thread"].start()
+    return profiler
+
+
+# FUNCTION to stop the sampling profiler
+def stopProfiler(profiler):
+    """ FUNCTION to stop the sampling profiler and wait for its thread
+
+    Source : Mulnard T.
+
+    :param profiler: dictionary coming from startProfiler
+    :return: nothing
+    """
+    profiler["stop"].set()
+    profiler["thread"].join()
+    profiler["duration"] = time.perf_counter() - profiler["start"]
+
+
+# FUNCTION to write the sampled stacks in the collapsed format
+def writeCollapsed(profiler, path=p.pathProfile):
+    """ FUNCTION to write the sampled stacks in the collapsed format : one line per stack, the calls separated by ';'
+    and followed by the number of samples (file opened by https://www.speedscope.app or flamegraph.pl)
+
+    Source : Mulnard T. and https://github.com/brendangregg/FlameGraph#2-fold-stacks
+
+    :param profiler: dictionary coming from stopProfiler
+    :param path: string : path of the written file
+    :return: nothing
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as profileFile:
+        for stack, count in sorted(profiler["stacks"].items(), key=lambda item: -item[1]):
+            profileFile.write("{} {}\n".format(";".join(name.replace(";", ",").replace(" ", "_") for name in stack),
+                                               count))
+
+
+# FUNCTION to rank the functions of the detection
+def topFunctions(profiler, modules=SUMMARY_MODULES, count=10):
+    """ FUNCTION to rank the functions of some modules by their share of the samples : own share (the function is
+    running, or waiting for a call outside these modules such as OpenCV) and total share (the function is in the stack)
+
+    Source : Mulnard T.
+
+    :param profiler: dictionary coming from stopProfiler
+    :param modules: tuple of strings : names of the modules (last part, ex: 'imgProcess')
+    :param count: integer : number of ranked functions
+    :return: list of tuples (function name, own share, total share), largest total share first
+    """
+    total = sum(profiler["stacks"].values())
+    own, inStack = {}, {}
+    for stack, samples in profiler["stacks"].items():
+        names = [name for name in stack if name.split(":")[0].split(".")[-1] in modules]
+        if not names:
+            continue
+        own[names[-1]] = own.get(names[-1], 0) + samples
+        for name in set(names):
+            inStack[name] = inStack.get(name, 0) + samples
+
+    ranked = sorted(inStack, key=lambda name: (-inStack[name], -own.get(name, 0)))[:count]
+    return [(name, own.get(name, 0) / total, inStack[name] / total) for name in ranked] if total > 0 else []
+
+
+# FUNCTION to print the summary of a profile
+def showSummary(profiler, path=p.pathProfile, count=10):
+    """ FUNCTION to print the summary of a profile : samples, cost of the sampling, file of the stacks and top functions
+    of the detection
+
+    Source : Mulnard T.
+
+    :param profiler: dictionary coming from stopProfiler
+    :param path: string : path of the written stacks
+    :param count: integer : number of ranked functions
+    :return: nothing
+    """
+    print("      > {} samples in {:.2f} s | sampling cost {:.1%} of the run | stacks written in {}".format(
+        profiler["samples"], profiler["duration"], profiler["sampleTime"] / max(profiler["duration"], 1e-9), path))
+    for name, ownShare, totalShare in topFunctions(profiler, count=count):
+        print("      > {:50s} : own {:5.1%} | total {:5.1%}".format(name, ownShare, totalShare))
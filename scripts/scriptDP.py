@@ -1,7 +1,9 @@
 import cv2
+import numpy as np
 import time
-from scripts import imgProcess, parameters as p
-from numpy import loadtxt, savetxt
+from scripts import imgProcess, adaptiveRes, apiServer, bufferPool, calibSnapshot, debugWriter, detectionGate, \
+    drillGenerator, frameBus, gameEngine, keystoneMonitor, shotLog, parameters as p
+from numpy import savetxt
 from tabulate import tabulate
 
 # try to import and setup the PiCamera (used to avoid errors when developing on another computer than the raspberry
@@ -13,6 +15,66 @@ try:
 except NameError and ModuleNotFoundError:
     print("   <WARNING> camera module not found")
 
+# duration (seconds) of each stage of the last capture and detection
+stageTimes = {}
+
+# if the steps of the detection are printed in the terminal (disabled by the headless runtimes)
+verbose = True
+
+# working resolution of the detection while the balls are placed (see adaptiveRes.py)
+resController = adaptiveRes.newController()
+
+# if the images of the detection are written in preallocated buffers (see bufferPool.py)
+useBufferPool = True
+
+# data of the last played drill (used for the session history)
+lastShot = {}
+
+# backends of the projector (imgShow) and of the camera (imgTake) used instead of the fullscreen window and of the Pi
+# camera, None = real hardware (see projectors.py, cameras.py and virtualRig.py)
+projector = None
+cameraBackend = None
+
+# frames taken by the camera backend, read by detectBall instead of the image files
+capturedFrames = {}
+
+# pause (seconds) before the placement and before the shot, to let the player read the instructions
+pauseTime = 2
+
+# change gate of detectBall : balls of the last analysed frame given again while nothing moves (see detectionGate.py)
+gate = detectionGate.newGate()
+
+
+
+# FUNCTION to create the outputs of the detection of a table
+def newSinks(bus=False, monitor=None, topic=None):
+    """ FUNCTION to create the outputs of the detection of a table : where its frames and its detections are sent
+
+    Source : Mulnard T.
+
+    :param bus: boolean : publish the frames and the detections on the frame bus of the process (see frameBus.py)
+    :param monitor: dictionary : keystone monitor of the table (see keystoneMonitor.newMonitor), None = not checked
+    :param topic: string : prefix of the topics of the table on the local API (see apiServer.py), None = not published
+    :return: dictionary : outputs of the detection
+    """
+    return {"bus": bus, "monitor": monitor, "topic": topic}
+
+
+# outputs of the detection of the single table program
+defaultSinks = newSinks(bus=True, topic="")
+
+
+# PRIVATE FUNCTION to publish a topic of a table on the local API
+def __publish(sinks, topic, data):
+    """ PRIVATE FUNCTION to publish a topic of a table on the local API (nothing if the table has no topic)
+
+    :param sinks: dictionary coming from newSinks
+    :param topic: string : name of the topic (without the prefix of the table)
+    :param data: json serializable data of the topic
+    """
+    if sinks["topic"] is not None:
+        apiServer.publish(sinks["topic"] + topic, data)
+
 
 # FUNCTION to take a picture with the camera
 def imgTake(camPath, preview=False):
@@ -26,12 +88,19 @@ def imgTake(camPath, preview=False):
     """
 
     print("   > taking picture...")
+    if cameraBackend is not None:
+        timeStart = time.perf_counter()
+        capturedFrames[camPath] = cameraBackend.capture()
+        stageTimes["capture"] = time.perf_counter() - timeStart
+        return
     try:
         if preview:
             camera.start_preview()
         camera.rotation = p.camRot 
         time.sleep(p.camWait)
+        timeStart = time.perf_counter()
         camera.capture(camPath)
+        stageTimes["capture"] = time.perf_counter() - timeStart
         if preview:
             camera.stop_preview()
     except NameError:
@@ -44,14 +113,17 @@ def imgShow(imgPath, windowName="window", waitTime=0, fullscreen=True):
 
     Source : MULNARD T. and https://gist.github.com/ronekko/dc3747211543165108b11073f929b85e
 
-    :param imgPath: string : path of the image to show
+    :param imgPath: string or image array : path of the image to show, or the image itself
     :param windowName: string : name of the window
     :param waitTime: integer : wait time before the window is closed. Default 0 = wait for key press
     :param fullscreen: boolean : if the output should be in full screen
     """
 
     print("   > showing image...")
-    image = cv2.imread(imgPath)
+    image = cv2.imread(imgPath) if isinstance(imgPath, str) else imgPath
+    if projector is not None:
+        projector.show(image)
+        return
     if fullscreen:
         cv2.namedWindow(windowName, cv2.WND_PROP_FULLSCREEN)
         cv2.setWindowProperty(windowName, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
@@ -71,6 +143,16 @@ def setKstMatrix(fromTesting=False):
     """
     imgShow(p.kstTemplateIN)
     imgTake(p.kstImgPath)
+
+    # drift of the previous calibration (the template is the only projected image with the projector tags)
+    image = cv2.imread(p.testKstIN if fromTesting else p.kstImgPath)
+    try:
+        result = None if image is None else keystoneMonitor.checkFrame(image)
+    except OSError:
+        # no calibration yet
+        result = None
+    if result is not None:
+        print("   > the projector moved by {:.1f} pixels since the last keystone".format(result["error"]))
     matrix = imgProcess.getPrjMatrix(fromTestImg=fromTesting)
     try:
         savetxt(p.kstData, matrix, delimiter=",")
@@ -79,71 +161,191 @@ def setKstMatrix(fromTesting=False):
         matrix = 0
 
 # FUNCTION perspective correction and detecting the ball(s)
-def detectBall(imgPath):
+def detectBall(imgPath, adaptive=False):
     """ FUNCTION to correct the perspective adn detect the balls
 
     Source : Mulnard T.
 
     :param imgPath: string : path of the start image
+    :param adaptive: boolean : use the working resolution of the latency budget instead of the full resolution
     :return: dictionary : name and coordinates of the detected balls
     """
 
-    image = cv2.imread(imgPath)
+    timeStart = time.perf_counter()
+    image = capturedFrames.pop(imgPath, None)
+    if image is None:
+        image = cv2.imread(imgPath)
+    stageTimes["read"] = time.perf_counter() - timeStart
 
-    print("   > detecting tags...")
-    tagCenters = imgProcess.tagDetect(image, p.tagType)[0]
-    if tagCenters == {}:
-        print("<WARNING> Failed to detect the tags")
-        dictCircles = {}
-        return dictCircles
+    return detectBallGated(image, gate, controller=resController if adaptive else None)
 
-    print("   > warping image...")
-    image = imgProcess.warpPerspective(image, tagCenters, p.warpOffset)
-    cv2.imwrite(p.pathWarped, image)
 
-    # removing background
-    print("   > removing background...")
-    image = imgProcess.removeBackground(image, p.bRectDist, p.bCircRad)
-    cv2.imwrite(p.pathNoBack, image)
-
-    # detecting the white ball using circle detection
-    print("   > detecting the circles...")
-    image, dictCircles = imgProcess.circleDetection(image)
-    cv2.imwrite(p.pathCircleDtct, image)
-
-    return dictCircles
+# FUNCTION to detect the balls of a frame through a change gate
+def detectBallGated(image, gate, params=p, timings=None, debugOut=True, controller=None, tags=None, sinks=None):
+    """ FUNCTION to detect the balls of a frame through a change gate : the balls of the last analysed frame while
+    nothing moves, the changed regions only after a few changes, the whole frame otherwise (see detectionGate.py)
 
+    Source : Mulnard T.
 
-# PRIVATE FUNCTION to detect if the centers of the detected ball is in the target zone
-def __inZone(ballCenter, targetCenter, targetRadius):
-    """ Detect if the centers of the detected ball is in the target zone (variable radius)
+    :param image: image array : coming from cv2.imread or from a camera backend
+    :param gate: dictionary : gate of the table (see detectionGate.newGate)
+    :param params: parameters of the table (default : parameters module)
+    :param timings: dictionary : where the duration (seconds) of each stage is stored (default : stageTimes)
+    :param debugOut: boolean : if the intermediate images of an analysed frame are given to the debug writer
+    :param controller: dictionary : working resolution of the latency budget (see adaptiveRes.newController), None =
+                       full resolution (the balls kept at a reduced resolution are not given again)
+    :param tags: dictionary : where the centers of the tags of an analysed frame are stored, None = not kept
+    :param sinks: dictionary coming from newSinks : outputs of the table (default : single table program)
+    :return: dictionary : name and coordinates of the detected balls
+    """
+    timings = stageTimes if timings is None else timings
+    sinks = defaultSinks if sinks is None else sinks
+    scale = 1.0 if controller is None else controller["scale"]
+
+    # nothing moved since the last analysed frame : its balls, a few changes : only the changed regions
+    timeStart = time.perf_counter()
+    state, regions = detectionGate.checkFrame(gate, image, params, scale)
+    if state != "full":
+        balls = gate["balls"] if state == "hit" else detectionGate.analyseRegions(gate, image, regions, params,
+                                                                                  classifier=imgProcess.colorClassifier)
+        timings["gate"] = time.perf_counter() - timeStart
+        detectionGate.recordFrame(gate, state, timings["gate"])
+        __publish(sinks, "gate", detectionGate.gateReport(gate))
+        return imgProcess.ballDict(balls)
+
+    tags = {} if tags is None else tags
+    balls = detectBallFrame(image, params, timings, debugOut=debugOut, scale=scale, structured=True,
+                            tags=tags, sinks=sinks)
+    if controller is not None:
+        adaptiveRes.updateTimings(controller, timings, scale)
+    detectionGate.storeFrame(gate, balls, tags, params, scale)
+    timings["gate"] = time.perf_counter() - timeStart
+    detectionGate.recordFrame(gate, state, timings["gate"])
+    __publish(sinks, "gate", detectionGate.gateReport(gate))
+    return imgProcess.ballDict(balls)
+
+
+# FUNCTION perspective correction and detecting the ball(s) in an image array
+def detectBallFrame(image, params=p, timings=None, debugOut=True, scale=1.0, structured=False, tags=None, sinks=None):
+    """ FUNCTION to correct the perspective and detect the balls in an image array
 
     Source : Mulnard T.
 
-    :param ballCenter: integer tuple : coordinates of the ball
-    :param targetCenter: integer tuple : coordinates of the target
-    :param targetRadius: integer : target radius
-    :return: boolean value (true if in zone)
+    :param image: image array : coming from cv2.imread or from a camera backend
+    :param params: parameters of the table (default : parameters module)
+    :param timings: dictionary : where the duration (seconds) of each stage is stored (default : stageTimes)
+    :param debugOut: boolean : if the intermediate images are given to the debug writer (see debugWriter.py)
+    :param scale: float : working scale of the warp, background removal and detection (1 = image_resolution)
+    :param structured: boolean : give all the detected balls as a structured array (see imgProcess.BALL_DTYPE)
+    :param tags: dictionary : where the centers of the tags are stored (emptied if they are not found), None = not kept
+    :param sinks: dictionary coming from newSinks : outputs of the table (default : single table program)
+    :return: dictionary : name and coordinates (at full resolution) of the detected balls (one per color), or
+             structured array of all the balls
     """
-    isInZone = False
-    if ((ballCenter[0] - targetCenter[0]) ** 2) + ((ballCenter[1] - targetCenter[1]) ** 2) <= (targetRadius ** 2):
-        isInZone = True
-    return isInZone
+    timeStart = time.perf_counter()
+    timings = stageTimes if timings is None else timings
+    sinks = defaultSinks if sinks is None else sinks
+    debugFrame = debugWriter.newFrame(params) if debugOut else None
+    if sinks["bus"]:
+        frameBus.publishFrame("raw", image)
+    if sinks["monitor"] is not None:
+        keystoneMonitor.submitFrame(sinks["monitor"], image)
+
+    if verbose:
+        print("   > detecting tags...")
+    tagCenters = imgProcess.tagDetect(image, params.tagType, params.tagScale)[0]
+    if tags is not None:
+        tags.clear()
+        tags.update(tagCenters)
+    timings["tags"] = time.perf_counter() - timeStart
+    __publish(sinks, "tags", {"found": tagCenters != {}, "centers": tagCenters})
+    if tagCenters == {}:
+        # no scaled stage for this frame (the timings of the previous frame are not given to the controller again)
+        for stage in adaptiveRes.SCALED_STAGES:
+            timings.pop(stage, None)
+        timings["detect"] = time.perf_counter() - timeStart
+        if verbose:
+            print("<WARNING> Failed to detect the tags")
+        debugWriter.addImage(debugFrame, p.pathFailedIN, image)
+        debugWriter.endFrame(debugFrame, failure=True, params=params)
+        dictCircles = np.zeros(0, dtype=imgProcess.BALL_DTYPE) if structured else {}
+        if sinks["bus"]:
+            frameBus.publishDetections(dictCircles)
+        return dictCircles
+
+    dictCircles = detectBallTags(image, tagCenters, params, timings, debugFrame, scale, structured, sinks)
+    debugWriter.endFrame(debugFrame, failure=len(dictCircles) == 0, params=params)
+    timings["detect"] = time.perf_counter() - timeStart
+    __publish(sinks, "detections", {"balls": imgProcess.ballDict(dictCircles) if structured else dictCircles,
+                                    "timings": timings, "scale": scale})
+    if sinks["bus"]:
+        frameBus.publishDetections(dictCircles)
+
+    return dictCircles
 
 
-# PRIVATE FUNCTION to get the score based on the coordinates
-def __getScore(ballCenter, targetCenter):
-    """ FUNCTION to get the score based on the ball and the target coordinates
+# FUNCTION to detect the balls in an image array with known tags
+def detectBallTags(image, tagCenters, params=p, timings=None, debugFrame=None, scale=1.0, structured=False,
+                   sinks=None):
+    """ FUNCTION to correct the perspective and detect the balls in an image array with known tags
 
     Source : Mulnard T.
 
-    :param ballCenter: integer tuple :  coordinates of the ball
-    :param targetCenter: integer tuple : coordinates of the target
-    :return: integer : the calculated score
+    :param image: image array : coming from cv2.imread or from a camera backend
+    :param tagCenters: dictionary : centers of the 4 tags in the image (coming from imgProcess.tagDetect)
+    :param params: parameters of the table (default : parameters module)
+    :param timings: dictionary : where the duration (seconds) of each stage is stored (default : stageTimes)
+    :param debugFrame: list coming from debugWriter.newFrame, None = no debug images
+    :param scale: float : working scale of the warp, background removal and detection (1 = image_resolution)
+    :param structured: boolean : give all the detected balls as a structured array (see imgProcess.BALL_DTYPE)
+    :param sinks: dictionary coming from newSinks : outputs of the table (default : single table program)
+    :return: dictionary : name and coordinates (at full resolution) of the detected balls (one per color), or
+             structured array of all the balls
     """
-    score = abs(ballCenter[0] - targetCenter[0])
-    score += abs(ballCenter[1] - targetCenter[1])
-    return score
+    timings = stageTimes if timings is None else timings
+    sinks = defaultSinks if sinks is None else sinks
+    if verbose:
+        print("   > warping image...")
+    timeStage = time.perf_counter()
+    shape = (int(params.height * scale), int(params.width * scale), 3)
+    warped = bufferPool.getBuffer("warped", shape) if useBufferPool else None
+    image = imgProcess.warpPerspective(image, tagCenters, params.warpOffset, params=params, scale=scale, dst=warped)
+    timings["warp"] = time.perf_counter() - timeStage
+    debugWriter.addImage(debugFrame, p.pathWarped, image)
+    if sinks["bus"]:
+        frameBus.publishFrame("warped", image)
+
+    # removing background
+    if verbose:
+        print("   > removing background...")
+    timeStage = time.perf_counter()
+    image = imgProcess.removeBackground(image, adaptiveRes.scaled(params.bRectDist, scale, 0),
+                                        adaptiveRes.scaled(params.bCircRad, scale, 0), params=params,
+                                        kernelSize=adaptiveRes.scaled(40, scale),
+                                        dst=bufferPool.getBuffer("noBackground", shape) if useBufferPool else None)
+    timings["background"] = time.perf_counter() - timeStage
+    debugWriter.addImage(debugFrame, p.pathNoBack, image)
+
+    # detecting the white ball using circle detection
+    if verbose:
+        print("   > detecting the circles...")
+    timeStage = time.perf_counter()
+    # the accumulator resolution and threshold follow the number of edge pixels of a ball
+    image, dictCircles = imgProcess.circleDetection(image, dp=max(7 * scale, 1), minDist=adaptiveRes.scaled(50, scale),
+                                                    minRadius=adaptiveRes.scaled(15, scale),
+                                                    maxRadius=adaptiveRes.scaled(70, scale),
+                                                    imgDisplayOut=debugFrame is not None, params=params,
+                                                    param2=adaptiveRes.scaled(100, scale), structured=structured,
+                                                    classifier=imgProcess.colorClassifier)
+    if scale != 1.0 and structured:
+        for field in ("x", "y", "r"):
+            dictCircles[field] = np.round(dictCircles[field] / scale)
+    elif scale != 1.0:
+        dictCircles = {name: (int(round(x / scale)), int(round(y / scale))) for name, (x, y) in dictCircles.items()}
+    timings["circles"] = time.perf_counter() - timeStage
+    debugWriter.addImage(debugFrame, p.pathCircleDtct, image)
+
+    return dictCircles
 
 
 # PRIVATE FUNCTION to set the score
@@ -187,252 +389,114 @@ def displayScore(gameType, score, winLose, gmBestScore, gmScoreData, gmStateData
         return "", score, winLose, gmBestScore
 
 
-# FUNCTION for the first game
-def startGame1(imgGamePath, targetRadius, placementRadius=100):
-    """ FUNCTION to play the first game (one ball / one target)
+# FUNCTION to play a drill defined in a json file
+def startDrill(drillPath, targetRadius, placementRadius=100):
+    """ FUNCTION to play a drill defined in a json file (see assets/games/drills/)
 
     Source : Mulnard T.
 
-    :param imgGamePath: parameter : path of the game picture
+    :param drillPath: string : path of the json drill definition
     :param targetRadius: parameter : radius of the zone's target
     :param placementRadius: optional radius for the correct start position
     :return: score and data if win or lose game + string with infos to display
     """
+    drill = gameEngine.loadDrill(drillPath)
+    print("[GAME {}] Welcome to the '{}' game type : {}".format(drill["id"], drill["name"], drill["description"]))
 
-    print("[GAME 1] Welcome to the first game type : send the ball in the zone with the best accuracy")
-
-    image = cv2.imread(imgGamePath)
-    image = cv2.resize(image, (p.width, p.height))
-
-    # getting the matrix data
     try:
-        matrixTransform = loadtxt(p.kstData, delimiter=",")
+        image, layout = calibSnapshot.drillLayout(drill, drillPath, targetRadius, placementRadius)
     except IOError:
         print("   > matrix data not found, please set the keystone before playing")
         return 0, -1, "ERROR"
-    try:
-        # warping the image and detecting the tags
-        image = cv2.warpPerspective(image, matrixTransform, (p.width, p.height))
-        image, listTargets = imgProcess.circleDetection(image, dp=7, minDist=100, minRadius=20, maxRadius=80,
-                                                        imgDisplayOut=False)
-
-        cv2.imwrite(p.gmToDisplay, image)
-
-        # drawing the zone around the target
-
-        cv2.circle(image, listTargets["BROWN"], targetRadius, p.gmColBROWNMax, 4)
-        cv2.imwrite(p.gmToDisplay, image)
-
-        # start ball position
-        print("[GAME 1] Initial ball position. Press 'Enter' when done")
-        time.sleep(2)
-        correctPlacement = False
-        while not correctPlacement:
-            imgShow(p.gmToDisplay)
-            imgTake(p.pathCamIN)
-            listBalls = detectBall(p.pathCamIN)
-
-            # checking if the placement is correct
-            if __inZone(listBalls["WHITE"], listTargets["WHITE"], placementRadius):
-                correctPlacement = True
-                print("   > the ball is correctly placed")
-            else:
-                print("   > the ball is no correctly placed, please try again")
-
-        # playing the game and processing data
-        print("[GAME 1] Start playing ! Press 'Enter' when done")
-        time.sleep(2)
-        imgShow(p.gmToDisplay)
-        imgTake(p.pathCamIN)
-        listBalls = detectBall(p.pathCamIN)
-        print("   > processing data...")
-
-        # getting the score
-        score = __getScore(listBalls["WHITE"], listTargets["BROWN"])
-        if __inZone(listBalls["WHITE"], listTargets["BROWN"], targetRadius):
-            displayInfo = "WIN ! You are the best"
-            gameStat = 0
-        else:
-            displayInfo = "LOSE ! Better luck next time"
-            gameStat = 1
-        return score, gameStat, displayInfo
-
-    except KeyError or cv2.Error:
+    except KeyError:
         print("<Error> An error occurred during the game, please make sure everything is set correctly")
         return 0, -1, "ERROR"
 
+    return __playDrill(drill, image, layout)
 
-# FUNCTION for the second game
-def startGame2(imgGamePath, targetRadius, placementRadius=100):
-    """ FUNCTION to play the first game (one ball / one target)
+
+# FUNCTION to play a generated drill
+def startGeneratedDrill(level, targetRadius, placementRadius=100, seed=None):
+    """ FUNCTION to play a drill generated for a level of the difficulty ladder (see drillGenerator.py)
 
     Source : Mulnard T.
 
-    :param imgGamePath: parameter : path of the game picture
+    :param level: integer : level of the ladder
     :param targetRadius: parameter : radius of the zone's target
     :param placementRadius: optional radius for the correct start position
+    :param seed: integer : seed of the drill (None = new drill)
     :return: score and data if win or lose game + string with infos to display
     """
-
-    print("[GAME 2] Welcome to the second game type : send the ball in the zone without touching the red one")
-
-    image = cv2.imread(imgGamePath)
-    image = cv2.resize(image, (p.width, p.height))
-
-    # getting the matrix data
     try:
-        matrixTransform = loadtxt(p.kstData, delimiter=",")
-    except IOError:
-        print("   > matrix data not found, please set the keystone before playing")
+        drill = drillGenerator.generateDrill(level, seed, targetRadius, placementRadius)
+    except ValueError as error:
+        # the zones of a large radius do not all fit in the play area
+        print("<Error> {} (radius {})".format(error, targetRadius))
         return 0, -1, "ERROR"
+    print("[GAME {}] Welcome to the '{}' game type : {}".format(drill["id"], drill["name"], drill["description"]))
 
-    # warping the image and detecting the tags
-    image = cv2.warpPerspective(image, matrixTransform, (p.width, p.height))
-    image, listTargets = imgProcess.circleDetection(image, dp=7, minDist=100, minRadius=20, maxRadius=80,
-                                                    imgDisplayOut=False)
-
-    # drawing the zone around the target
     try:
-        cv2.circle(image, listTargets["BROWN"], targetRadius, p.gmColBROWNMax, 4)
-        cv2.imwrite(p.gmToDisplay, image)
-
-        # start ball position
-        print("[GAME 2] Initial ball position. Press 'Enter' when done")
-        time.sleep(2)
-        correctPlacement = False
-        while not correctPlacement:
-            imgShow(p.gmToDisplay)
-            imgTake(p.pathCamIN)
-            listBalls = detectBall(p.pathCamIN)
-
-            # checking if the placement is correct
-            if __inZone(listBalls["WHITE"], listTargets["WHITE"], placementRadius):
-                if __inZone(listBalls["YELLOW"], listTargets["YELLOW"], placementRadius):
-                    correctPlacement = True
-                    print("   > the balls are correctly placed")
-                else:
-                    print("   > the white ball is correctly placed but not the yellow one, please try again")
-            else:
-                if __inZone(listBalls["YELLOW"], listTargets["YELLOW"], placementRadius):
-                    print("   > the yellow ball is correctly placed but not the white one, please try again")
-                else:
-                    print("   > none of the balls are correctly placed, please try again")
-
-        # playing the game and processing data
-        print("[GAME 2] Start playing ! Press 'Enter' when done")
-        time.sleep(2)
-        imgShow(p.gmToDisplay)
-        imgTake(p.pathCamIN)
-        listBalls = detectBall(p.pathCamIN)
-        print("   > processing data...")
-
-        # getting the score
-        score = __getScore(listBalls["WHITE"], listTargets["BROWN"])
-        if __inZone(listBalls["YELLOW"], listTargets["YELLOW"], placementRadius):
-            if __inZone(listBalls["WHITE"], listTargets["BROWN"], targetRadius):
-                displayInfo = "WIN ! You are the best"
-                gameStat = 0
-            else:
-                displayInfo = "LOSE ! Better luck next time"
-                gameStat = 1
-        else:
-            displayInfo = "LOSE ! The yellow ball moved"
-            gameStat = 1
-            score = __getScore(listBalls["YELLOW"], listTargets["YELLOW"])*2
-
-        return score, gameStat, displayInfo
-
-    except KeyError:
-        print("<Error> An error occurred during the game, please make sure everything is set correctly")
+        image, layout = drillGenerator.renderDrill(drill, targetRadius, placementRadius,
+                                                   calibSnapshot.keystoneMatrix())
+    except IOError:
+        print("   > matrix data not found, please set the keystone before playing")
         return 0, -1, "ERROR"
 
+    return __playDrill(drill, image, layout)
 
-# FUNCTION for the third game
-def startGame3(imgGamePath, targetRadius, placementRadius=100):
-    """ FUNCTION to play the first game (one ball / one target)
 
-    Source : Mulnard T.
+# PRIVATE FUNCTION to play a drill
+def __playDrill(drill, image, layout):
+    """ PRIVATE FUNCTION to play a drill : placement of the balls, shot and result
 
-    :param imgGamePath: parameter : path of the game picture
-    :param targetRadius: parameter : radius of the zone's target
-    :param placementRadius: optional radius for the correct start position
+    :param drill: dictionary : drill definition
+    :param image: image array : projected image of the drill
+    :param layout: dictionary : compiled layout of the drill (see gameEngine.compileDrill)
     :return: score and data if win or lose game + string with infos to display
     """
-
-    print("[GAME 3] Welcome to the third game type : send the balls in their zones by only touching the white one")
-
-    image = cv2.imread(imgGamePath)
-    image = cv2.resize(image, (p.width, p.height))
-
-    # getting the matrix data
-    try:
-        matrixTransform = loadtxt(p.kstData, delimiter=",")
-    except IOError:
-        print("   > matrix data not found, please set the keystone before playing")
-        return 0, -1, "ERROR"
-
-    # warping the image and detecting the tags
-    image = cv2.warpPerspective(image, matrixTransform, (p.width, p.height))
-    image, listTargets = imgProcess.circleDetection(image, dp=7, minDist=100, minRadius=20, maxRadius=80,
-                                                    imgDisplayOut=False)
-
-    # drawing the zone around the target
-    try:
-        cv2.circle(image, listTargets["BROWN"], targetRadius, p.gmColBROWNMax, 4)
-        cv2.circle(image, listTargets["CYAN"], targetRadius, p.gmColCYANMax, 4)
-        cv2.imwrite(p.gmToDisplay, image)
-
-        # start ball position
-        print("[GAME 3] Initial ball position. Press 'Enter' when done")
-        time.sleep(2)
-        correctPlacement = False
-        while not correctPlacement:
-            imgShow(p.gmToDisplay)
-            imgTake(p.pathCamIN)
-            listBalls = detectBall(p.pathCamIN)
-
-            # checking if the placement is correct
-            if __inZone(listBalls["WHITE"], listTargets["WHITE"], placementRadius):
-                if __inZone(listBalls["YELLOW"], listTargets["YELLOW"], placementRadius):
-                    correctPlacement = True
-                    print("   > the balls are correctly placed")
-                else:
-                    print("   > the white ball is correctly placed but not the yellow one, please try again")
-            else:
-                if __inZone(listBalls["YELLOW"], listTargets["YELLOW"], placementRadius):
-                    print("   > the yellow ball is correctly placed but not the white one, please try again")
-                else:
-                    print("   > none of the balls are correctly placed, please try again")
-
-        # playing the game and processing data
-        print("[GAME 3] Start playing ! Press 'Enter' when done")
-        time.sleep(2)
-        imgShow(p.gmToDisplay)
+    global lastShot
+    debugWriter.saveImage(p.gmToDisplay, image)
+    apiServer.publish("game", {"drill": drill["id"], "event": "start", "name": drill["name"],
+                               "zones": layout["zones"], "centers": layout["centers"], "radius": layout["radius"]})
+
+    # start ball position
+    print("[GAME {}] Initial ball position. Press 'Enter' when done".format(drill["id"]))
+    time.sleep(pauseTime)
+    correctPlacement = False
+    while not correctPlacement:
+        imgShow(image)
         imgTake(p.pathCamIN)
-        listBalls = detectBall(p.pathCamIN)
-        print("   > processing data...")
-
-        # getting the score
-        score = __getScore(listBalls["WHITE"], listTargets["BROWN"])
-        score += __getScore(listBalls["YELLOW"], listTargets["CYAN"])
-        score /= 2
-        if __inZone(listBalls["WHITE"], listTargets["BROWN"], placementRadius):
-            if __inZone(listBalls["YELLOW"], listTargets["CYAN"], targetRadius):
-                displayInfo = "WIN ! You are the best"
-                gameStat = 0
-            else:
-                displayInfo = "LOSE ! The yellow ball is not in his target"
-                gameStat = 1
+        result = gameEngine.evaluateDrill(layout, detectBall(p.pathCamIN, adaptive=True))
+
+        # checking if the placement is correct
+        apiServer.publish("game", {"drill": drill["id"], "event": "placement", "placed": result["placed"],
+                                   "misplaced": result["misplaced"]})
+        if result["placed"]:
+            correctPlacement = True
+            print("   > the balls are correctly placed")
         else:
-            if __inZone(listBalls["YELLOW"], listTargets["CYAN"], targetRadius):
-                displayInfo = "LOSE ! The white ball is not in his target"
-                gameStat = 1
-            else:
-                displayInfo = " LOSE ! None of the balls are in their target"
-                gameStat = 1
-
-        return score, gameStat, displayInfo
-
-    except KeyError:
+            print("   > not correctly placed ({}), please try again".format(", ".join(result["misplaced"])))
+
+    # playing the game and processing data
+    print("[GAME {}] Start playing ! Press 'Enter' when done".format(drill["id"]))
+    time.sleep(pauseTime)
+    timeStart = time.time()
+    imgShow(image)
+    imgTake(p.pathCamIN)
+    listBalls = detectBall(p.pathCamIN)
+    result = gameEngine.evaluateDrill(layout, listBalls)
+    print("   > processing data...")
+
+    if result["score"] is None:
         print("<Error> An error occurred during the game, please make sure everything is set correctly")
         return 0, -1, "ERROR"
+    gameStat = 0 if result["win"] else 1
+    apiServer.publish("game", {"drill": drill["id"], "event": "result", "win": result["win"],
+                               "score": result["score"], "failed": result["failed"]})
+
+    # keeping the data of the shot for the session history
+    lastShot = {"drill": drill["id"], "balls": listBalls, "timings": dict(stageTimes),
+                "started": timeStart, "ended": time.time()}
+    shotLog.appendShot(p.shotLogDir, drill["id"], listBalls, gameEngine.ballTargets(layout))
+
+    return result["score"], gameStat, gameEngine.resultMessage(layout, result)
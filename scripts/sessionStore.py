@@ -0,0 +1,204 @@
+""" Session history part of the project
+This script stores every played shot in an append-only SQLite database (WAL mode). The statistics per drill and
+per day are updated in the same transaction as the shot, so they are read directly instead of rescanning the history
+"""
+
+import json
+import sqlite3
+import time
+from scripts import parameters as p
+
+# creation of the tables, the shots are never modified once written
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    id INTEGER PRIMARY KEY,
+    player TEXT NOT NULL,
+    drill_id INTEGER NOT NULL,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    score REAL NOT NULL,
+    state INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    balls TEXT NOT NULL,
+    timings TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shots_by_drill ON shots (player, drill_id, ended);
+CREATE TABLE IF NOT EXISTS drill_stats (
+    player TEXT NOT NULL,
+    drill_id INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    best_score REAL,
+    total_score REAL NOT NULL,
+    PRIMARY KEY (player, drill_id)
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    player TEXT NOT NULL,
+    drill_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    shots INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    total_score REAL NOT NULL,
+    PRIMARY KEY (player, drill_id, day)
+);
+"""
+
+
+# FUNCTION to open (and create if needed) the session history
+def openStore(dbPath=p.sessionDB):
+    """ FUNCTION to open (and create if needed) the session history
+
+    Source : Mulnard T. and https://www.sqlite.org/wal.html
+
+    :param dbPath: string : path of the database file
+    :return: sqlite3 connection
+    """
+    connection = sqlite3.connect(dbPath)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+# FUNCTION to add a shot to the history
+def recordShot(connection, drillId, score, state, info, balls=None, timings=None, started=None, ended=None,
+               player="default"):
+    """ FUNCTION to add a shot to the history and update the statistics
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param drillId: integer : id of the played drill
+    :param score: float : score of the shot
+    :param state: integer : 0 if win, 1 if lose
+    :param info: string : information displayed at the end of the shot
+    :param balls: dictionary : name and coordinates of the detected balls
+    :param timings: dictionary : duration (seconds) of each stage of the detection
+    :param started: float : timestamp of the start of the shot
+    :param ended: float : timestamp of the end of the shot
+    :param player: string : name of the player
+    :return: integer : id of the shot
+    """
+    ended = time.time() if ended is None else ended
+    started = ended if started is None else started
+    balls = {name: [int(xy[0]), int(xy[1])] for name, xy in (balls or {}).items()}
+    win = 1 if state == 0 else 0
+    day = time.strftime("%Y-%m-%d", time.localtime(ended))
+
+    # the shot and the statistics are written in the same transaction
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO shots (player, drill_id, started, ended, score, state, info, balls, timings) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (player, drillId, started, ended, score, state, info, json.dumps(balls), json.dumps(timings or {})))
+        connection.execute(
+            "INSERT INTO drill_stats (player, drill_id, shots, wins, losses, best_score, total_score) "
+            "VALUES (?, ?, 1, ?, ?, ?, ?) "
+            "ON CONFLICT (player, drill_id) DO UPDATE SET shots = shots + 1, wins = wins + excluded.wins, "
+            "losses = losses + excluded.losses, total_score = total_score + excluded.total_score, "
+            "best_score = MIN(COALESCE(best_score, excluded.best_score), excluded.best_score)",
+            (player, drillId, win, 1 - win, score, score))
+        connection.execute(
+            "INSERT INTO daily_stats (player, drill_id, day, shots, wins, total_score) VALUES (?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (player, drill_id, day) DO UPDATE SET shots = shots + 1, wins = wins + excluded.wins, "
+            "total_score = total_score + excluded.total_score",
+            (player, drillId, day, win, score))
+
+    return cursor.lastrowid
+
+
+# FUNCTION to get the statistics of each drill
+def getDrillStats(connection, player="default"):
+    """ FUNCTION to get the statistics of each drill
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param player: string : name of the player
+    :return: dictionary : statistics (shots, wins, losses, win rate, best and total score) for each drill id
+    """
+    stats = {}
+    rows = connection.execute("SELECT drill_id, shots, wins, losses, best_score, total_score FROM drill_stats "
+                              "WHERE player = ? ORDER BY drill_id", (player,))
+    for drillId, shots, wins, losses, bestScore, totalScore in rows:
+        stats[drillId] = {"shots": shots, "wins": wins, "losses": losses, "winRate": wins / shots,
+                          "bestScore": bestScore, "totalScore": totalScore}
+
+    return stats
+
+
+# FUNCTION to get the evolution of a drill day by day
+def getTrend(connection, drillId, days=30, player="default"):
+    """ FUNCTION to get the evolution of a drill day by day
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param drillId: integer : id of the drill
+    :param days: integer : number of played days to return
+    :param player: string : name of the player
+    :return: list of tuples : (day, shots, win rate, average score) from the oldest to the newest day
+    """
+    rows = connection.execute("SELECT day, shots, wins, total_score FROM daily_stats "
+                              "WHERE player = ? AND drill_id = ? ORDER BY day DESC LIMIT ?",
+                              (player, drillId, days)).fetchall()
+
+    return [(day, shots, wins / shots, totalScore / shots) for day, shots, wins, totalScore in reversed(rows)]
+
+
+# FUNCTION to get the last shots of a drill
+def getLastShots(connection, drillId, count=10, player="default"):
+    """ FUNCTION to get the last shots of a drill
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param drillId: integer : id of the drill
+    :param count: integer : number of shots to return
+    :param player: string : name of the player
+    :return: list of dictionaries : data of each shot, from the newest to the oldest
+    """
+    rows = connection.execute("SELECT ended, score, state, info, balls, timings FROM shots "
+                              "WHERE player = ? AND drill_id = ? ORDER BY ended DESC LIMIT ?",
+                              (player, drillId, count))
+
+    return [{"ended": ended, "score": score, "state": state, "info": info, "balls": json.loads(balls),
+             "timings": json.loads(timings)} for ended, score, state, info, balls, timings in rows]
+
+
+# FUNCTION to reset the statistics without removing the history of the shots
+def resetStats(connection, player="default"):
+    """ FUNCTION to reset the statistics without removing the history of the shots
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param player: string : name of the player
+    :return: nothing
+    """
+    with connection:
+        connection.execute("DELETE FROM drill_stats WHERE player = ?", (player,))
+
+
+# FUNCTION to display the statistics of the session history
+def displayStats(connection, player="default"):
+    """ FUNCTION to display the statistics of the session history
+
+    Source : Mulnard T.
+
+    :param connection: sqlite3 connection coming from openStore
+    :param player: string : name of the player
+    :return: nothing
+    """
+    stats = getDrillStats(connection, player)
+    if stats == {}:
+        print("   > no shot recorded yet")
+
+    for drillId, drillStats in stats.items():
+        print("   > drill {} : {} shots | win rate {:.0%} | best score {} | average score {:.1f}".format(
+            drillId, drillStats["shots"], drillStats["winRate"], drillStats["bestScore"],
+            drillStats["totalScore"] / drillStats["shots"]))
+        for day, shots, winRate, average in getTrend(connection, drillId, days=7, player=player):
+            print("      > {} : {} shots | win rate {:.0%} | average score {:.1f}".format(day, shots, winRate, average))
@@ -0,0 +1,256 @@
+""" Shot capture part of the project
+This script follows a shot at a high frame rate : once the tags are known, the camera only reads the window of the
+table at a reduced resolution, and every frame goes through the detection with the known tags (no tag detection).
+The cue strike, the ball-ball contacts and the cushion hits are timestamped and appended to a compact event record
+(one json line per shot)
+"""
+
+import json
+import math
+import time
+import types
+from scripts import imgProcess, motionPredict, scriptDP, parameters as p
+
+# distance (pixels of the warped image) from its rest position for a ball to be considered moving
+MOVE_DISTANCE = 12
+
+# maximum move (pixels) between two frames of a ball at rest
+STILL_MOVE = 4
+
+# number of frames without any move which end the shot
+STILL_FRAMES = 15
+
+# number of frames after the strike used to measure the speed of the cue ball
+SPEED_FRAMES = 5
+
+# margin around the tags of the window read by the camera (part of the size of the table)
+ROI_MARGIN = 0.03
+
+
+# FUNCTION to get the window of the camera which contains the table
+def roiFromTags(tagCenters, frameSize, margin=ROI_MARGIN):
+    """ FUNCTION to get the window of the camera which contains the table
+
+    Source : Mulnard T.
+
+    :param tagCenters: dictionary : centers of the 4 tags (coming from imgProcess.tagDetect)
+    :param frameSize: integer tuple : size (w, h) of the full camera frames
+    :param margin: float : margin around the tags (part of the size of the table)
+    :return: integer tuple : window (x, y, w, h) in pixels of the full frames
+    """
+    xs = [center[0] for center in tagCenters.values()]
+    ys = [center[1] for center in tagCenters.values()]
+    marginX = int((max(xs) - min(xs)) * margin)
+    marginY = int((max(ys) - min(ys)) * margin)
+    x0, y0 = max(min(xs) - marginX, 0), max(min(ys) - marginY, 0)
+    x1, y1 = min(max(xs) + marginX, frameSize[0]), min(max(ys) + marginY, frameSize[1])
+    return x0, y0, x1 - x0, y1 - y0
+
+
+# FUNCTION to get the position of the tags in the frames of the window
+def roiTags(tagCenters, roi, resolution):
+    """ FUNCTION to get the position of the tags in the frames of the window
+
+    Source : Mulnard T.
+
+    :param tagCenters: dictionary : centers of the 4 tags in the full frames
+    :param roi: integer tuple : window (x, y, w, h) in pixels of the full frames
+    :param resolution: integer tuple : resolution (w, h) of the frames of the window
+    :return: dictionary : centers of the 4 tags in the frames of the window
+    """
+    scaleX, scaleY = resolution[0] / roi[2], resolution[1] / roi[3]
+    return {name: ((x - roi[0]) * scaleX, (y - roi[1]) * scaleY) for name, (x, y) in tagCenters.items()}
+
+
+# FUNCTION to start the events of a shot
+def newShot(params=p):
+    """ FUNCTION to start the events of a shot
+
+    Source : Mulnard T.
+
+    :param params: parameters of the table
+    :return: dictionary : state of the shot
+    """
+    return {"params": params,
+            "rest": {},
+            "last": {},
+            "moving": set(),
+            "predictors": {},
+            "events": [],
+            "strike": None,
+            "strikeLast": None,
+            "strikeEvent": None,
+            "firstMove": None,
+            "speedFrames": 0,
+            "stillFrames": 0,
+            "lastTime": None,
+            "frames": 0,
+            "finished": False}
+
+
+# PRIVATE FUNCTION to get the distance between two points
+def __distance(first, second):
+    """ PRIVATE FUNCTION to get the distance between two points
+
+    :param first: tuple : (x, y)
+    :param second: tuple : (x, y)
+    :return: float : distance
+    """
+    return math.hypot(first[0] - second[0], first[1] - second[1])
+
+
+# FUNCTION to update the shot with the balls of a new frame
+def updateShot(shot, t, listBalls):
+    """ FUNCTION to update the shot with the balls of a new frame
+
+    A ball starts moving when it leaves its rest position : the white ball gives the cue strike, the next balls give
+    the contacts. The event is dated between the last frame at rest and the first moving frame. The cushions are
+    detected by the motion predictor of each moving ball (see motionPredict.py).
+
+    Source : Mulnard T.
+
+    :param shot: dictionary : state coming from newShot
+    :param t: float : time of the frame (seconds)
+    :param listBalls: dictionary : name and coordinates of the detected balls
+    :return: list : events of this frame ([time, kind, ball, values...])
+    """
+    events = []
+    eventTime = t if shot["lastTime"] is None else (shot["lastTime"] + t) / 2
+    shot["frames"] += 1
+    still = True
+
+    for name, position in listBalls.items():
+        if name not in shot["rest"]:
+            shot["rest"][name] = position
+        if name in shot["last"] and __distance(position, shot["last"][name]) > STILL_MOVE:
+            still = False
+        shot["last"][name] = position
+
+        if name not in shot["moving"] and __distance(position, shot["rest"][name]) > MOVE_DISTANCE:
+            if shot["strike"] is None and name != "WHITE":
+                # a ball moved by the player before the shot is a new rest position
+                shot["rest"][name] = position
+                continue
+            shot["moving"].add(name)
+            shot["predictors"][name] = motionPredict.newPredictor(shot["params"])
+            motionPredict.addPosition(shot["predictors"][name], shot["lastTime"] or t, shot["rest"][name])
+            if name == "WHITE" and shot["strike"] is None:
+                shot["strike"] = eventTime
+                shot["strikeLast"] = shot["lastTime"] if shot["lastTime"] is not None else t
+                shot["strikeEvent"] = [eventTime, "strike", name]
+                events.append(shot["strikeEvent"])
+            else:
+                events.append([eventTime, "contact", name])
+
+        if name in shot["moving"]:
+            predictor = shot["predictors"][name]
+            cushions = predictor["cushions"]
+            motionPredict.addPosition(predictor, t, position)
+            if predictor["cushions"] > cushions:
+                events.append([eventTime, "cushion", name, int(position[0]), int(position[1])])
+
+    # speed of the cue ball, measured over the first frames after the strike (the time of the strike is then
+    # corrected with the distance travelled before the first moving frame)
+    if shot["strike"] is not None and shot["speedFrames"] < SPEED_FRAMES and "WHITE" in listBalls:
+        if shot["speedFrames"] == 0:
+            shot["firstMove"] = (t, listBalls["WHITE"])
+        shot["speedFrames"] += 1
+        if shot["speedFrames"] == SPEED_FRAMES:
+            firstTime, firstPosition = shot["firstMove"]
+            speed = __distance(listBalls["WHITE"], firstPosition) / max(t - firstTime, 1e-6)
+            strike = firstTime - __distance(firstPosition, shot["rest"]["WHITE"]) / max(speed, 1e-6)
+            shot["strike"] = strike = max(strike, shot["strikeLast"])
+            shot["strikeEvent"][0] = strike
+            events.append([t, "speed", "WHITE", round(speed, 1)])
+
+    # end of the shot when nothing moves anymore
+    shot["stillFrames"] = shot["stillFrames"] + 1 if still and shot["strike"] is not None else 0
+    if shot["stillFrames"] >= STILL_FRAMES:
+        shot["finished"] = True
+        for name, position in listBalls.items():
+            events.append([t, "rest", name, int(position[0]), int(position[1])])
+
+    shot["lastTime"] = t
+    shot["events"] += events
+    return events
+
+
+# FUNCTION to follow a shot with the window of the camera
+def captureShot(camera, params=p, fps=None, scale=None, maxDuration=20.0, frames=0):
+    """ FUNCTION to follow a shot with the window of the camera
+
+    Source : Mulnard T. and https://picamera.readthedocs.io/en/release-1.13/api_camera.html#picamera.PiCamera.zoom
+
+    :param camera: camera backend with setRoi (see cameras.py)
+    :param params: parameters of the table
+    :param fps: float : frame rate of the window (default : parameter shot_capture_fps)
+    :param scale: float : resolution of the window compared to the full frames (default : parameter
+                  shot_capture_scale)
+    :param maxDuration: float : maximum duration of the capture (seconds)
+    :param frames: integer : maximum number of frames (0 = no limit)
+    :return: dictionary : record of the shot (events, frame rate, processing time), None if there is no frame or if
+             the tags are not found
+    """
+    fps = params.shotFps if fps is None else fps
+    scale = params.shotScale if scale is None else scale
+
+    # the tags are found once on a full frame
+    image = camera.capture()
+    if image is None:
+        print("<WARNING> No frame to capture")
+        return None
+    tagCenters = imgProcess.tagDetect(image, params.tagType)[0]
+    if tagCenters == {}:
+        print("<WARNING> Failed to detect the tags")
+        return None
+    roi = roiFromTags(tagCenters, (image.shape[1], image.shape[0]))
+    resolution = (max(int(roi[2] * scale), 1), max(int(roi[3] * scale), 1))
+    roiTagCenters = roiTags(tagCenters, roi, resolution)
+
+    # same parameters with the offset of the tags in pixels of the window
+    roiParams = types.SimpleNamespace(**vars(params))
+    roiParams.warpOffset = params.warpOffset * resolution[0] / roi[2]
+
+    shot = newShot(params)
+    timings = {}
+    processTimes = []
+    verbose, scriptDP.verbose = scriptDP.verbose, False
+    camera.setRoi(roi, resolution, fps)
+    timeStart = time.perf_counter()
+    try:
+        while not shot["finished"] and time.perf_counter() - timeStart < maxDuration:
+            image = camera.capture()
+            timeFrame = time.perf_counter()
+            if image is None or (frames > 0 and shot["frames"] >= frames):
+                break
+            listBalls = scriptDP.detectBallTags(image, roiTagCenters, roiParams, timings, scale=scale)
+            updateShot(shot, timeFrame - timeStart, listBalls)
+            processTimes.append(time.perf_counter() - timeFrame)
+    finally:
+        camera.setRoi(None, None, 0)
+        scriptDP.verbose = verbose
+
+    duration = time.perf_counter() - timeStart
+    period = 1 / fps if fps > 0 else 0
+    return {"start": time.time() - duration,
+            "roi": roi,
+            "resolution": resolution,
+            "frames": shot["frames"],
+            "fps": round(shot["frames"] / duration, 1) if duration > 0 else 0,
+            "processMs": round(1000 * sum(processTimes) / len(processTimes), 2) if processTimes else 0,
+            "late": sum(processTime > period for processTime in processTimes) if period > 0 else 0,
+            "events": [[round(event[0], 4)] + event[1:] for event in shot["events"]]}
+
+
+# FUNCTION to append the record of a shot to the event file
+def saveRecord(record, path=p.shotEventsPath):
+    """ FUNCTION to append the record of a shot to the event file (one compact json line per shot)
+
+    Source : Mulnard T.
+
+    :param record: dictionary coming from captureShot
+    :param path: string : path of the event file
+    :return: nothing
+    """
+    with open(path, "a") as eventFile:
+        eventFile.write(json.dumps(record, separators=(",", ":")) + "\n")
@@ -0,0 +1,220 @@
+""" Shot log part of the project
+This script keeps the final positions of the balls and of their targets in a columnar log : one fixed-width binary
+file per column (read back with numpy.memmap) and a small json header with the number of valid rows. The reports are
+computed chunk by chunk in vectorised form, so millions of shots never become python objects
+"""
+
+import cv2
+import json
+import numpy as np
+import os
+import time
+from scripts import parameters as p
+
+# name and type of each column of the log (one row per ball and per shot)
+COLUMNS = {"time": "f8", "drill": "i2", "ball": "i1", "ballX": "f4", "ballY": "f4", "targetX": "f4", "targetY": "f4"}
+
+# id of the balls in the 'ball' column
+BALL_NAMES = ["WHITE", "YELLOW", "RED", "BLUE"]
+
+# number of rows processed at once in the reports
+CHUNK_ROWS = 1 << 20
+
+
+# PRIVATE FUNCTION to read the number of valid rows of the log
+def __readCount(logDir):
+    """ PRIVATE FUNCTION to read the number of valid rows of the log
+
+    Source : Mulnard T.
+
+    :param logDir: string : folder of the log
+    :return: integer : number of rows
+    """
+    try:
+        with open(os.path.join(logDir, "header.json"), "r") as headerFile:
+            return json.load(headerFile)["count"]
+    except IOError:
+        return 0
+
+
+# FUNCTION to append the final positions of a shot to the log
+def appendShot(logDir, drillId, listBalls, listTargets):
+    """ FUNCTION to append the final positions of a shot to the log
+
+    Source : Mulnard T.
+
+    :param logDir: string : folder of the log
+    :param drillId: integer : id of the played drill
+    :param listBalls: dictionary : name and coordinates of the detected balls
+    :param listTargets: dictionary : name of the ball and coordinates of its target
+    :return: integer : number of rows in the log
+    """
+    names = [name for name in listTargets if name in listBalls and name in BALL_NAMES]
+    if not names:
+        return __readCount(logDir)
+
+    os.makedirs(logDir, exist_ok=True)
+    count = __readCount(logDir)
+    rows = {"time": np.full(len(names), time.time()),
+            "drill": np.full(len(names), drillId),
+            "ball": np.array([BALL_NAMES.index(name) for name in names]),
+            "ballX": np.array([listBalls[name][0] for name in names]),
+            "ballY": np.array([listBalls[name][1] for name in names]),
+            "targetX": np.array([listTargets[name][0] for name in names]),
+            "targetY": np.array([listTargets[name][1] for name in names])}
+
+    # the rows after 'count' are ignored, so a shot is only visible once the header is updated
+    for column, dtype in COLUMNS.items():
+        columnPath = os.path.join(logDir, column + ".bin")
+        with open(columnPath, "ab") as columnFile:
+            columnFile.truncate(count * np.dtype(dtype).itemsize)
+            columnFile.write(rows[column].astype(dtype).tobytes())
+
+    count += len(names)
+    headerPath = os.path.join(logDir, "header.json")
+    with open(headerPath + ".tmp", "w") as headerFile:
+        json.dump({"count": count, "columns": COLUMNS}, headerFile)
+    os.replace(headerPath + ".tmp", headerPath)
+
+    return count
+
+
+# FUNCTION to open the columns of the log without loading them
+def openLog(logDir):
+    """ FUNCTION to open the columns of the log without loading them
+
+    Source : Mulnard T.
+
+    :param logDir: string : folder of the log
+    :return: dictionary : read-only memory-mapped array for each column
+    """
+    count = __readCount(logDir)
+    columns = {}
+    for column, dtype in COLUMNS.items():
+        if count == 0:
+            columns[column] = np.zeros(0, dtype=dtype)
+        else:
+            columns[column] = np.memmap(os.path.join(logDir, column + ".bin"), dtype=dtype, mode="r", shape=(count,))
+
+    return columns
+
+
+# FUNCTION to compute the dispersion and the heatmap of the final positions
+def dispersionReport(logDir, ball="WHITE", drillId=None, binSize=10):
+    """ FUNCTION to compute the dispersion and the heatmap of the final positions of a ball
+
+    Source : Mulnard T.
+
+    :param logDir: string : folder of the log
+    :param ball: string : name of the ball
+    :param drillId: integer : id of the drill (None for all the drills)
+    :param binSize: integer : size of a cell of the heatmap in pixels (table space)
+    :return: dictionary : number of shots, mean offset to the target, covariance, rms error and heatmap
+    """
+    columns = openLog(logDir)
+    binsX = -(-p.width // binSize)
+    binsY = -(-p.height // binSize)
+    heat = np.zeros(binsX * binsY, dtype=np.int64)
+    count = 0
+    sums = np.zeros(5)    # dx, dy, dx*dx, dy*dy, dx*dy
+    sumTarget = np.zeros(2)
+
+    for start in range(0, len(columns["time"]), CHUNK_ROWS):
+        chunk = slice(start, start + CHUNK_ROWS)
+        select = columns["ball"][chunk] == BALL_NAMES.index(ball)
+        if drillId is not None:
+            select &= columns["drill"][chunk] == drillId
+
+        ballX = columns["ballX"][chunk][select].astype(np.float64)
+        ballY = columns["ballY"][chunk][select].astype(np.float64)
+        targetX = columns["targetX"][chunk][select]
+        targetY = columns["targetY"][chunk][select]
+        dx = ballX - targetX
+        dy = ballY - targetY
+
+        count += ballX.size
+        sums += (dx.sum(), dy.sum(), (dx * dx).sum(), (dy * dy).sum(), (dx * dy).sum())
+        sumTarget += (targetX.sum(), targetY.sum())
+
+        # heatmap of the positions in table space
+        cellX = np.clip((ballX // binSize).astype(np.int64), 0, binsX - 1)
+        cellY = np.clip((ballY // binSize).astype(np.int64), 0, binsY - 1)
+        heat += np.bincount(cellY * binsX + cellX, minlength=binsX * binsY)
+
+    report = {"ball": ball, "drill": drillId, "count": count, "binSize": binSize,
+              "heat": heat.reshape(binsY, binsX)}
+    if count > 0:
+        mean = sums[0:2] / count
+        cov = np.array([[sums[2] / count - mean[0] ** 2, sums[4] / count - mean[0] * mean[1]],
+                        [sums[4] / count - mean[0] * mean[1], sums[3] / count - mean[1] ** 2]])
+        report.update({"meanOffset": mean, "covariance": cov, "meanTarget": sumTarget / count,
+                       "rmsError": float(np.sqrt((sums[2] + sums[3]) / count))})
+
+    return report
+
+
+# FUNCTION to render the dispersion report as an image
+def renderHeatmap(report, matrixTransform=None):
+    """ FUNCTION to render the dispersion report as an image in table space
+
+    Source : Mulnard T.
+
+    :param report: dictionary : report coming from dispersionReport
+    :param matrixTransform: float array : keystone matrix to project the image on the table (None to stay in table space)
+    :return: image array
+    """
+    heat = report["heat"].astype(np.float32)
+    if heat.max() > 0:
+        heat *= 255 / heat.max()
+    heat = cv2.resize(heat.astype(np.uint8), (p.width, p.height), interpolation=cv2.INTER_LINEAR)
+    image = cv2.applyColorMap(heat, cv2.COLORMAP_JET)
+    image[heat == 0] = 0
+
+    if report["count"] > 0:
+        # mean target and ellipses at one and two standard deviations around the mean final position
+        target = report["meanTarget"]
+        mean = target + report["meanOffset"]
+        values, vectors = np.linalg.eigh(report["covariance"])
+        angle = np.degrees(np.arctan2(vectors[1, 1], vectors[0, 1]))
+        axes = np.sqrt(np.maximum(values[::-1], 0))
+        cv2.drawMarker(image, (int(target[0]), int(target[1])), (255, 255, 255), cv2.MARKER_CROSS, 40, 3)
+        for sigma in (1, 2):
+            cv2.ellipse(image, (int(mean[0]), int(mean[1])), (int(axes[0] * sigma), int(axes[1] * sigma)),
+                        angle, 0, 360, (255, 255, 255), 2)
+
+    if matrixTransform is not None:
+        image = cv2.warpPerspective(image, matrixTransform, (p.width, p.height))
+
+    return image
+
+
+# FUNCTION to print the dispersion report and save the heatmap
+def showReport(logDir, ball="WHITE", drillId=None):
+    """ FUNCTION to print the dispersion report and save the heatmap projected through the keystone
+
+    Source : Mulnard T.
+
+    :param logDir: string : folder of the log
+    :param ball: string : name of the ball
+    :param drillId: integer : id of the drill (None for all the drills)
+    :return: dictionary : report coming from dispersionReport
+    """
+    report = dispersionReport(logDir, ball, drillId)
+    print("   > {} shots of the {} ball".format(report["count"], ball))
+    if report["count"] == 0:
+        return report
+
+    print("   > mean offset to the target : ({:.1f}, {:.1f}) | rms error : {:.1f} px".format(
+        report["meanOffset"][0], report["meanOffset"][1], report["rmsError"]))
+    print("   > standard deviation : ({:.1f}, {:.1f}) px".format(
+        np.sqrt(report["covariance"][0, 0]), np.sqrt(report["covariance"][1, 1])))
+
+    try:
+        matrixTransform = np.loadtxt(p.kstData, delimiter=",")
+    except IOError:
+        print("   > matrix data not found, the heatmap stays in table space")
+        matrixTransform = None
+    cv2.imwrite(p.pathHeatmap, renderHeatmap(report, matrixTransform))
+    print("   > heatmap stored in " + p.pathHeatmap)
+
+    return report
@@ -0,0 +1,263 @@
+""" Multi-table part of the project
+This script drives several tables from one process. Each table has its own camera backend, keystone matrix,
+parameters and game state, and a worker pool shares the cores between the tables
+"""
+
+import concurrent.futures
+import cv2
+import json
+import numpy as np
+import os
+import time
+from scripts import adaptiveRes, bufferPool, cameras, detectionGate, gameEngine, keystoneMonitor, motionPredict, \
+    multiCamera, parallelTiles, powerScheduler, scriptDP, parameters as p
+
+
+# CLASS with everything that belongs to one table
+class Table:
+    """ CLASS with everything that belongs to one table (camera, calibration, parameters and game state)
+
+    Source : Mulnard T.
+    """
+
+    def __init__(self, name, params, camera, matrixTransform=None, matrixPath=None):
+        """ Create the table
+
+        :param name: string : name of the table
+        :param params: parameters of the table (coming from parameters.loadParameters)
+        :param camera: camera backend of the table (see cameras.py) or group of cameras (see multiCamera.py)
+        :param matrixTransform: float array : keystone matrix of the projector of the table
+        :param matrixPath: string : path of the keystone matrix of the table, checked by its keystone monitor (None =
+                           no monitor)
+        """
+        self.name = name
+        self.params = params
+        self.camera = camera
+        self.matrixTransform = matrixTransform
+        self.monitor = keystoneMonitor.newMonitor(params, matrixPath) if matrixPath else None
+
+        # detection : duration of each stage and centers of the tags of the last frame, outputs of the table (own API
+        # topics, the frame bus is kept for the single table program and the keystone monitor gets the idle frames too)
+        self.timings = {}
+        self.tags = {}
+        self.sinks = scriptDP.newSinks(topic=name + "/")
+        self.resController = adaptiveRes.newController(params=params)
+        self.gate = detectionGate.newGate(params)
+        self.scheduler = powerScheduler.newScheduler(params)
+
+        # game state : compiled drill (gameEngine) and result of the last frame
+        self.layout = None
+        self.listBalls = {}
+        self.result = None
+
+        # predicted rest position of each moving ball (see motionPredict.py)
+        self.predictors = {}
+        self.predictions = {}
+
+        # statistics used by the scheduler and the report
+        self.frames = 0
+        self.busyTime = 0.0
+        self.finished = False
+
+    def startDrill(self, drillPath, targetRadius=None, placementRadius=100):
+        """ Prepare a drill, its rules are then evaluated on every frame
+
+        :param drillPath: string : path of the json drill definition
+        :param targetRadius: integer : radius of the finish zones (default : parameter of the table)
+        :param placementRadius: integer : radius for the correct start position
+        :return: image array to project on the table
+        """
+        targetRadius = self.params.zoneRadius if targetRadius is None else targetRadius
+        if self.monitor is not None:
+            # the drill image hides the projector tags, and the keystone may have been computed again by the monitor
+            keystoneMonitor.showTemplate(self.monitor, False)
+            if self.monitor["matrix"] is not None:
+                self.matrixTransform = self.monitor["matrix"]
+        self.predictors, self.predictions = {}, {}
+        powerScheduler.wakeUp(self.scheduler)
+        image, self.layout = gameEngine.prepareDrill(gameEngine.loadDrill(drillPath), targetRadius, placementRadius,
+                                                     matrixTransform=self.matrixTransform, params=self.params)
+        return image
+
+    def keystoneTemplate(self):
+        """ Get the keystone template : while it is projected, the keystone monitor of the table checks the frames
+
+        :return: image array to project on the table
+        """
+        if self.monitor is not None:
+            keystoneMonitor.showTemplate(self.monitor, True)
+        return cv2.resize(cv2.imread(p.kstTemplateIN), (self.params.width, self.params.height))
+
+    def processFrame(self):
+        """ Capture and analyse one frame of the table
+
+        :return: dictionary : name and coordinates of the detected balls
+        """
+        image = self.camera.capture()
+        if image is None:
+            self.finished = True
+            return {}
+
+        # nobody plays : only the motion is checked
+        cpuStart = time.thread_time()
+        group = isinstance(self.camera, multiCamera.CameraGroup)
+        if self.monitor is not None and not group:
+            keystoneMonitor.submitFrame(self.monitor, image)
+        if not powerScheduler.updateScheduler(self.scheduler, self.camera.overview(image) if group else image,
+                                              self.layout is not None):
+            powerScheduler.addCpuTime(self.scheduler, time.thread_time() - cpuStart)
+            return self.listBalls
+
+        # the working resolution is adapted to the latency budget of the table and the frames without changes are not
+        # analysed again (the cameras of a group work at full resolution)
+        if group:
+            self.listBalls = self.camera.detect(image)
+        else:
+            self.listBalls = scriptDP.detectBallGated(image, self.gate, self.params, self.timings, debugOut=False,
+                                                      controller=self.resController, tags=self.tags, sinks=self.sinks)
+        if self.layout is not None:
+            self.result = gameEngine.evaluateDrill(self.layout, self.listBalls)
+
+        # the rest positions are predicted while the balls roll
+        timeFrame = time.perf_counter()
+        for name, position in self.listBalls.items():
+            if name not in self.predictors:
+                self.predictors[name] = motionPredict.newPredictor(self.params)
+            motionPredict.addPosition(self.predictors[name], timeFrame, position)
+            self.predictions[name] = motionPredict.predictRest(self.predictors[name])
+        powerScheduler.addCpuTime(self.scheduler, time.thread_time() - cpuStart)
+        return self.listBalls
+
+
+# FUNCTION to load the tables described in a json file
+def loadTables(configPath=p.tablesConfig):
+    """ FUNCTION to load the tables described in a json file
+
+    Source : Mulnard T.
+
+    :param configPath: string : path of the json file with the list of the tables
+    :return: list of Table
+    """
+    with open(configPath, "r") as configFile:
+        config = json.load(configFile)
+
+    tables = []
+    for tableConfig in config["tables"]:
+        params = p.loadParameters(tableConfig.get("parameters", "assets/parameters.json"))
+        matrixTransform = None
+        if os.path.exists(tableConfig.get("keystone", "")):
+            matrixTransform = np.loadtxt(tableConfig["keystone"], delimiter=",")
+        if "cameras" in tableConfig:
+            camera = multiCamera.openGroup(tableConfig["cameras"], params)
+        else:
+            camera = cameras.openCamera(tableConfig["camera"], params)
+        tables.append(Table(tableConfig["name"], params, camera, matrixTransform, tableConfig.get("keystone")))
+
+    return tables
+
+
+# FUNCTION to process the frames of several tables with a worker pool
+def runTables(tables, frames=0, duration=0, workers=0):
+    """ FUNCTION to process the frames of several tables with a worker pool
+
+    Each table has at most one frame in progress. When a worker is free, the table which has used the least
+    processing time gets it, so a slow table cannot starve the others. The frames of a table are only taken at the
+    rate of its power state (see powerScheduler.py). The tables already share the cores, so the OpenCV calls stay on
+    the thread of their table (parallel_workers of the tables should stay at 1).
+
+    Source : Mulnard T.
+
+    :param tables: list of Table
+    :param frames: integer : number of frames per table (0 = no limit)
+    :param duration: float : duration of the run in seconds (0 = no limit)
+    :param workers: integer : number of workers (0 = one per core)
+    :return: dictionary : statistics (frames, fps, mean latency, share of the processing time) per table
+    """
+    workers = workers if workers > 0 else os.cpu_count()
+    verbose, scriptDP.verbose = scriptDP.verbose, False
+    parallelTiles.setThreadPolicy(workers)
+    timeStart = time.perf_counter()
+
+    def job(table):
+        timeJob = time.perf_counter()
+        table.processFrame()
+        return table, time.perf_counter() - timeJob
+
+    def ready(table):
+        if table.finished or (frames > 0 and table.frames >= frames):
+            return False
+        return duration <= 0 or time.perf_counter() - timeStart < duration
+
+    try:
+        for table in tables:
+            if table.monitor is not None and table.params.kstCheckPeriod > 0:
+                keystoneMonitor.startMonitor(table.monitor)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            running = set()
+            waiting = [table for table in tables if ready(table)]
+            while waiting or running:
+                # giving the free workers to the tables with the least processing time whose next frame is due
+                waiting = [table for table in waiting if ready(table)]
+                waiting.sort(key=lambda table: table.busyTime)
+                for table in [table for table in waiting if powerScheduler.waitTime(table.scheduler) <= 0]:
+                    if len(running) >= workers:
+                        break
+                    waiting.remove(table)
+                    running.add(executor.submit(job, table))
+
+                # waiting for a finished frame or for the next due frame of an idle table
+                timeout = None
+                if waiting and len(running) < workers:
+                    timeout = max(min(powerScheduler.waitTime(table.scheduler) for table in waiting), 0)
+                if not running:
+                    time.sleep(timeout or 0)
+                    continue
+                done, running = concurrent.futures.wait(running, timeout=timeout,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    table, timeJob = future.result()
+                    table.frames += 1
+                    table.busyTime += timeJob
+                    if ready(table):
+                        waiting.append(table)
+    finally:
+        # the state of the program is restored even when a frame raised an error
+        scriptDP.verbose = verbose
+        parallelTiles.setThreadPolicy(1)
+        for table in tables:
+            if table.monitor is not None:
+                keystoneMonitor.stopMonitor(table.monitor)
+        bufferPool.clearPool()
+
+    elapsed = time.perf_counter() - timeStart
+    totalBusy = sum(table.busyTime for table in tables) or 1
+
+    return {table.name: {"frames": table.frames,
+                         "fps": table.frames / elapsed,
+                         "latency": table.busyTime / table.frames if table.frames else 0,
+                         "share": table.busyTime / totalBusy} for table in tables}
+
+
+# FUNCTION to run the tables described in the configuration file and print the report
+def showRun(frames=20, configPath=p.tablesConfig):
+    """ FUNCTION to run the tables described in the configuration file and print the report
+
+    Source : Mulnard T.
+
+    :param frames: integer : number of frames per table
+    :param configPath: string : path of the json file with the list of the tables
+    :return: nothing
+    """
+    tables = loadTables(configPath)
+    report = runTables(tables, frames=frames)
+    for table in tables:
+        stats = report[table.name]
+        print("   > {:12s} : {:4d} frames | {:5.2f} fps | {:6.1f} ms per frame | {:4.0%} of the processing time".format(
+            table.name, stats["frames"], stats["fps"], stats["latency"] * 1000, stats["share"]))
+        print("      > last detection : {}".format(table.listBalls))
+        for state, stats in powerScheduler.schedulerReport(table.scheduler).items():
+            print("      > {:6s} : {:6.1f} s ({:4.0%}) | {:4d} frames | CPU {:4.0%} of a core".format(
+                state, stats["time"], stats["share"], stats["frames"], stats["cpu"]))
+        if isinstance(table.camera, multiCamera.CameraGroup):
+            multiCamera.showLatency(table.camera.report())
+        table.camera.close()
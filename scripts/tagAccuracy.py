@@ -0,0 +1,192 @@
+""" Tag accuracy part of the project
+This script measures the precision of the tag detection : camera frames are rendered with the 4 tags of the table at
+known sub-pixel positions (random perspective, blur and noise), the tags are found with each mode of
+imgProcess.tagDetect and the warp of the table computed from the detected centers is compared with the warp computed
+from the real centers
+"""
+
+import cv2
+import cv2.aruco
+import numpy as np
+import time
+from scripts import imgProcess, parameters as p
+
+# modes of the detection compared by the benchmark : name and scale of imgProcess.tagDetect
+MODES = (("full image, integer centers", 0), ("full image, refined", 1), ("half image, refined", 0.5))
+
+# size of the tags (pixels of the table plane, as in the warped image) and distance of their center to the corners
+TAG_SIZE = 76
+TAG_INSET = 60
+
+# white margin around the printed tags (cells of the tag)
+QUIET_ZONE = 1.5
+
+# supersampling of the rendered tags (pixels of the tag image per pixel of the frame)
+SUPERSAMPLE = 4
+
+# gray levels of the rendered frame : table, black and white of the tags
+TABLE_GRAY = 90
+TAG_BLACK = 30
+TAG_WHITE = 220
+
+
+# PRIVATE FUNCTION to get the image of a tag with its white margin
+def __tagImage(tagType, markerID, cellSize=40):
+    """ PRIVATE FUNCTION to get the image of a tag with its white margin
+
+    :param tagType: string : aruco tag type
+    :param markerID: integer : id of the tag
+    :param cellSize: integer : pixels per cell of the tag
+    :return: image array of the tag with its margin, size (pixels) of the tag without the margin
+    """
+    arucoDict = cv2.aruco.Dictionary_get(imgProcess.ARUCO_DICT[tagType])
+    size = (arucoDict.markerSize + 2) * cellSize
+    margin = int(QUIET_ZONE * cellSize)
+    marker = cv2.aruco.drawMarker(arucoDict, markerID, size)
+    marker = np.where(marker > 127, TAG_WHITE, TAG_BLACK).astype(np.uint8)
+    return cv2.copyMakeBorder(marker, margin, margin, margin, margin, cv2.BORDER_CONSTANT, value=TAG_WHITE), size
+
+
+# FUNCTION to render a camera frame with the tags of the table
+def renderFrame(seed=0, params=p, blur=1.0, noise=3.0, tagType=p.tagType):
+    """ FUNCTION to render a camera frame with the 4 tags of the table at known sub-pixel positions
+
+    The table plane (size of the warped image) is seen through a random perspective : each tag is drawn at a high
+    resolution, projected in the frame and reduced (area interpolation), so its edges are not aligned on the pixels.
+
+    Source : Mulnard T. and https://docs.opencv.org/4.5.5/d5/dae/tutorial_aruco_detection.html
+
+    :param seed: integer : seed of the perspective
+    :param params: parameters of the table (camera resolution and size of the warped image)
+    :param blur: float : standard deviation (pixels) of the blur of the lens
+    :param noise: float : standard deviation of the noise of the sensor (gray levels)
+    :param tagType: string : aruco tag type of the table
+    :return: image array, dictionary : real centers of the 4 tags (float, see imgProcess.tagDetect)
+    """
+    generator = np.random.default_rng(seed)
+    frameWidth, frameHeight = params.camRes
+    frame = np.full((frameHeight, frameWidth), TABLE_GRAY, dtype=np.uint8)
+
+    # perspective of the table plane : corners of the table around 12 % of the frame, moved by up to 4 %
+    plane = np.float32([[0, 0], [params.width, 0], [params.width, params.height], [0, params.height]])
+    seen = np.float32([[0.12, 0.12], [0.88, 0.12], [0.88, 0.88], [0.12, 0.88]]) * (frameWidth, frameHeight)
+    seen += generator.uniform(-0.04, 0.04, (4, 2)) * (frameWidth, frameHeight)
+    planeToFrame = cv2.getPerspectiveTransform(plane, seen.astype(np.float32))
+
+    # tags at the corners of the table plane, named as the corners of the warped image (see imgProcess.warpPerspective)
+    centers = {}
+    corners = {"TOP_R": (TAG_INSET, TAG_INSET), "TOP_L": (params.width - TAG_INSET, TAG_INSET),
+               "BOT_L": (params.width - TAG_INSET, params.height - TAG_INSET),
+               "BOT_R": (TAG_INSET, params.height - TAG_INSET)}
+    for markerID, (name, (x, y)) in enumerate(corners.items()):
+        tagImage, tagPixels = __tagImage(tagType, markerID)
+        margin = (tagImage.shape[0] - tagPixels) / 2
+
+        # tag image -> table plane (the tag spans from -0.5 to size - 0.5 in the pixels of its image) -> frame
+        side = tagImage.shape[0] - 0.5
+        square = np.float32([[-0.5, -0.5], [side, -0.5], [side, side], [-0.5, side]])
+        half = TAG_SIZE / 2 * (1 + 2 * margin / tagPixels)
+        tagToPlane = cv2.getPerspectiveTransform(square, np.float32([[x - half, y - half], [x + half, y - half],
+                                                                     [x + half, y + half], [x - half, y + half]]))
+        tagToFrame = planeToFrame @ tagToPlane
+        center = cv2.perspectiveTransform(np.float32([[[(side - 0.5) / 2, (side - 0.5) / 2]]]), tagToFrame)[0, 0]
+        centers[name] = (float(center[0]), float(center[1]))
+
+        # rendering in a supersampled patch of the frame : frame pixel X -> patch pixel (X - x0 + 0.5) * S - 0.5
+        outline = cv2.perspectiveTransform(square[None], tagToFrame)[0]
+        x0, y0 = np.floor(outline.min(axis=0)).astype(int) - 2
+        x1, y1 = np.ceil(outline.max(axis=0)).astype(int) + 3
+        frameToPatch = np.array([[SUPERSAMPLE, 0, (0.5 - x0) * SUPERSAMPLE - 0.5],
+                                 [0, SUPERSAMPLE, (0.5 - y0) * SUPERSAMPLE - 0.5], [0, 0, 1]])
+        patch = cv2.warpPerspective(tagImage, frameToPatch @ tagToFrame,
+                                    ((x1 - x0) * SUPERSAMPLE, (y1 - y0) * SUPERSAMPLE), flags=cv2.INTER_LINEAR,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=TABLE_GRAY)
+        frame[y0:y1, x0:x1] = cv2.resize(patch, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+    # lens and sensor
+    if blur > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    frame = np.clip(frame + generator.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), centers
+
+
+# FUNCTION to measure the error of the warp computed from detected tags
+def warpError(tagCenters, realCenters, params=p, points=(30, 20)):
+    """ FUNCTION to measure the error of the warp of the table computed from the detected tags (see
+    imgProcess.warpPerspective, without offset)
+
+    Source : Mulnard T.
+
+    :param tagCenters: dictionary : detected centers of the 4 tags
+    :param realCenters: dictionary : real centers of the 4 tags
+    :param params: parameters of the table (size of the warped image)
+    :param points: integer tuple : number of points of the grid of the warped image (columns, rows)
+    :return: float tuple : mean and max distance (pixels of the warped image) between the points of the table warped
+             with the detected and with the real tags
+    """
+    names = ["TOP_R", "TOP_L", "BOT_L", "BOT_R"]
+    unwarped = np.float32([[0, 0], [params.width, 0], [params.width, params.height], [0, params.height]])
+    detected = cv2.getPerspectiveTransform(np.float32([tagCenters[name] for name in names]), unwarped)
+    real = cv2.getPerspectiveTransform(np.float32([realCenters[name] for name in names]), unwarped)
+
+    grid = np.stack(np.meshgrid(np.linspace(0, params.width, points[0]), np.linspace(0, params.height, points[1])),
+                    axis=-1).reshape((1, -1, 2))
+    inFrame = cv2.perspectiveTransform(grid, np.linalg.inv(real))
+    errors = np.hypot(*(cv2.perspectiveTransform(inFrame, detected) - grid)[0].T)
+    return float(errors.mean()), float(errors.max())
+
+
+# FUNCTION to compare the modes of the tag detection on rendered frames
+def benchmark(frames=20, modes=MODES, params=p, tagType=p.tagType):
+    """ FUNCTION to compare the modes of the tag detection on rendered frames
+
+    Source : Mulnard T.
+
+    :param frames: integer : number of rendered frames
+    :param modes: list of tuples : name and scale of each mode (see imgProcess.tagDetect)
+    :param params: parameters of the table
+    :param tagType: string : aruco tag type of the table
+    :return: list of dictionaries : name and scale of the mode, frames where the tags are found, mean error of the
+             centers (pixels of the frame), mean and max error of the warp (pixels of the warped image), mean duration
+             (milliseconds)
+    """
+    results = [{"name": name, "scale": scale, "found": 0, "center": 0.0, "warp": 0.0, "warpMax": 0.0, "time": 0.0}
+               for name, scale in modes]
+    for seed in range(frames):
+        image, realCenters = renderFrame(seed, params, tagType=tagType)
+        for result in results:
+            timeStart = time.perf_counter()
+            tagCenters = imgProcess.tagDetect(image.copy(), tagType, result["scale"])[0]
+            result["time"] += time.perf_counter() - timeStart
+            if tagCenters == {}:
+                continue
+            result["found"] += 1
+            result["center"] += np.mean([np.hypot(tagCenters[name][0] - realCenters[name][0],
+                                                  tagCenters[name][1] - realCenters[name][1]) for name in realCenters])
+            meanError, maxError = warpError(tagCenters, realCenters, params)
+            result["warp"] += meanError
+            result["warpMax"] = max(result["warpMax"], maxError)
+
+    for result in results:
+        for key in ("center", "warp"):
+            result[key] = result[key] / result["found"] if result["found"] > 0 else None
+        result["time"] = 1000 * result["time"] / frames
+    return results
+
+
+# FUNCTION to run the benchmark and print the results
+def showBenchmark(frames=20):
+    """ FUNCTION to run the benchmark and print the results
+
+    Source : Mulnard T.
+
+    :param frames: integer : number of rendered frames
+    :return: nothing
+    """
+    for result in benchmark(frames):
+        if result["found"] == 0:
+            print("      > {:28s} : tags never found | {:6.1f} ms".format(result["name"], result["time"]))
+            continue
+        print("      > {:28s} : found {:2d}/{} | center error {:5.2f} px | warp error {:5.2f} px (max {:5.2f}) | "
+              "{:6.1f} ms".format(result["name"], result["found"], frames, result["center"], result["warp"],
+                                  result["warpMax"], result["time"]))
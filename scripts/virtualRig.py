@@ -0,0 +1,330 @@
+""" Virtual rig part of the project
+This script plays the games without the table : the projected images are kept by a buffer projector (see
+projectors.py), the frames of the camera are drawn by a simulated camera (see cameras.py) and a virtual player puts the
+balls on the table. The games run unattended as fast as the detection allows, and the throughput of the program is
+measured stage by stage
+"""
+
+import contextlib
+import cv2
+import io
+import numpy as np
+import time
+from scripts import calibSnapshot, cameras, detectionGate, gameEngine, imgProcess, multiCamera, projectors, scriptDP, \
+    parameters as p
+
+# games played by the rig : drill definition and balls sent in a target by the shot (ball, target)
+GAMES = {1: (p.gm1Drill, (("WHITE", "BROWN"),)),
+         2: (p.gm2Drill, (("WHITE", "BROWN"),)),
+         3: (p.gm3Drill, (("WHITE", "BROWN"), ("YELLOW", "CYAN")))}
+
+# balls put on their start zone by the player (the balls without a start zone in the game are not on the table)
+START_BALLS = ("WHITE", "YELLOW")
+
+# maximum number of frames of a game : a game still asking for the placement after them is stopped
+MAX_CAPTURES = 6
+
+# stages of the shot frame measured by the rig (see scriptDP.stageTimes), the capture is the simulated camera and the
+# gate is the whole detection of scriptDP.detectBall
+STAGES = ("capture", "read", "tags", "warp", "background", "circles", "detect", "gate")
+
+# results of a game by game state (see scriptDP.startDrill)
+GAME_STATES = {0: "win", 1: "lose", -1: "error"}
+
+# table covered by two cameras : length (pixels of the warped image) of the table and overlap of the two sections
+LONG_TABLE = 2600
+SECTION_OVERLAP = 400
+
+
+# FUNCTION to get the zones of a game as the game finds them
+def gameTargets(imgGamePath, params=p):
+    """ FUNCTION to get the zones of a game as the game finds them (warp of the game image and circle detection)
+
+    Source : Mulnard T.
+
+    :param imgGamePath: string : path of the game picture
+    :param params: parameters of the table
+    :return: dictionary : name and coordinates of the zones of the game
+    """
+    image = cv2.resize(cv2.imread(imgGamePath), (params.width, params.height))
+    image = cv2.warpPerspective(image, calibSnapshot.keystoneMatrix(), (params.width, params.height))
+    return imgProcess.circleDetection(image, dp=7, minDist=100, minRadius=20, maxRadius=80, imgDisplayOut=False)[1]
+
+
+# PRIVATE FUNCTION to move the balls of the virtual player
+def __playerBalls(player, params=p):
+    """ PRIVATE FUNCTION to move the balls of the virtual player at each frame of the camera : the balls are put on
+    their start zone for the first frame (placement) and sent around their target for the next ones (shot), with an
+    error following the skill of the player
+
+    :param player: dictionary : state of the player (see openRig)
+    :param params: parameters of the table (size of the warped image)
+    :return: dictionary : name and coordinates (x, y) of the balls on the table
+    """
+    player["captures"] += 1
+    if player["captures"] > MAX_CAPTURES:
+        raise RuntimeError("the game is still asking for the placement after {} frames".format(MAX_CAPTURES))
+
+    targets = player["targets"]
+    if player["captures"] == 1:
+        player["balls"] = {name: targets[name] for name in START_BALLS if name in targets}
+    elif player["captures"] == 2:
+        margin = cameras.BALL_RADIUS
+        for ball, target in player["shots"]:
+            x, y = np.add(targets[target], player["generator"].normal(0, player["skill"], 2))
+            player["balls"][ball] = (float(np.clip(x, margin, params.width - margin)),
+                                     float(np.clip(y, margin, params.height - margin)))
+    return player["balls"]
+
+
+# FUNCTION to plug the virtual rig in the games
+def openRig(skill=20.0, noise=3.0, light=0.3, seed=0, debugImages=False, params=p):
+    """ FUNCTION to plug the virtual rig in the games : projector and camera of scriptDP replaced, no pause, no
+    status messages and a new detection gate during the games
+
+    Source : Mulnard T.
+
+    :param skill: float : standard deviation (pixels) of the distance between a shot ball and its target
+    :param noise: float : standard deviation of the noise of the sensor (gray levels)
+    :param light: float : intensity of the projected light on the cloth (0-1)
+    :param seed: integer : seed of the shots and of the noise
+    :param debugImages: boolean : keep the debug images of the detection (policy of the parameters)
+    :param params: parameters of the table
+    :return: dictionary : projector, camera, player and settings of scriptDP to restore with closeRig
+    """
+    player = {"targets": {}, "shots": (), "captures": 0, "balls": {}, "skill": skill,
+              "generator": np.random.default_rng(seed)}
+    projector = projectors.BufferProjector()
+    camera = cameras.SimulatedCameraBackend(projector, params, noise=noise, light=light,
+                                            player=lambda: __playerBalls(player, params), seed=seed)
+    rig = {"projector": projector, "camera": camera, "player": player, "params": params,
+           "saved": {name: getattr(scriptDP, name)
+                     for name in ("projector", "cameraBackend", "pauseTime", "verbose", "gate")},
+           "debugPolicy": params.debugPolicy}
+
+    scriptDP.projector = projector
+    scriptDP.cameraBackend = camera
+    scriptDP.pauseTime = 0
+    scriptDP.verbose = False
+    scriptDP.gate = detectionGate.newGate(params)
+    if not debugImages:
+        params.debugPolicy = "never"
+    return rig
+
+
+# FUNCTION to unplug the virtual rig
+def closeRig(rig):
+    """ FUNCTION to unplug the virtual rig and restore the settings of scriptDP
+
+    Source : Mulnard T.
+
+    :param rig: dictionary coming from openRig
+    :return: nothing
+    """
+    for name, value in rig["saved"].items():
+        setattr(scriptDP, name, value)
+    rig["params"].debugPolicy = rig["debugPolicy"]
+    scriptDP.capturedFrames.clear()
+    rig["camera"].close()
+    rig["projector"].close()
+
+
+# FUNCTION to play the games unattended and measure the throughput
+def runThroughput(shots=30, games=(1, 2, 3), targetRadius=p.zoneRadius, skill=20.0, quiet=True, params=p):
+    """ FUNCTION to play the games unattended on the virtual rig (one shot per game, the games in turn) and measure
+    the throughput
+
+    Source : Mulnard T.
+
+    :param shots: integer : number of played games
+    :param games: integer tuple : games played in turn (see GAMES)
+    :param targetRadius: integer : radius of the finish zones
+    :param skill: float : standard deviation (pixels) of the distance between a shot ball and its target
+    :param quiet: boolean : hide the messages of the games
+    :param params: parameters of the table
+    :return: dictionary : number of shots, frames and results (win / lose / error), total duration (seconds) and
+             duration (seconds) of each stage of the shot frames
+    """
+    targets = {game: gameTargets(gameEngine.loadDrill(GAMES[game][0])["image"], params) for game in games}
+    results = {"shots": 0, "frames": 0, "win": 0, "lose": 0, "error": 0, "time": 0.0,
+               "stages": {stage: [] for stage in STAGES}}
+    rig = openRig(skill, params=params)
+    try:
+        timeStart = time.perf_counter()
+        for shot in range(shots):
+            game = games[shot % len(games)]
+            drillPath, shotBalls = GAMES[game]
+            rig["player"].update({"targets": targets[game], "shots": shotBalls, "captures": 0, "balls": {}})
+            scriptDP.stageTimes.clear()
+            with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                try:
+                    gmState = scriptDP.startDrill(drillPath, targetRadius)[1]
+                except RuntimeError:
+                    gmState = -1
+            results["shots"] += 1
+            results[GAME_STATES[gmState]] += 1
+            for stage in STAGES:
+                if stage in scriptDP.stageTimes:
+                    results["stages"][stage].append(scriptDP.stageTimes[stage])
+        results["time"] = time.perf_counter() - timeStart
+        results["frames"] = rig["camera"].frames
+    finally:
+        closeRig(rig)
+    return results
+
+
+# FUNCTION to run the games on the virtual rig and print the throughput
+def showThroughput(shots=30):
+    """ FUNCTION to run the games on the virtual rig and print the throughput
+
+    Source : Mulnard T.
+
+    :param shots: integer : number of played games
+    :return: nothing
+    """
+    results = runThroughput(shots)
+    print("      > {} shots ({} win / {} lose / {} error) and {} frames in {:.2f} s : {:.2f} shots/s | {:.2f} "
+          "frames/s".format(results["shots"], results["win"], results["lose"], results["error"], results["frames"],
+                            results["time"], results["shots"] / results["time"], results["frames"] / results["time"]))
+    for stage, durations in results["stages"].items():
+        if durations:
+            print("      > {:10s} : mean {:6.2f} ms | max {:6.2f} ms".format(stage, 1000 * np.mean(durations),
+                                                                            1000 * np.max(durations)))
+
+
+# FUNCTION to measure the detection gate on a sequence of frames
+def runGate(rounds=4, still=3, params=p):
+    """ FUNCTION to measure the detection gate (see detectionGate.py) on a sequence of frames of the virtual rig : in
+    each round the frame does not change for a few frames, then one ball moves, then two balls move. Each frame is
+    detected with the gate and with a full analysis, to compare the balls and the durations
+
+    Source : Mulnard T.
+
+    :param rounds: integer : number of rounds of the sequence
+    :param still: integer : frames without any change after each move
+    :param params: parameters of the table
+    :return: dictionary : report of the gate (see detectionGate.gateReport), frames where the gated balls are the
+             balls of the full analysis (same colors, within 3 pixels), mean duration (seconds) with and without gate
+    """
+    generator = np.random.default_rng(0)
+    rig = openRig(params=params)
+    camera = rig["camera"]
+    camera.player = None
+    camera.balls = {"WHITE": (300.0, 300.0), "YELLOW": (900.0, 500.0), "RED": (600.0, 700.0)}
+    gated, full = scriptDP.gate, detectionGate.newGate(params)
+    full["threshold"] = 0
+    results = {"frames": 0, "same": 0, "gated": 0.0, "full": 0.0}
+    try:
+        for _ in range(rounds):
+            for moved in [()] * still + [("WHITE",)] + [()] * still + [("YELLOW", "RED")]:
+                for name in moved:
+                    camera.balls[name] = tuple(generator.uniform((150, 150), (params.width - 150,
+                                                                                 params.height - 150)).tolist())
+                frame = camera.capture().copy()
+                balls = {}
+                for key, gate in (("gated", gated), ("full", full)):
+                    scriptDP.gate = gate
+                    scriptDP.capturedFrames[p.pathCamIN] = frame
+                    timeStart = time.perf_counter()
+                    balls[key] = scriptDP.detectBall(p.pathCamIN)
+                    results[key] += time.perf_counter() - timeStart
+                results["frames"] += 1
+                results["same"] += balls["gated"].keys() == balls["full"].keys() and all(
+                    np.hypot(*np.subtract(balls["gated"][name], balls["full"][name])) <= 3 for name in balls["full"])
+        results["report"] = detectionGate.gateReport(gated)
+    finally:
+        closeRig(rig)
+    results["gated"] /= results["frames"]
+    results["full"] /= results["frames"]
+    return results
+
+
+# FUNCTION to measure the detection gate and print the results
+def showGate():
+    """ FUNCTION to measure the detection gate on a sequence of frames of the virtual rig and print the results
+
+    Source : Mulnard T.
+
+    :return: nothing
+    """
+    results = runGate()
+    report = results["report"]
+    print("      > {} frames : {:.0%} given again | {:.0%} changed regions | {:.0%} full analysis".format(
+        report["frames"], report["hit"]["share"], report["region"]["share"], report["full"]["share"]))
+    print("      > mean duration : given again {:6.2f} ms | changed regions {:6.2f} ms | full analysis {:6.2f} "
+          "ms".format(1000 * report["hit"]["time"], 1000 * report["region"]["time"], 1000 * report["full"]["time"]))
+    print("      > with the gate {:6.2f} ms per frame, without {:6.2f} ms ({:.2f} s saved) | same balls in {}/{} "
+          "frames".format(1000 * results["gated"], 1000 * results["full"], report["saved"], results["same"],
+                          results["frames"]))
+
+
+# FUNCTION to measure the detection of a table covered by two cameras
+def runCameras(frames=20, seed=0, params=p):
+    """ FUNCTION to measure the detection of a longer table covered by two simulated cameras (see multiCamera.py) :
+    each camera sees one half of the table with its own tags, the two halves overlap in the middle. Some balls are put
+    in the overlap at each frame, so that both cameras see them
+
+    Source : Mulnard T.
+
+    :param frames: integer : number of detected frames
+    :param seed: integer : seed of the positions of the balls and of the noise
+    :param params: parameters of the table (size of a section, resolution of the cameras)
+    :return: dictionary : frames, balls put on the table, balls found once within the resolution of the circle
+             detection, duplicated balls and latency report of the group (see multiCamera.CameraGroup.report)
+    """
+    tableParams = p.loadParameters("assets/parameters.json")
+    tableParams.width = LONG_TABLE
+    tableParams.height = params.height
+    middle = LONG_TABLE // 2
+    sections = [(0, 0, middle + SECTION_OVERLAP // 2, params.height),
+                (middle - SECTION_OVERLAP // 2, 0, LONG_TABLE, params.height)]
+    group = multiCamera.CameraGroup([cameras.SimulatedCameraBackend(None, tableParams, seed=seed + index,
+                                                                    section=section,
+                                                                    tagIds=tuple(range(4 * index, 4 * index + 4)))
+                                     for index, section in enumerate(sections)], sections, tableParams,
+                                    tagIds=[list(range(4 * index, 4 * index + 4)) for index in range(len(sections))])
+
+    generator = np.random.default_rng(seed)
+    margin = params.bRectDist + cameras.BALL_RADIUS
+    results = {"frames": 0, "balls": 0, "found": 0, "duplicated": 0}
+    try:
+        for _ in range(frames):
+            # one ball in the overlap, the others anywhere on the table
+            balls = {"WHITE": (generator.uniform(middle - SECTION_OVERLAP // 4, middle + SECTION_OVERLAP // 4),
+                               generator.uniform(margin, params.height - margin))}
+            for name in ("YELLOW", "RED", "BLUE"):
+                while True:
+                    position = generator.uniform((margin, margin), (LONG_TABLE - margin, params.height - margin))
+                    if all(np.hypot(*np.subtract(position, other)) > 4 * cameras.BALL_RADIUS
+                           for other in balls.values()):
+                        break
+                balls[name] = tuple(position.tolist())
+            for camera in group.cameras:
+                camera.balls = balls
+
+            found = group.detect(group.capture(), structured=True)
+            results["frames"] += 1
+            results["balls"] += len(balls)
+            for x, y in balls.values():
+                distance = np.hypot(found["x"] - x, found["y"] - y)
+                results["found"] += int(np.sum(distance <= detectionGate.ACCUMULATOR_STEP) == 1)
+                results["duplicated"] += int(np.sum(distance < 2 * cameras.BALL_RADIUS) > 1)
+        results["report"] = group.report()
+    finally:
+        group.close()
+    return results
+
+
+# FUNCTION to measure the detection of a table covered by two cameras and print the results
+def showCameras(frames=20):
+    """ FUNCTION to measure the detection of a table covered by two cameras and print the results
+
+    Source : Mulnard T.
+
+    :param frames: integer : number of detected frames
+    :return: nothing
+    """
+    results = runCameras(frames)
+    print("      > {} frames : {}/{} balls found once | {} duplicated balls".format(
+        results["frames"], results["found"], results["balls"], results["duplicated"]))
+    multiCamera.showLatency(results["report"])
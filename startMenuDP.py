@@ -1,14 +1,21 @@
-from scripts import dvptTest, scriptDP, parameters as p
-import datetime
+from scripts import apiServer, calibSnapshot, colorLearning, debugWriter, drillGenerator, dvptTest, frameBus, \
+    scriptDP, sessionStore, parameters as p
+import os
 
 
 # navigation menu in terminal command
 def menuInTerminal():
     option = 1
-    winLoseRatio = [[0, 0], [0, 0], [0, 0]]
-    bestScores = [0, 0, 0]
-    totalScore = 654321
-    table = ""
+    store = sessionStore.openStore()
+    winLoseRatio, bestScores, totalScore = loadScores(store)
+    if p.apiEnabled:
+        apiServer.startServer()
+    if p.busEnabled:
+        frameBus.startBus()
+    if colorLearning.loadClassifier():
+        print("[menu] Using the learned colors of the balls")
+    warmTime = calibSnapshot.warmStart([p.gm1Drill, p.gm2Drill, p.gm3Drill])
+    print("[menu] Calibration ready in {:.2f} s".format(warmTime))
 
     while option != 0:
 
@@ -21,6 +28,11 @@ def menuInTerminal():
         print("{:38s} │".format("│ 6. set projector keystone"))
         print("{:38s} │".format("│ 7. tests"))
         print("{:38s} │".format("│ 8. parameters"))
+        print("{:38s} │".format("│ 9. custom drill"))
+        print("{:38s} │".format("│ 10. session statistics"))
+        print("{:38s} │".format("│ 11. remote control (API)"))
+        print("{:38s} │".format("│ 12. generated drills"))
+        print("{:38s} │".format("│ 13. learn the ball colors"))
         print("{:38s} │".format("│ 0. quit program"))
         print("╰──────────────────────────────────────╯")
         cmdInput = input("[menu] Enter you option : ")
@@ -33,21 +45,24 @@ def menuInTerminal():
         # First game
         if option == 1:
             print("[menu] Starting game type 1 : line")
-            gmScore, gmState, gmInfo = scriptDP.startGame1(p.gm1LinePath, p.zoneRadius)
+            gmScore, gmState, gmInfo = scriptDP.startDrill(p.gm1Drill, p.zoneRadius)
+            recordScore(store, gmScore, gmState, gmInfo)
             table, totalScore, winLoseRatio, bestScores = scriptDP.displayScore(1, totalScore, winLoseRatio, bestScores,
                                                                                 gmScore, gmState, gmInfo)
 
         # Second game
         elif option == 2:
             print("[menu] Starting game type 2 : obstacle")
-            gmScore, gmState, gmInfo = scriptDP.startGame2(p.gm2ObstaclePath, p.zoneRadius)
+            gmScore, gmState, gmInfo = scriptDP.startDrill(p.gm2Drill, p.zoneRadius)
+            recordScore(store, gmScore, gmState, gmInfo)
             table, totalScore, winLoseRatio, bestScores = scriptDP.displayScore(2, totalScore, winLoseRatio, bestScores,
                                                                                 gmScore, gmState, gmInfo)
                 
         # Third game
         elif option == 3:
             print("[menu] Starting game type 3 : two zones")
-            gmScore, gmState, gmInfo = scriptDP.startGame3(p.gm3ContactPath, p.zoneRadius)
+            gmScore, gmState, gmInfo = scriptDP.startDrill(p.gm3Drill, p.zoneRadius)
+            recordScore(store, gmScore, gmState, gmInfo)
             table, totalScore, winLoseRatio, bestScores = scriptDP.displayScore(3, totalScore, winLoseRatio, bestScores,
                                                                                 gmScore, gmState, gmInfo)
                 
@@ -61,9 +76,8 @@ def menuInTerminal():
             print("[menu] Resetting game score")
             choice = input("   > are you sure you want to reset score and the WIN/LOSE ratio ? (y/n) : ")
             if choice == "y":
-                winLoseRatio = [[0, 0], [0, 0], [0, 0]]
-                bestScores = [0, 0, 0]
-                totalScore = 0
+                sessionStore.resetStats(store)
+                winLoseRatio, bestScores, totalScore = loadScores(store)
 
         # Setting the projector keystone
         elif option == 6:
@@ -81,35 +95,153 @@ def menuInTerminal():
             print("[menu] Launching the parameters menu")
             print("\n \n")
             p.parametersMenu()
-            
+
+        # Custom drill from the drills folder
+        elif option == 9:
+            print("[menu] Choosing a custom drill")
+            drillFiles = sorted(os.listdir(p.gmDrillsDir))
+            for i, drillFile in enumerate(drillFiles):
+                print("   > {}. {}".format(i + 1, drillFile))
+            try:
+                number = int(input("   > Enter the drill number : "))
+            except ValueError:
+                number = 0
+            if not 1 <= number <= len(drillFiles):
+                print("<Error> Please enter a valid drill number")
+            else:
+                # a malformed drill file must not close the menu
+                try:
+                    drillPath = os.path.join(p.gmDrillsDir, drillFiles[number - 1])
+                    gmScore, gmState, gmInfo = scriptDP.startDrill(drillPath, p.zoneRadius)
+                    recordScore(store, gmScore, gmState, gmInfo)
+                    print("[menu] {} with score : {}".format(gmInfo, gmScore))
+                except (IOError, ValueError, KeyError, TypeError) as error:
+                    print("<Error> The drill {} failed : {}".format(drillFiles[number - 1], error))
+
+        # Statistics of the session history
+        elif option == 10:
+            print("[menu] Session statistics")
+            sessionStore.displayStats(store)
+
+        # Remote control with the commands of the API server
+        elif option == 11:
+            print("[menu] Remote control, waiting for the commands on port {} (Ctrl+C to stop)".format(p.apiPort))
+            apiServer.startServer()
+            try:
+                while True:
+                    command = apiServer.nextCommand(timeout=0.5)
+                    if command is not None:
+                        runCommand(store, command)
+            except KeyboardInterrupt:
+                print("")
+                print("[menu] End of the remote control")
+
+        # Generated drills, one level up after a win and one level down after a loss
+        elif option == 12:
+            print("[menu] Generated drills ({} levels)".format(len(drillGenerator.LEVELS)))
+            try:
+                level = int(input("   > Enter the starting level ('Enter' for 1) : ") or 1)
+            except ValueError:
+                print("<Error> Please enter a valid level")
+                level = 0
+            while level > 0:
+                gmScore, gmState, gmInfo = scriptDP.startGeneratedDrill(level, p.zoneRadius)
+                if gmState == -1:
+                    break
+                recordScore(store, gmScore, gmState, gmInfo)
+                print("[menu] {} with score : {}".format(gmInfo, gmScore))
+                level = drillGenerator.nextLevel(level, gmState == 0)
+                if input("   > next drill at level {} ? ('Enter' to play, 'n' to stop) : ".format(level)) == "n":
+                    break
+
+        # Learning the colors of the balls with the camera
+        elif option == 13:
+            print("[menu] Learning the colors of the balls")
+            colorLearning.calibrate()
+
         print("")
 
-    if table != "":
-        print("[menu] Saving data...")
-        saveScoreToFile("gameSavedData.txt", table)
+    apiServer.stopServer()
+    frameBus.stopBus()
+    calibSnapshot.flush()
+    debugWriter.flush()
+    store.close()
     print("[menu] Goodbye !")
 
 
-def saveScoreToFile(filePath, table):
-    choice = input("   > do you want to save your score data ? (y/n) : ")
-    if choice == "y":
-        gmWinLose = [[0, 0], [0, 0], [0, 0]]
-        gmBestScore = [0, 0, 0]
-        with open(filePath, 'a+') as file:
-            # Move read cursor to the start of file.
-            file.seek(0)
-            # If file is not empty then append '\n'
-            data = file.read(100)
-            if len(data) > 0:
-                file.write("\n")
-            # Append text at the end of file
-            file.write("\n")
-            file.write("Score from {} ".format(datetime.datetime.now()))
-            file.write("\n")
-            file.write(table)
-        print("   > game data has been saved ! Search in the project file")
-    else:
-        print("   > game data has not been saved !")
+# FUNCTION to load the scores of the three games from the session history
+def loadScores(store):
+    """ FUNCTION to load the scores of the three games from the session history
+
+    Source : Mulnard T.
+
+    :param store: sqlite3 connection coming from sessionStore.openStore
+    :return: win and lose per game, best score per game, total score
+    """
+    winLose = [[0, 0], [0, 0], [0, 0]]
+    gmBestScore = [0, 0, 0]
+    totalScore = 0
+    for drillId, drillStats in sessionStore.getDrillStats(store).items():
+        totalScore += drillStats["totalScore"]
+        if 1 <= drillId <= 3:
+            winLose[drillId - 1] = [drillStats["wins"], drillStats["losses"]]
+            gmBestScore[drillId - 1] = drillStats["bestScore"]
+
+    return winLose, gmBestScore, totalScore
+
+
+# FUNCTION to save the last played drill in the session history
+def recordScore(store, gmScore, gmState, gmInfo):
+    """ FUNCTION to save the last played drill in the session history
+
+    Source : Mulnard T.
+
+    :param store: sqlite3 connection coming from sessionStore.openStore
+    :param gmScore: integer : score of the last played game
+    :param gmState: byte : game state of the last played game (-1 if error)
+    :param gmInfo: string : info if win or lose
+    """
+    if gmState != -1:
+        shot = scriptDP.lastShot
+        sessionStore.recordShot(store, shot["drill"], gmScore, gmState, gmInfo, shot["balls"], shot["timings"],
+                                shot["started"], shot["ended"])
+
+
+# FUNCTION to run a command received by the API server
+def runCommand(store, command):
+    """ FUNCTION to run a command received by the API server
+
+    Source : Mulnard T.
+
+    :param store: sqlite3 connection coming from sessionStore.openStore
+    :param command: dictionary : command and its arguments (see apiServer.COMMANDS)
+    """
+    print("[remote] command : {}".format(command))
+    try:
+        if command["command"] == "start_drill":
+            # only the drills of the menu : a number of the 3 games or a file listed in the drills folder
+            drills = {1: p.gm1Drill, 2: p.gm2Drill, 3: p.gm3Drill}
+            drills.update({drillFile: os.path.join(p.gmDrillsDir, drillFile)
+                           for drillFile in os.listdir(p.gmDrillsDir) if drillFile.endswith(".json")})
+            if not isinstance(command["drill"], (int, str)) or command["drill"] not in drills:
+                raise ValueError("unknown drill '{}', accepted drills are 1, 2, 3 or a file of {}".format(
+                    command["drill"], p.gmDrillsDir))
+            drillPath = drills[command["drill"]]
+            gmScore, gmState, gmInfo = scriptDP.startDrill(drillPath, p.zoneRadius)
+            recordScore(store, gmScore, gmState, gmInfo)
+            print("[remote] {} with score : {}".format(gmInfo, gmScore))
+
+        elif command["command"] == "recalibrate":
+            scriptDP.setKstMatrix()
+
+        elif command["command"] == "set_radius":
+            p.zoneRadius = int(command["radius"])
+            print("[remote] finish zone radius set to {}".format(p.zoneRadius))
+        apiServer.publish("command", {"command": command, "done": True})
+
+    except (IOError, ValueError, KeyError, TypeError) as error:
+        print("<Error> The command failed : {}".format(error))
+        apiServer.publish("command", {"command": command, "done": False, "error": str(error)})
 
 
 menuInTerminal()